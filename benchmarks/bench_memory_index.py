@@ -0,0 +1,73 @@
+# benchmarks/bench_memory_index.py
+
+"""
+Recall vs. latency for the memory index kinds in memory/index.build_index.
+
+Uses synthetic clustered, normalized vectors (the same shape as all-MiniLM-L6-v2
+embeddings) so it runs without the embedding model:
+
+    python -m benchmarks.bench_memory_index --sizes 1000 5000 20000 --queries 200
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+# Ensure root directory is in path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from memory.index import build_index, ANN_INDEX_KINDS
+
+def make_vectors(n: int, dim: int, clusters: int, rng) -> np.ndarray:
+    centers = rng.standard_normal((clusters, dim)).astype("float32")
+    labels = rng.integers(0, clusters, size=n)
+    vectors = centers[labels] + 0.35 * rng.standard_normal((n, dim)).astype("float32")
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+def run(sizes: list[int], dim: int, n_queries: int, k: int, kinds: list[str]):
+    rng = np.random.default_rng(42)
+    print(f"{'chunks':>8} {'index':>7} {'build ms':>10} {'p50 ms':>8} {'p95 ms':>8} {'recall@' + str(k):>10} {'MB':>8}")
+
+    for n in sizes:
+        vectors = make_vectors(n, dim, clusters=max(8, n // 200), rng=rng)
+        queries = vectors[rng.integers(0, n, size=n_queries)] + 0.05 * rng.standard_normal((n_queries, dim)).astype("float32")
+
+        exact = build_index("flat", dim)
+        exact.add(vectors)
+        _, truth = exact.search(queries, k)
+
+        for kind in kinds:
+            start = time.perf_counter()
+            index = build_index(kind, dim, training_vectors=vectors)
+            index.add(vectors)
+            build_ms = (time.perf_counter() - start) * 1000
+
+            latencies, found = [], []
+            for q in queries:
+                start = time.perf_counter()
+                _, ids = index.search(q.reshape(1, -1), k)
+                latencies.append((time.perf_counter() - start) * 1000)
+                found.append(ids[0])
+
+            recall = np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])
+            size_mb = _index_size_mb(index)
+            print(f"{n:>8} {kind:>7} {build_ms:>10.1f} {np.percentile(latencies, 50):>8.3f} "
+                  f"{np.percentile(latencies, 95):>8.3f} {recall:>10.3f} {size_mb:>8.1f}")
+
+def _index_size_mb(index) -> float:
+    import faiss
+    return faiss.serialize_index(index).nbytes / (1024 * 1024)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 20000])
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=8)
+    parser.add_argument("--kinds", nargs="+", default=list(ANN_INDEX_KINDS), choices=ANN_INDEX_KINDS)
+    args = parser.parse_args()
+    run(args.sizes, args.dim, args.queries, args.k, args.kinds)
@@ -0,0 +1,125 @@
+# benchmarks/bench_session_lookups.py
+
+"""
+Cost of the per-session lookups (world_tools handlers, prompt builder, game loop) as
+campaigns accumulate in one database, with and without the indexes from db/schema.py:
+
+    python -m benchmarks.bench_session_lookups --campaigns 1 10 100 1000 --queries 500
+
+With the indexes the per-lookup time should stay flat as the database grows; without
+them it grows with the total row count across all campaigns.
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# Ensure root directory is in path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from sqlalchemy import create_engine, desc
+from sqlalchemy.orm import sessionmaker
+from db import engine as db_engine
+from db.schema import Base, Session, NPC, Quest, WorldFlag, Turn, ConversationContext, JournalEntry
+
+def make_engine(path: str, indexed: bool):
+    # Same connection profile (WAL, cache, mmap) as the game uses.
+    engine = db_engine.apply_sqlite_pragmas(create_engine(f"sqlite:///{path}", echo=False))
+    Base.metadata.create_all(engine)
+    if not indexed:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.drop(engine)
+    return engine
+
+def add_campaigns(engine, first_id: int, count: int, npcs: int, turns: int, flags: int, quests: int):
+    now = datetime.utcnow()
+    rows = {table: [] for table in (Session, NPC, Quest, WorldFlag, Turn, ConversationContext, JournalEntry)}
+    for session_id in range(first_id, first_id + count):
+        rows[Session].append({"id": session_id, "genre": "Fantasy", "tone": "Grim", "realism": True})
+        for i in range(npcs):
+            npc_id = session_id * npcs + i
+            rows[NPC].append({"id": npc_id, "session_id": session_id, "name": f"NPC {i}", "status": "active", "power_level": 15})
+            rows[ConversationContext].append({"session_id": session_id, "npc_id": npc_id, "last_topic": "weather",
+                                              "last_updated": now - timedelta(minutes=i)})
+        for i in range(quests):
+            rows[Quest].append({"session_id": session_id, "name": f"Quest {i}", "status": "active"})
+        for i in range(flags):
+            rows[WorldFlag].append({"session_id": session_id, "key": f"flag_{i}", "value": "true"})
+        for i in range(1, turns + 1):
+            rows[Turn].append({"session_id": session_id, "turn_number": i, "player_input": "I look around.",
+                               "gm_response": "The room is quiet.", "timestamp": now})
+            if i % 5 == 0:
+                rows[JournalEntry].append({"session_id": session_id, "turn_number": i, "entry_text": "Things happened."})
+    with engine.begin() as conn:
+        for model, values in rows.items():
+            if values:
+                conn.execute(model.__table__.insert(), values)
+
+def lookups(db, session_id: int, rng, npcs: int, turns: int, flags: int, quests: int) -> dict:
+    """
+    One of each hot query, as the application runs it. Returns {name: seconds}.
+    """
+    npc_id = session_id * npcs + rng.randrange(npcs)
+    queries = {
+        "npc by name": lambda: db.query(NPC).filter_by(session_id=session_id, name=f"NPC {rng.randrange(npcs)}").first(),
+        "quest by name": lambda: db.query(Quest).filter_by(session_id=session_id, name=f"Quest {rng.randrange(quests)}").first(),
+        "flag by key": lambda: db.query(WorldFlag).filter_by(session_id=session_id, key=f"flag_{rng.randrange(flags)}").first(),
+        "context by npc": lambda: db.query(ConversationContext).filter_by(session_id=session_id, npc_id=npc_id).first(),
+        "turn by number": lambda: db.query(Turn).filter_by(session_id=session_id, turn_number=rng.randrange(1, turns + 1)).first(),
+        "turn count": lambda: db.query(Turn).filter_by(session_id=session_id).count(),
+        "recent turns": lambda: db.query(Turn).filter_by(session_id=session_id).order_by(desc(Turn.turn_number)).limit(3).all(),
+        "recent journal": lambda: db.query(JournalEntry).filter_by(session_id=session_id).order_by(desc(JournalEntry.turn_number)).limit(5).all(),
+    }
+    timings = {}
+    for name, query in queries.items():
+        start = time.perf_counter()
+        query()
+        timings[name] = time.perf_counter() - start
+    return timings
+
+def run(campaign_counts: list[int], n_queries: int, npcs: int, turns: int, flags: int, quests: int):
+    work_dir = tempfile.mkdtemp(prefix="gm-lookups-")
+    engines = {
+        "indexed": make_engine(os.path.join(work_dir, "indexed.db"), indexed=True),
+        "unindexed": make_engine(os.path.join(work_dir, "unindexed.db"), indexed=False),
+    }
+    rng = random.Random(42)
+    loaded = 0
+    header_printed = False
+
+    for campaigns in sorted(campaign_counts):
+        for engine in engines.values():
+            add_campaigns(engine, loaded + 1, campaigns - loaded, npcs, turns, flags, quests)
+        loaded = campaigns
+
+        for label, engine in engines.items():
+            db = sessionmaker(bind=engine)()
+            totals = {}
+            for _ in range(n_queries):
+                for name, seconds in lookups(db, rng.randint(1, loaded), rng, npcs, turns, flags, quests).items():
+                    totals[name] = totals.get(name, 0.0) + seconds
+                db.expunge_all()
+            db.close()
+
+            if not header_printed:
+                print(f"{'campaigns':>9} {'rows':>9} {'schema':>10} " + " ".join(f"{name:>15}" for name in totals) + "   (us per lookup)")
+                header_printed = True
+            rows = loaded * (npcs * 2 + turns + turns // 5 + flags + quests)
+            print(f"{loaded:>9} {rows:>9} {label:>10} " + " ".join(f"{seconds / n_queries * 1e6:>15.1f}" for seconds in totals.values()))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-session lookup cost as campaigns accumulate.")
+    parser.add_argument("--campaigns", type=int, nargs="+", default=[1, 10, 100, 500])
+    parser.add_argument("--queries", type=int, default=300, help="Rounds of lookups per measurement.")
+    parser.add_argument("--npcs", type=int, default=40)
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--flags", type=int, default=30)
+    parser.add_argument("--quests", type=int, default=10)
+    args = parser.parse_args()
+    run(args.campaigns, args.queries, args.npcs, args.turns, args.flags, args.quests)
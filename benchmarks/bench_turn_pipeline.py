@@ -0,0 +1,243 @@
+# benchmarks/bench_turn_pipeline.py
+
+"""
+Replays a campaign export through run_game_turn, run_simulation_pass and
+evaluate_player_growth with offline LLM backends (see gpt_interface/backends.py and
+gemini_interface/backends.py), and reports turns/sec, DB query counts and memory growth:
+
+    python -m benchmarks.bench_turn_pipeline --campaign campaign_export_1.txt --latency-ms 0
+    python -m benchmarks.bench_turn_pipeline --backend recorded --recordings llm_recordings.jsonl
+    python -m benchmarks.bench_turn_pipeline --save baseline.json
+    python -m benchmarks.bench_turn_pipeline --baseline baseline.json --max-regression 0.2
+
+Each run uses a fresh SQLite database and memory store in a temporary directory. The
+embedding model is the real one. With --baseline the exit status is 1 if turns/sec or
+DB queries per turn regressed by more than --max-regression.
+"""
+
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+# Ensure root directory is in path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+# The pipeline reads these at import time, so they are set before importing it.
+WORK_DIR = tempfile.mkdtemp(prefix="gm-bench-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(WORK_DIR, 'bench.db')}"
+os.environ["MEMORY_DIR"] = os.path.join(WORK_DIR, "memory_store")
+os.environ.setdefault("EMBEDDING_CACHE_PATH", os.path.join(WORK_DIR, "embedding_cache.db"))
+os.environ.setdefault("LLM_CACHE_PATH", os.path.join(WORK_DIR, "llm_cache.db"))
+
+from sqlalchemy import event
+
+import game_loop
+from db.engine import get_engine, get_session
+from db.schema import Base, Session, PlayerState, NPC
+from gemini_interface import backends as gemini_backends
+from gpt_interface import backends as gpt_backends
+from memory.ingest import wait_for_ingestion
+from utils.llm_replay import SyntheticTiming
+from utils.progression import evaluate_player_growth
+from utils.simulation import run_simulation_pass
+
+# What the synthetic logic engine / simulation / progression calls do to the world.
+CANNED_TOOL_CALLS = [
+    {"name": "set_world_flag", "args": {"key": "bench_event", "value": "true", "reason": "benchmark"}},
+    {"name": "create_rumor", "args": {"rumor_content": "Strange lights were seen over the barrow.", "is_confirmed": False}},
+]
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+def rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def dir_mb(path: str) -> float:
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total / (1024 * 1024)
+
+def install_backends(args):
+    timing = SyntheticTiming(args.latency_ms, args.jitter_ms, args.chunk_ms)
+    chat = gpt_backends.SyntheticChatBackend(timing=timing)
+    gemini = gemini_backends.SyntheticGeminiBackend(tool_calls=CANNED_TOOL_CALLS, timing=timing)
+    if args.backend == "recorded":
+        chat = gpt_backends.RecordedChatBackend(args.recordings, fallback=chat, replay_latency=args.replay_latency)
+        gemini = gemini_backends.RecordedGeminiBackend(args.recordings, fallback=gemini, replay_latency=args.replay_latency)
+    gpt_backends.set_backend(chat)
+    gemini_backends.set_backend(gemini)
+    return chat, gemini
+
+def seed_session(db, campaign: dict, extra_npcs: int) -> int:
+    config = campaign.get("session") or {}
+    session = Session(
+        genre=config.get("genre", "Fantasy"),
+        tone=config.get("tone", "Neutral"),
+        world_intro="",
+        realism=True,
+    )
+    db.add(session)
+    db.flush()
+
+    player = campaign.get("player_state")
+    if player:
+        db.add(PlayerState(
+            session_id=session.id,
+            name=player.get("name"),
+            character_class=player.get("class"),
+            backstory=player.get("backstory"),
+            attributes=player.get("attributes"),
+            skills=player.get("skills"),
+            inventory=player.get("inventory"),
+            limitations=player.get("limitations"),
+        ))
+
+    npcs = campaign.get("npcs") or []
+    for npc in npcs:
+        db.add(NPC(session_id=session.id, **{k: npc.get(k) for k in ("name", "role", "status", "power_level", "combat_style", "motivation")}))
+    # Exports without NPCs would leave the simulation pass with nothing to do.
+    for i in range(extra_npcs if not npcs else 0):
+        db.add(NPC(session_id=session.id, name=f"Bench NPC {i + 1}", role="Villager", status="active",
+                   power_level=15 + i, motivation="Keep the village safe."))
+    db.commit()
+    return session.id
+
+def timed(phases: dict, name: str, counter: QueryCounter, func, *args):
+    queries_before = counter.count
+    start = time.perf_counter()
+    result = func(*args)
+    phase = phases.setdefault(name, {"durations_ms": [], "queries": 0})
+    phase["durations_ms"].append((time.perf_counter() - start) * 1000)
+    phase["queries"] += counter.count - queries_before
+    return result
+
+def run(args) -> dict:
+    with open(args.campaign, encoding="utf-8") as f:
+        campaign = json.load(f)
+    inputs = [t["player_input"] for t in campaign.get("turns", [])] * args.repeat
+    if not inputs:
+        raise SystemExit(f"No turns to replay in {args.campaign}.")
+
+    chat, gemini = install_backends(args)
+    engine = get_engine()
+    Base.metadata.create_all(engine)
+    counter = QueryCounter(engine)
+    # Simulation and progression are timed here instead of running as background jobs.
+    game_loop.SIMULATION_TURN_THRESHOLD = len(inputs) + 1
+
+    db = get_session()
+    session_id = seed_session(db, campaign, args.npcs)
+
+    tracemalloc.start()
+    rss_before = rss_mb()
+    phases = {}
+    start = time.perf_counter()
+    for turn_number, player_input in enumerate(inputs, start=1):
+        timed(phases, "run_game_turn", counter, game_loop.run_game_turn, db, session_id, player_input)
+        if args.sim_every and turn_number % args.sim_every == 0:
+            timed(phases, "run_simulation_pass", counter, run_simulation_pass, db, session_id)
+            timed(phases, "evaluate_player_growth", counter, evaluate_player_growth, db, session_id)
+    wait_for_ingestion(session_id)
+    elapsed = time.perf_counter() - start
+    traced_now, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    db.close()
+
+    results = {
+        "campaign": args.campaign,
+        "backend": args.backend,
+        "turns": len(inputs),
+        "elapsed_s": elapsed,
+        "turns_per_sec": len(inputs) / elapsed,
+        "db_queries": sum(p["queries"] for p in phases.values()),
+        "db_queries_per_turn": phases["run_game_turn"]["queries"] / len(inputs),
+        "memory": {
+            "python_heap_growth_mb": traced_now / (1024 * 1024),
+            "python_heap_peak_mb": traced_peak / (1024 * 1024),
+            "rss_growth_mb": rss_mb() - rss_before,
+            "memory_store_mb": dir_mb(os.environ["MEMORY_DIR"]),
+        },
+        "recorded_misses": getattr(chat, "misses", 0) + getattr(gemini, "misses", 0),
+        "phases": {},
+    }
+    for name, phase in phases.items():
+        durations = np.array(phase["durations_ms"])
+        results["phases"][name] = {
+            "calls": len(durations),
+            "p50_ms": float(np.percentile(durations, 50)),
+            "p95_ms": float(np.percentile(durations, 95)),
+            "queries_per_call": phase["queries"] / len(durations),
+        }
+    return results
+
+def print_results(results: dict):
+    print(f"\n{'phase':<24} {'calls':>6} {'p50 ms':>9} {'p95 ms':>9} {'queries/call':>13}")
+    for name, phase in results["phases"].items():
+        print(f"{name:<24} {phase['calls']:>6} {phase['p50_ms']:>9.1f} {phase['p95_ms']:>9.1f} {phase['queries_per_call']:>13.1f}")
+    memory = results["memory"]
+    print(
+        f"\n{results['turns']} turns in {results['elapsed_s']:.2f}s: {results['turns_per_sec']:.2f} turns/sec, "
+        f"{results['db_queries']} DB queries ({results['db_queries_per_turn']:.1f} per turn)"
+    )
+    print(
+        f"Memory: Python heap +{memory['python_heap_growth_mb']:.1f} MB (peak {memory['python_heap_peak_mb']:.1f} MB), "
+        f"RSS +{memory['rss_growth_mb']:.1f} MB, memory store {memory['memory_store_mb']:.2f} MB"
+    )
+    if results["backend"] == "recorded":
+        print(f"Requests not found in the recordings (answered synthetically): {results['recorded_misses']}")
+
+def check_regressions(results: dict, baseline: dict, max_regression: float) -> list[str]:
+    problems = []
+    if results["turns_per_sec"] < baseline["turns_per_sec"] * (1 - max_regression):
+        problems.append(f"turns/sec {results['turns_per_sec']:.2f} vs baseline {baseline['turns_per_sec']:.2f}")
+    if results["db_queries_per_turn"] > baseline["db_queries_per_turn"] * (1 + max_regression):
+        problems.append(f"DB queries/turn {results['db_queries_per_turn']:.1f} vs baseline {baseline['db_queries_per_turn']:.1f}")
+    return problems
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmark of the turn pipeline.")
+    parser.add_argument("--campaign", default="campaign_export_1.txt", help="Campaign export to replay (export_db.py format).")
+    parser.add_argument("--repeat", type=int, default=1, help="Replay the campaign's turns this many times.")
+    parser.add_argument("--backend", choices=("synthetic", "recorded"), default="synthetic")
+    parser.add_argument("--recordings", default=None, help="Recordings file for --backend recorded (default: LLM_RECORDINGS_PATH).")
+    parser.add_argument("--replay-latency", action="store_true", help="Sleep for the recorded response times.")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Synthetic time to first token.")
+    parser.add_argument("--jitter-ms", type=float, default=10.0)
+    parser.add_argument("--chunk-ms", type=float, default=1.0, help="Synthetic delay between streamed words.")
+    parser.add_argument("--sim-every", type=int, default=game_loop.SIMULATION_TURN_THRESHOLD,
+                        help="Run the simulation and progression passes every N turns (0 = never).")
+    parser.add_argument("--npcs", type=int, default=5, help="NPCs to create when the export has none.")
+    parser.add_argument("--save", default=None, help="Write the results as JSON.")
+    parser.add_argument("--baseline", default=None, help="Compare against results saved with --save.")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = run(args)
+    print_results(results)
+    print(f"(work dir: {WORK_DIR})")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            problems = check_regressions(results, json.load(f), args.max_regression)
+        for problem in problems:
+            print(f"REGRESSION: {problem}")
+        sys.exit(1 if problems else 0)
@@ -1,15 +1,108 @@
 # db/engine.py
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import os
+from contextlib import contextmanager
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker, Session
+from utils.tracing import instrument_engine
 
-DATABASE_URL = "sqlite:///game_master.db"
+# DB_PATH is the SQLite file (the same variable init_db has always read); DATABASE_URL,
+# if set, overrides it with a full SQLAlchemy URL.
+DB_PATH = os.getenv("DB_PATH", "game_master.db")
+DATABASE_URL = os.getenv("DATABASE_URL", f"sqlite:///{DB_PATH}")
 
-_engine = create_engine(DATABASE_URL, echo=False, future=True)
+# --- SQLite connection profile ---
+# WAL lets readers (background jobs, the memory rebuild, the UI) keep reading while a turn
+# writes, and synchronous=NORMAL is durable enough in WAL mode at far fewer fsyncs.
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", str(64 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+def apply_sqlite_pragmas(engine):
+    """
+    Applies the connection profile above to every new connection.
+    """
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+            cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+            cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+            # Negative values are in KiB rather than pages.
+            cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+            cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        finally:
+            cursor.close()
+
+    return engine
+
+# Statements that open a transaction (with BEGIN IMMEDIATE) when none is open yet.
+_WRITE_STATEMENTS = ("INSERT", "UPDATE", "DELETE", "REPLACE", "CREATE", "DROP", "ALTER", "SAVEPOINT")
+
+def enable_savepoints(engine):
+    """
+    pysqlite manages transactions on its own and skips BEGIN before SAVEPOINT, which makes
+    nested transactions commit immediately. Take over from it, but keep its laziness:
+    reads run in autocommit, and the first write of a transaction issues BEGIN IMMEDIATE.
+
+    A BEGIN on every SQLAlchemy transaction would turn the first read into a WAL snapshot
+    held until commit, and a later write from it fails at once ("database is locked",
+    regardless of busy_timeout) if another connection committed in the meantime. A turn
+    reads its prompt, streams for seconds, and only then writes. BEGIN IMMEDIATE takes
+    the write lock up front, so it waits out busy_timeout instead.
+    """
+    @event.listens_for(engine, "connect")
+    def _disable_pysqlite_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _begin_before_write(conn, cursor, statement, parameters, context, executemany):
+        if cursor.connection.in_transaction:
+            return
+        words = statement.lstrip().split(None, 1)
+        if words and words[0].upper() in _WRITE_STATEMENTS:
+            cursor.execute("BEGIN IMMEDIATE")
+
+    return engine
+
+def make_engine(url: str = None):
+    """
+    Creates an engine with the app's SQLite profile: pragmas, working savepoints and tracing.
+    """
+    engine = create_engine(url or DATABASE_URL, echo=False, future=True)
+    return instrument_engine(enable_savepoints(apply_sqlite_pragmas(engine)))
+
+_engine = make_engine()
+
+# The one session factory; use it (or get_session) instead of building new sessionmakers.
+SessionLocal = sessionmaker(bind=_engine)
 
 def get_engine():
     return _engine
 
 def get_session():
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=_engine)
     return SessionLocal()
+
+@contextmanager
+def atomic_session(bind=None):
+    """
+    Yields a session whose commit() calls only release savepoints inside one outer
+    transaction. Everything done in the block is committed together when it exits
+    cleanly, and rolled back together if it raises.
+    """
+    connection = (bind or _engine).connect()
+    transaction = connection.begin()
+    session = Session(bind=connection, join_transaction_mode="create_savepoint", autoflush=False)
+    try:
+        yield session
+        session.flush()
+        transaction.commit()
+    except Exception:
+        transaction.rollback()
+        raise
+    finally:
+        session.close()
+        connection.close()
@@ -1,6 +1,5 @@
 # db/init_db.py
 
-import os
 import sys
 from pathlib import Path
 
@@ -8,14 +7,15 @@ from pathlib import Path
 sys.path.append(str(Path(__file__).resolve().parent.parent))
 
 from db.schema import Base
-from sqlalchemy import create_engine
-
-DB_PATH = os.getenv("DB_PATH", "game_master.db")
+from db.migrations import run_migrations
+from db.engine import DATABASE_URL, get_engine
 
 def init_database():
-    engine = create_engine(f"sqlite:///{DB_PATH}", echo=False)
+    engine = get_engine()
     Base.metadata.create_all(engine)
-    print(f"Database initialized at: {DB_PATH}")
+    # create_all skips tables that already exist; older databases are brought up to date here.
+    run_migrations(engine)
+    print(f"Database initialized at: {DATABASE_URL}")
 
 if __name__ == "__main__":
     init_database()
@@ -0,0 +1,151 @@
+# db/migrate_indexes.py
+
+"""
+Brings an existing database up to the indexes declared in db/schema.py.
+
+create_all only creates missing tables, so databases made before the per-session
+indexes need this once. Rows that would break the new unique indexes are merged first:
+  - npcs, quests, world_flags, conversation_contexts: the lowest id is kept, since it is
+    the row the world_tools handlers' .first() lookups have been reading and updating.
+    Conversation contexts of a removed duplicate NPC move to the kept one, unless it
+    already has its own.
+  - turns: a session with repeated turn numbers is renumbered in (turn_number, id)
+    order, so no turn is lost. Its persisted memories are deleted, to be rebuilt from
+    the renumbered turns.
+
+Applied as migration 2 by db/migrations.py; can also be run on its own:
+
+    python db/migrate_indexes.py
+"""
+
+import sys
+from pathlib import Path
+
+# Ensure root directory is in path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from sqlalchemy import inspect, text
+from db.schema import Base
+
+# table -> the columns of its unique natural key
+UNIQUE_KEYS = {
+    "npcs": ("session_id", "name"),
+    "quests": ("session_id", "name"),
+    "world_flags": ("session_id", "key"),
+    "conversation_contexts": ("session_id", "npc_id"),
+}
+
+def _delete_duplicates(conn, table: str, columns: tuple) -> int:
+    not_null = " AND ".join(f"{c} IS NOT NULL" for c in columns)
+    group_by = ", ".join(columns)
+    result = conn.execute(text(
+        f"DELETE FROM {table} WHERE {not_null} "
+        f"AND id NOT IN (SELECT MIN(id) FROM {table} GROUP BY {group_by})"
+    ))
+    return result.rowcount
+
+def _merge_duplicate_npcs(conn) -> int:
+    """
+    Moves conversation contexts off NPCs that are about to be removed as duplicates.
+    A context is dropped instead if the kept NPC already has one in that session.
+    """
+    duplicates = dict(conn.execute(text("""
+        SELECT dup.id, MIN(keep.id) FROM npcs AS dup
+        JOIN npcs AS keep ON keep.session_id = dup.session_id AND keep.name = dup.name
+        WHERE dup.name IS NOT NULL
+        GROUP BY dup.id
+        HAVING dup.id != MIN(keep.id)
+    """)).all())
+    if not duplicates:
+        return 0
+
+    contexts = conn.execute(text(
+        "SELECT id, session_id, npc_id FROM conversation_contexts ORDER BY id"
+    )).all()
+    claimed = {(session_id, npc_id) for _, session_id, npc_id in contexts if npc_id not in duplicates}
+    moved = 0
+    for context_id, session_id, npc_id in contexts:
+        if npc_id not in duplicates:
+            continue
+        keep_id = duplicates[npc_id]
+        if (session_id, keep_id) in claimed:
+            conn.execute(text("DELETE FROM conversation_contexts WHERE id = :id"), {"id": context_id})
+        else:
+            conn.execute(text("UPDATE conversation_contexts SET npc_id = :npc_id WHERE id = :id"), {"npc_id": keep_id, "id": context_id})
+            claimed.add((session_id, keep_id))
+            moved += 1
+    return moved
+
+def _renumber_duplicate_turns(conn) -> list:
+    """
+    Renumbers the turns of every session with repeated turn numbers. Returns those sessions.
+    """
+    sessions = conn.execute(text(
+        "SELECT DISTINCT session_id FROM turns "
+        "GROUP BY session_id, turn_number HAVING COUNT(*) > 1"
+    )).scalars().all()
+    for session_id in sessions:
+        turn_ids = conn.execute(text(
+            "SELECT id FROM turns WHERE session_id = :session_id ORDER BY turn_number, id"
+        ), {"session_id": session_id}).scalars().all()
+        conn.execute(
+            text("UPDATE turns SET turn_number = :turn_number WHERE id = :id"),
+            [{"turn_number": i, "id": turn_id} for i, turn_id in enumerate(turn_ids, start=1)]
+        )
+    return sessions
+
+def migrate_indexes(engine) -> dict:
+    """
+    Removes rows that violate the unique keys, then creates every index from db/schema.py
+    that the database is missing. Runs in one transaction. Returns what was changed.
+    """
+    report = {"contexts_repointed": 0, "duplicates_removed": {}, "sessions_renumbered": 0, "indexes_created": []}
+    renumbered = []
+    with engine.begin() as conn:
+        existing_tables = set(inspect(conn).get_table_names())
+
+        if {"npcs", "conversation_contexts"} <= existing_tables:
+            report["contexts_repointed"] = _merge_duplicate_npcs(conn)
+        for table, columns in UNIQUE_KEYS.items():
+            if table in existing_tables:
+                removed = _delete_duplicates(conn, table, columns)
+                if removed:
+                    report["duplicates_removed"][table] = removed
+        if "turns" in existing_tables:
+            renumbered = _renumber_duplicate_turns(conn)
+            report["sessions_renumbered"] = len(renumbered)
+
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing_indexes = {ix["name"] for ix in inspect(conn).get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(conn)
+                    report["indexes_created"].append(index.name)
+
+    if renumbered:
+        # Their persisted memories still carry the old turn numbers, which recency ranking
+        # and the add_chunks dedupe go by. Without the files, the next retrieval rebuilds
+        # them from the renumbered turns. Imported here so databases that need no
+        # renumbering don't load the memory package.
+        from memory.index import delete_session_memory
+        for session_id in renumbered:
+            delete_session_memory(session_id)
+    return report
+
+def print_report(report: dict):
+    if report["contexts_repointed"]:
+        print(f"Moved {report['contexts_repointed']} conversation context(s) off duplicate NPCs.")
+    for table, removed in report["duplicates_removed"].items():
+        print(f"Removed {removed} duplicate row(s) from {table}.")
+    if report["sessions_renumbered"]:
+        print(f"Renumbered the turns of {report['sessions_renumbered']} session(s) with repeated turn numbers.")
+    if report["indexes_created"]:
+        print(f"Created indexes: {', '.join(report['indexes_created'])}")
+    else:
+        print("All indexes already present.")
+
+if __name__ == "__main__":
+    from db.engine import get_engine
+    print_report(migrate_indexes(get_engine()))
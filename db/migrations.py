@@ -0,0 +1,193 @@
+# db/migrations.py
+
+"""
+Versioned schema migrations for game_master.db.
+
+create_all only creates missing tables, so every other schema change goes here as a
+numbered migration. A migration is a function taking the engine; MIGRATIONS lists them
+in order and the schema_version table records which ones a database has had.
+A migration can be interrupted part-way (crash, closed launcher), so each must be safe
+to run again: check before you ALTER, and move data with backfill_in_batches, which
+commits every batch so the game can keep writing while a large table is converted.
+
+    python db/migrations.py            # apply pending migrations
+    python db/migrations.py --status
+
+The launcher calls start_migrations() at start-up, which upgrades on a background
+thread; code that writes calls wait_for_migrations() first.
+"""
+
+import argparse
+import sqlite3
+import sys
+import threading
+import traceback
+from datetime import datetime
+from pathlib import Path
+
+# Ensure root directory is in path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from sqlalchemy import bindparam, inspect, text
+from db.schema import Base
+from db.migrate_indexes import migrate_indexes, print_report
+
+BACKFILL_BATCH_SIZE = 500
+
+# --- Helpers for migrations ---
+
+def column_exists(engine, table: str, column: str) -> bool:
+    inspector = inspect(engine)
+    return inspector.has_table(table) and any(c["name"] == column for c in inspector.get_columns(table))
+
+def backfill_in_batches(engine, select_ids_sql: str, update_sql: str, batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+    """
+    Repeatedly selects up to :limit ids with select_ids_sql and runs update_sql for them
+    (bound as the expanding :ids parameter), one transaction per batch. select_ids_sql
+    must stop returning rows that have been updated. Returns the number of rows updated.
+    """
+    update = text(update_sql).bindparams(bindparam("ids", expanding=True))
+    total = 0
+    while True:
+        with engine.begin() as conn:
+            ids = conn.execute(text(select_ids_sql), {"limit": batch_size}).scalars().all()
+            if not ids:
+                return total
+            conn.execute(update, {"ids": ids})
+        total += len(ids)
+        _set_status(progress=f"{total} rows")
+
+# --- Migrations ---
+
+def _create_missing_tables(engine):
+    Base.metadata.create_all(engine)
+
+def _per_session_indexes(engine):
+    print_report(migrate_indexes(engine))
+
+def _merge_turn_prompt_columns(engine):
+    # turns.prompt_used was never written by the game loop; prompt_snapshot is the one kept.
+    if not column_exists(engine, "turns", "prompt_used"):
+        return
+    backfill_in_batches(
+        engine,
+        "SELECT id FROM turns WHERE prompt_snapshot IS NULL AND prompt_used IS NOT NULL LIMIT :limit",
+        "UPDATE turns SET prompt_snapshot = prompt_used WHERE id IN :ids",
+    )
+    if sqlite3.sqlite_version_info < (3, 35, 0):
+        print(f"SQLite {sqlite3.sqlite_version} can't drop columns; leaving the unused turns.prompt_used in place.")
+        return
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE turns DROP COLUMN prompt_used"))
+
+MIGRATIONS = [
+    (1, "create_missing_tables", _create_missing_tables),
+    (2, "per_session_indexes", _per_session_indexes),
+    (3, "merge_turn_prompt_columns", _merge_turn_prompt_columns),
+]
+
+# --- Runner ---
+
+def _ensure_version_table(engine):
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_version ("
+            "version INTEGER PRIMARY KEY, name TEXT NOT NULL, applied_at DATETIME NOT NULL)"
+        ))
+
+def get_applied_versions(engine) -> dict:
+    """
+    Returns {version: applied_at} for the migrations the database has had.
+    """
+    _ensure_version_table(engine)
+    with engine.connect() as conn:
+        return dict(conn.execute(text("SELECT version, applied_at FROM schema_version")).all())
+
+def run_migrations(engine=None) -> list[str]:
+    """
+    Applies the pending migrations in order. Returns the names of those applied.
+    """
+    if engine is None:
+        from db.engine import get_engine
+        engine = get_engine()
+
+    applied = get_applied_versions(engine)
+    done = []
+    for version, name, migrate in MIGRATIONS:
+        if version in applied:
+            continue
+        print(f"Applying migration {version}: {name}...")
+        _set_status(current=name, progress=None)
+        migrate(engine)
+        with engine.begin() as conn:
+            conn.execute(
+                text("INSERT OR IGNORE INTO schema_version (version, name, applied_at) VALUES (:version, :name, :applied_at)"),
+                {"version": version, "name": name, "applied_at": datetime.utcnow()}
+            )
+        done.append(name)
+    if done:
+        print(f"Database upgraded: {', '.join(done)}")
+    return done
+
+# --- Background start-up ---
+
+_status = {"state": "idle", "current": None, "progress": None, "applied": [], "error": None}
+_status_lock = threading.Lock()
+_thread = None
+_finished = threading.Event()
+
+def _set_status(**changes):
+    with _status_lock:
+        _status.update(changes)
+
+def _run_in_background(engine):
+    try:
+        applied = run_migrations(engine)
+        _set_status(state="done", current=None, progress=None, applied=applied)
+    except Exception as e:
+        _set_status(state="failed", error=str(e))
+        print("--- DATABASE MIGRATION FAILED ---")
+        print(traceback.format_exc())
+    finally:
+        _finished.set()
+
+def start_migrations(engine=None):
+    """
+    Applies pending migrations on a background thread. Only the first call per process
+    starts anything.
+    """
+    global _thread
+    with _status_lock:
+        if _thread is not None:
+            return
+        _status["state"] = "running"
+        _thread = threading.Thread(target=_run_in_background, args=(engine,), name="gm-migrations", daemon=True)
+    _thread.start()
+
+def wait_for_migrations(timeout: float = None) -> bool:
+    """
+    Blocks until the background upgrade (if one was started) has finished, successfully
+    or not. Returns False if the timeout expired first.
+    """
+    if _thread is None:
+        return True
+    return _finished.wait(timeout)
+
+def get_migration_status() -> dict:
+    with _status_lock:
+        return dict(_status)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply or list schema migrations.")
+    parser.add_argument("--status", action="store_true", help="List applied and pending migrations.")
+    args = parser.parse_args()
+
+    from db.engine import get_engine
+    engine = get_engine()
+    if args.status:
+        applied = get_applied_versions(engine)
+        for version, name, _ in MIGRATIONS:
+            state = f"applied {applied[version]}" if version in applied else "pending"
+            print(f"{version:>4}  {name:<32} {state}")
+    elif not run_migrations(engine):
+        print("Database is up to date.")
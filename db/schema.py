@@ -2,7 +2,7 @@
 
 from sqlalchemy import (
     create_engine, Column, Integer, String, Boolean,
-    Text, DateTime, ForeignKey
+    Text, DateTime, ForeignKey, Float, Index
 )
 from sqlalchemy import Column, Integer, String, Boolean, Text, ForeignKey, JSON
 
@@ -12,6 +12,10 @@ from datetime import datetime
 
 Base = declarative_base()
 
+# Every hot lookup is per session, so each table is indexed on session_id first. Unique
+# indexes double as the constraints for the natural keys the world_tools handlers look up.
+# Existing databases get them from migration 2 in db/migrations.py.
+
 # --- Core Tables ---
 
 class Session(Base):
@@ -44,6 +48,10 @@ class NPC(Base):
     emotional_state = Column(String)
     last_interaction = Column(DateTime)
 
+    __table_args__ = (
+        Index("ux_npcs_session_name", "session_id", "name", unique=True),
+    )
+
 
 class Quest(Base):
     __tablename__ = "quests"
@@ -54,6 +62,10 @@ class Quest(Base):
     consequences = Column(SQLiteJSON)
     status = Column(String)
 
+    __table_args__ = (
+        Index("ux_quests_session_name", "session_id", "name", unique=True),
+    )
+
 
 class WorldFlag(Base):
     __tablename__ = "world_flags"
@@ -62,6 +74,10 @@ class WorldFlag(Base):
     key = Column(String)
     value = Column(String)  # Use "true", "false", "unknown", etc.
 
+    __table_args__ = (
+        Index("ux_world_flags_session_key", "session_id", "key", unique=True),
+    )
+
 
 class Rumor(Base):
     __tablename__ = "rumors"
@@ -70,6 +86,10 @@ class Rumor(Base):
     content = Column(Text)
     is_confirmed = Column(Boolean, default=False)
 
+    __table_args__ = (
+        Index("ix_rumors_session", "session_id"),
+    )
+
 
 class Location(Base):
     __tablename__ = "locations"
@@ -81,6 +101,10 @@ class Location(Base):
     connected_locations = Column(SQLiteJSON)
     session_id = Column(Integer, ForeignKey("sessions.id")) 
 
+    __table_args__ = (
+        Index("ix_locations_session", "session_id"),
+    )
+
 
 class ConversationContext(Base):
     __tablename__ = "conversation_contexts"
@@ -91,6 +115,10 @@ class ConversationContext(Base):
     last_topic = Column(String)
     last_updated = Column(DateTime)
 
+    __table_args__ = (
+        Index("ux_conversation_contexts_session_npc", "session_id", "npc_id", unique=True),
+    )
+
 
 class Turn(Base):
     __tablename__ = "turns"
@@ -99,12 +127,32 @@ class Turn(Base):
     turn_number = Column(Integer)
     player_input = Column(Text)
     gm_response = Column(Text)
-    prompt_used = Column(Text)
     summary = Column(Text)
     timestamp = Column(DateTime, default=datetime.utcnow)
     prompt_snapshot = Column(Text)  # Stores full prompt sent to GPT
+
+    __table_args__ = (
+        Index("ux_turns_session_turn_number", "session_id", "turn_number", unique=True),
+    )
     
 
+class TurnMetric(Base):
+    __tablename__ = "turn_metrics"
+    # One row per (stage, model) per turn, aggregated from the turn's trace (see utils/tracing.py).
+    id = Column(Integer, primary_key=True)
+    turn_id = Column(Integer, ForeignKey("turns.id"), index=True)
+    session_id = Column(Integer, ForeignKey("sessions.id"), index=True)
+    stage = Column(String)        # e.g. "llm.chat", "embedding", "faiss_search", "db.query", "narration"
+    model = Column(String)
+    span_count = Column(Integer, default=0)
+    total_ms = Column(Float, default=0.0)
+    max_ms = Column(Float, default=0.0)
+    prompt_tokens = Column(Integer, default=0)
+    response_tokens = Column(Integer, default=0)
+    tool_calls = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
 class JournalEntry(Base):
     __tablename__ = "journal_entries"
     id = Column(Integer, primary_key=True)
@@ -113,6 +161,10 @@ class JournalEntry(Base):
     entry_text = Column(Text) # The narrative summary
     timestamp = Column(DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        Index("ix_journal_entries_session_turn", "session_id", "turn_number"),
+    )
+
 
 class PlayerState(Base):
     __tablename__ = "player_state"
@@ -128,4 +180,8 @@ class PlayerState(Base):
     inventory = Column(JSON)      # ["dagger", "rope"]
     limitations = Column(JSON)    # ["no magic", "hunted in Duskport"]
 
+    __table_args__ = (
+        Index("ix_player_state_session", "session_id"),
+    )
+
     session = relationship("Session", back_populates="player_state")
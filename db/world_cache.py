@@ -0,0 +1,122 @@
+# db/world_cache.py
+
+"""
+Per-session cache of the world state that is read every turn but rarely changes: NPCs,
+quests, world flags and the session config. build_prompt and the simulation pass read
+it through get_world_state() instead of querying those tables each time.
+
+Entries are plain dicts, since ORM objects belong to one DB session and thread. The
+world_tools handlers are the only code that changes these rows during play, and they
+call invalidate_world_state() as they write. Reads from a DB session holding
+uncommitted world changes go straight to the database and are not cached, and the
+session's entries are dropped again when its transaction commits or rolls back.
+Anything else that changes these tables (the launcher deleting or restarting a
+campaign) must invalidate as well.
+
+Every invalidation bumps the version of the parts it drops, so caches built from the
+world state (the rendered prompt sections) can tell when what they used has changed.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from sqlalchemy import event
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session as DBSession
+from db.schema import NPC, Quest, WorldFlag, Session
+
+WORLD_CACHE_MAX_SESSIONS = int(os.getenv("WORLD_CACHE_MAX_SESSIONS", "32"))
+WORLD_STATE_PARTS = ("npcs", "quests", "flags", "config")
+
+_entries = OrderedDict()   # session_id -> {part: rows}, least recently used first
+_versions = {}             # (session_id, part) -> version
+_lock = threading.Lock()
+
+def _load_part(db: DBSession, session_id: int, part: str):
+    if part == "npcs":
+        return [
+            {"id": n.id, "name": n.name, "role": n.role, "status": n.status, "motivation": n.motivation,
+             "power_level": n.power_level, "combat_style": n.combat_style}
+            for n in db.query(NPC).filter_by(session_id=session_id).order_by(NPC.id)
+        ]
+    if part == "quests":
+        return [
+            {"id": q.id, "name": q.name, "status": q.status, "milestones": q.milestones}
+            for q in db.query(Quest).filter_by(session_id=session_id).order_by(Quest.id)
+        ]
+    if part == "flags":
+        return [
+            {"id": f.id, "key": f.key, "value": f.value}
+            for f in db.query(WorldFlag).filter_by(session_id=session_id).order_by(WorldFlag.id)
+        ]
+    config = db.get(Session, session_id)
+    if config is None:
+        return None
+    return {"genre": config.genre, "tone": config.tone, "realism": config.realism,
+            "power_fantasy": config.power_fantasy, "world_intro": config.world_intro}
+
+def _can_cache(db: DBSession) -> bool:
+    # Not while this session has world changes in flight, and not inside a transaction
+    # owned by someone else (atomic_session), whose outcome we don't get to see.
+    return not db.info.get("world_state_dirty") and not isinstance(db.get_bind(), Connection)
+
+def get_world_state(db: DBSession, session_id: int) -> dict:
+    """
+    Returns {"versions", "npcs", "quests", "flags", "config"} for the session, loading
+    only the parts that aren't cached. versions maps each part to its current version.
+    The returned lists and dicts are shared: don't modify them.
+    """
+    with _lock:
+        entry = _entries.get(session_id)
+        if entry is not None:
+            _entries.move_to_end(session_id)
+        cached = dict(entry or {})
+        versions = _part_versions(session_id)
+
+    missing = [part for part in WORLD_STATE_PARTS if part not in cached]
+    if missing:
+        loaded = {part: _load_part(db, session_id, part) for part in missing}
+        cached.update(loaded)
+        if _can_cache(db):
+            with _lock:
+                # Skip the store if anything was invalidated while we were loading.
+                if _part_versions(session_id) == versions:
+                    _entries.setdefault(session_id, {}).update(loaded)
+                    _entries.move_to_end(session_id)
+                    while len(_entries) > WORLD_CACHE_MAX_SESSIONS:
+                        _entries.popitem(last=False)
+
+    return {"versions": versions, **{part: cached[part] for part in WORLD_STATE_PARTS}}
+
+def _part_versions(session_id: int) -> dict:
+    return {part: _versions.get((session_id, part), 0) for part in WORLD_STATE_PARTS}
+
+def get_world_state_versions(session_id: int) -> dict:
+    with _lock:
+        return _part_versions(session_id)
+
+def invalidate_world_state(session_id: int, *parts: str, db: DBSession = None):
+    """
+    Drops the cached parts (all of them if none are given) of a session's world state.
+    Pass the DB session making the change so the entry is dropped again once it commits
+    or rolls back.
+    """
+    with _lock:
+        entry = _entries.get(session_id)
+        for part in parts or WORLD_STATE_PARTS:
+            if entry is not None:
+                entry.pop(part, None)
+            _versions[(session_id, part)] = _versions.get((session_id, part), 0) + 1
+    if db is not None:
+        db.info.setdefault("world_state_dirty", {}).setdefault(session_id, set()).update(parts or WORLD_STATE_PARTS)
+
+def clear_world_cache():
+    with _lock:
+        _entries.clear()
+
+@event.listens_for(DBSession, "after_commit")
+@event.listens_for(DBSession, "after_rollback")
+def _invalidate_after_transaction(db):
+    dirty = db.info.pop("world_state_dirty", None)
+    for session_id, parts in (dirty or {}).items():
+        invalidate_world_state(session_id, *parts)
@@ -1,8 +1,7 @@
 # export_db.py
 
 import json
-from sqlalchemy.orm import sessionmaker
-from db.engine import get_engine
+from db.engine import get_session
 from db.schema import PlayerState, NPC, Session, Turn
 
 # This utility connects to your database and exports the relevant data to a text file.
@@ -11,8 +10,7 @@ def export_game_data(session_id: int):
     """
     Connects to the database and exports the data for a specific session ID.
     """
-    SessionFactory = sessionmaker(bind=get_engine())
-    db = SessionFactory()
+    db = get_session()
 
     try:
         # Fetch the session, player, NPCs, and turns
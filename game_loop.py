@@ -1,32 +1,178 @@
 # game_loop.py
 
+import asyncio
 import json
+import os
+import queue
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 from sqlalchemy.orm import Session as DBSession
 from sqlalchemy import desc
 from datetime import datetime
 
 # Adjusted imports for the new architecture
 from prompt_builder.builder import build_prompt
-from gemini_interface.gemini_client import call_gemini_with_tools
-from gpt_interface.gpt_client import call_chat_model
+from gemini_interface.gemini_client import call_gemini_with_tools, stream_gemini_text
+from gpt_interface.gpt_client import stream_chat_model
+from db.engine import atomic_session
 from db.schema import Turn
-from memory.ingest import chunk_and_store
-from utils.simulation import run_simulation_pass
-from utils.progression import evaluate_player_growth
-from world_tools import FUNCTION_HANDLERS # Import the function handlers directly
+from memory.ingest import chunk_and_store_async
+from utils.simulation import aplan_simulation_pass, apply_simulation_plans
+from utils.progression import aplan_player_growth, apply_player_growth
+from utils import llm_async
+from utils.background_jobs import submit_job, wait_for_session_jobs
+from utils.timing import StageTimer
+from utils.tracing import start_trace, submit_traced, save_turn_metrics
+from world_tools import execute_tool_calls, unit_of_work, LOGIC_ENGINE_TOOLS
 
 SIMULATION_TURN_THRESHOLD = 5
+# Stream the logic engine's JSON and start narrating as soon as `outcome_summary` is complete,
+# instead of waiting for the whole response. The streamed call is plain text (no function
+# calling); the JSON `tool_calls` are applied exactly as in the default mode.
+STREAM_LOGIC_ENGINE = os.getenv("STREAM_LOGIC_ENGINE", "false").lower() == "true"
+
+# The narrator streams from a worker thread into a queue, so the turn's generator can
+# keep reading the logic engine's stream (and yield narration) while it is being generated.
+_narration_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="gm-narrator")
+_NARRATION_DONE = object()
+_OUTCOME_SUMMARY_PATTERN = re.compile(r'"outcome_summary"\s*:\s*"((?:[^"\\]|\\.)*)"', re.DOTALL)
+
+# session_id -> {stage: milliseconds} for the most recent turn
+_last_turn_timings = {}
+
+def run_periodic_passes(db: DBSession, session_id: int):
+    """
+    The NPC simulation and player progression passes, run as one background job.
+    """
+    llm_async.run(arun_periodic_passes(db, session_id))
+
+async def arun_periodic_passes(db: DBSession, session_id: int):
+    """
+    The simulation pass, then the progression pass. They share the job's session, so they
+    run one after the other; the simulation's NPCs are still planned concurrently.
+    Both are planned on the job's session, which holds no transaction, and applied together
+    at the end in one short atomic_session: SQLite's write lock is only held while the
+    changes are written, never across a model call.
+    """
+    profiles, plans = await aplan_simulation_pass(db, session_id)
+    growth_calls = await aplan_player_growth(db, session_id)
+    await asyncio.to_thread(_apply_periodic_passes, db, session_id, profiles, plans, growth_calls)
+
+def _apply_periodic_passes(db: DBSession, session_id: int, profiles: list, plans: list, growth_calls: list):
+    with atomic_session(db.get_bind()) as write_db:
+        apply_simulation_plans(write_db, session_id, profiles, plans)
+        print("\n--- Simulation Pass Complete ---")
+        apply_player_growth(write_db, session_id, growth_calls)
+
+def _traced_periodic_passes(turn_id: int):
+    """
+    Wraps run_periodic_passes so its spans are stored with the turn that triggered it.
+    """
+    def run(db: DBSession, session_id: int):
+        with start_trace(session_id) as trace:
+            run_periodic_passes(db, session_id)
+        with atomic_session(db.get_bind()) as write_db:
+            save_turn_metrics(write_db, turn_id, trace)
+    return run
 
 def run_game_turn(db: DBSession, session_id: int, player_input: str):
     """
     Runs a single turn of the game using a two-step "Logic -> Narration" pipeline.
+    Returns the full narration.
+    """
+    return "".join(run_game_turn_stream(db, session_id, player_input)).strip()
+
+def get_last_turn_timings(session_id: int) -> dict:
+    return dict(_last_turn_timings.get(session_id, {}))
+
+def extract_outcome_summary(partial_json: str):
+    """
+    Returns the `outcome_summary` string from a (possibly incomplete) logic engine
+    response once its closing quote has arrived, otherwise None.
+    """
+    match = _OUTCOME_SUMMARY_PATTERN.search(partial_json)
+    if not match:
+        return None
+    try:
+        return json.loads(f'"{match.group(1)}"')
+    except json.JSONDecodeError:
+        return None
+
+def parse_logic_response(logic_response_text: str) -> dict:
+    try:
+        match = re.search(r"\{.*\}", logic_response_text, re.DOTALL)
+        if match:
+            clean_json_string = match.group(0)
+            return json.loads(clean_json_string)
+        else:
+            raise json.JSONDecodeError("No JSON object found in the response.", logic_response_text, 0)
+            
+    except json.JSONDecodeError:
+        print(f"ERROR: Logic Engine did not return valid JSON. Response:\n{logic_response_text}")
+        return {"outcome_summary": "The world seems to shift in response to your action, but the details are unclear.", "tool_calls": []}
+
+def _produce_narration(narration_prompt: str, deltas: queue.Queue, timer: StageTimer):
+    start = time.perf_counter()
+    first_token = True
+    try:
+        # Hedged: a narrator that is slower than usual to start gets a second request raced against it.
+        for delta in stream_chat_model([{"role": "user", "content": narration_prompt}], model="gpt4o", hedge=True):
+            if first_token:
+                timer.record("narration_first_token", (time.perf_counter() - start) * 1000)
+                first_token = False
+            deltas.put(delta)
+    except Exception as e:
+        deltas.put(e)
+    finally:
+        timer.record("narration", (time.perf_counter() - start) * 1000)
+        deltas.put(_NARRATION_DONE)
+
+def _take_deltas(deltas: queue.Queue, block: bool):
+    """
+    Returns (queued narration deltas, finished). Re-raises the narrator's exception, if any.
+    """
+    items = []
+    try:
+        item = deltas.get(block=block)
+        while True:
+            if item is _NARRATION_DONE:
+                return items, True
+            if isinstance(item, Exception):
+                raise item
+            items.append(item)
+            item = deltas.get_nowait()
+    except queue.Empty:
+        return items, False
+
+def run_game_turn_stream(db: DBSession, session_id: int, player_input: str):
+    """
+    Generator version of run_game_turn: yields the narration text as it streams in.
+    Independent stages overlap: memory retrieval runs alongside the context queries,
+    the narration starts while the logic engine is still streaming, and the turn's
+    memories are embedded after it returns. The logic engine's tool calls and the Turn
+    row are committed together once the narration has finished, so the generator must
+    be consumed to the end for the turn to take effect; closing it early changes nothing.
+    Every LLM call, embedding, FAISS search and DB statement of the turn is traced and
+    stored in turn_metrics (see utils/tracing.py).
     """
+    with start_trace(session_id) as trace:
+        yield from _run_turn_stream(db, session_id, player_input, trace)
+
+def _run_turn_stream(db: DBSession, session_id: int, player_input: str, trace):
+    timer = StageTimer()
+
+    # Any simulation/progression job from an earlier turn must land before we read the world state.
+    with timer.stage("wait_for_jobs"):
+        wait_for_session_jobs(session_id)
+        db.expire_all()
+
     turn_counter = db.query(Turn).filter_by(session_id=session_id).count() + 1
     
     # --- STEP 1: THE LOGIC ENGINE (Gemini 2.5 Pro) ---
     print("\n--- Running Logic Engine ---")
-    logic_prompt_context = build_prompt(db, session_id, player_input)
+    with timer.stage("build_prompt"):
+        logic_prompt_context = build_prompt(db, session_id, player_input, timer=timer)
     
     logic_prompt = f"""
 You are the Logic Engine for a text-based RPG. Your job is to be a strict rules referee.
@@ -43,84 +189,97 @@ Based on the provided game state and player input, determine the outcome of the
 **Game State:**
 {logic_prompt_context}
 """
-    
-    logic_response_text = call_gemini_with_tools(db, session_id, messages=[{"role": "user", "content": logic_prompt}])
-    
-    try:
-        match = re.search(r"\{.*\}", logic_response_text, re.DOTALL)
-        if match:
-            clean_json_string = match.group(0)
-            logic_result = json.loads(clean_json_string)
-        else:
-            raise json.JSONDecodeError("No JSON object found in the response.", logic_response_text, 0)
-            
-    except json.JSONDecodeError:
-        print(f"ERROR: Logic Engine did not return valid JSON. Response:\n{logic_response_text}")
-        logic_result = {"outcome_summary": "The world seems to shift in response to your action, but the details are unclear.", "tool_calls": []}
 
-    # --- STEP 2: THE NARRATOR (GPT-4o) ---
-    print("\n--- Running Narrator ---")
-    
-    summary = logic_result.get('outcome_summary', 'Something unexpected happens.')
-    
-    # --- THIS IS THE FIX ---
-    # The narrator now receives the full game context in addition to the event summary.
-    narration_prompt = f"""
+    narration_parts = []
+    deltas = queue.Queue()
+    narration_started = False
+
+    def start_narration(summary):
+        # --- STEP 2: THE NARRATOR (GPT-4o) ---
+        print("\n--- Running Narrator ---")
+        # The narrator receives the full game context in addition to the event summary.
+        # The summary goes last, so the instructions and the slowly changing start of the
+        # context repeat from turn to turn and can be served from the provider's prompt cache.
+        narration_prompt = f"""
 You are a master storyteller and cinematic AI Game Master.
-Your only job is to take the following event summary and turn it into an engaging, immersive, and well-written narrative of 2-3 paragraphs.
+Your only job is to take the event summary at the end and turn it into an engaging, immersive, and well-written narrative of 2-3 paragraphs.
 You MUST use the provided Game State context to inform your narration. The story must be consistent with the recent dialogue, character sheets, and world state.
 Do not break character or mention game mechanics.
 
-**Event to Narrate:**
-{summary}
-
 **Full Game State Context:**
 {logic_prompt_context}
+
+**Event to Narrate:**
+{summary}
 """
-    narration = call_chat_model([{"role": "user", "content": narration_prompt}], model="gpt4o")
-
-    # --- STEP 3: EXECUTE TOOL CALLS & LOGGING ---
-    print("\n--- Executing World Reactions ---")
-    if logic_result.get("tool_calls"):
-        for tool_call in logic_result["tool_calls"]:
-            func_name = tool_call.get("name")
-            args = tool_call.get("args", {})
-            
-            if func_name in FUNCTION_HANDLERS:
-                func_to_call = FUNCTION_HANDLERS[func_name]
-                args['db_session'] = db
-                args['session_id'] = session_id
-                if func_name == 'create_journal_entry' and 'turn_number' not in args:
-                    args['turn_number'] = turn_counter
-
-                try:
-                    print(f"Executing tool: {func_name} with args: {args}")
-                    func_to_call(**args)
-                except TypeError as e:
-                    print(f"ERROR executing tool {func_name}: {e}")
+        submit_traced(_narration_executor, _produce_narration, narration_prompt, deltas, timer)
+
+    logic_start = time.perf_counter()
+    if STREAM_LOGIC_ENGINE:
+        logic_response_text = ""
+        for chunk in stream_gemini_text([{"role": "user", "content": logic_prompt}]):
+            logic_response_text += chunk
+            if not narration_started:
+                summary = extract_outcome_summary(logic_response_text)
+                if summary is not None:
+                    start_narration(summary)
+                    narration_started = True
             else:
-                print(f"Warning: Logic Engine tried to call unknown tool '{func_name}'")
-            
-    print("--- World Reaction Check Complete ---")
-
-    # --- DATABASE LOGGING ---
-    turn_entry = Turn(
-        session_id=session_id,
-        turn_number=turn_counter,
-        player_input=player_input,
-        gm_response=narration,
-        prompt_snapshot=logic_prompt_context,
-        timestamp=datetime.utcnow()
-    )
-    db.add(turn_entry)
-    db.commit()
+                new_deltas, _ = _take_deltas(deltas, block=False)
+                for delta in new_deltas:
+                    narration_parts.append(delta)
+                    yield delta
+    else:
+        logic_response_text = call_gemini_with_tools(db, session_id, messages=[{"role": "user", "content": logic_prompt}], tools=LOGIC_ENGINE_TOOLS)
+    timer.record("logic_engine", (time.perf_counter() - logic_start) * 1000)
+
+    logic_result = parse_logic_response(logic_response_text)
+    if not narration_started:
+        start_narration(logic_result.get('outcome_summary', 'Something unexpected happens.'))
+
+    finished = False
+    while not finished:
+        new_deltas, finished = _take_deltas(deltas, block=True)
+        for delta in new_deltas:
+            narration_parts.append(delta)
+            yield delta
+    narration = "".join(narration_parts).strip()
+
+    # --- STEP 3: EXECUTE TOOL CALLS & LOG THE TURN ---
+    # Only once the narration has succeeded, and in one transaction with the Turn row: a
+    # turn that fails or is abandoned mid-stream leaves the world untouched, so the player
+    # can simply send the action again.
+    with unit_of_work(db):
+        print("\n--- Executing World Reactions ---")
+        with timer.stage("world_reactions"):
+            if logic_result.get("tool_calls"):
+                execute_tool_calls(db, session_id, logic_result["tool_calls"], turn_number=turn_counter)
+        print("--- World Reaction Check Complete ---")
+
+        with timer.stage("log_turn"):
+            turn_entry = Turn(
+                session_id=session_id,
+                turn_number=turn_counter,
+                player_input=player_input,
+                gm_response=narration,
+                prompt_snapshot=logic_prompt_context,
+                timestamp=datetime.utcnow()
+            )
+            db.add(turn_entry)
+            db.flush()
+            # Read before commit: touching the expired instance afterwards would open a read
+            # transaction that blocks the background job's writes.
+            turn_id = turn_entry.id
+            save_turn_metrics(db, turn_id, trace)
 
     # --- MEMORY & CONTEXT ---
-    chunk_and_store(f"Player: {player_input}\nGM: {narration}", session_id)
+    # Embedded in the background; the next turn's retrieval waits for it.
+    chunk_and_store_async(f"Player: {player_input}\nGM: {narration}", session_id, turn_number=turn_counter)
     
     # --- PERIODIC SIMULATION & PROGRESSION ---
+    # Runs after the narration is returned; the next turn waits for it before building its prompt.
     if turn_counter % SIMULATION_TURN_THRESHOLD == 0:
-        run_simulation_pass(db, session_id)
-        evaluate_player_growth(db, session_id)
-        
-    return narration
+        submit_job(session_id, "simulation_and_progression", _traced_periodic_passes(turn_id), bind=db.get_bind())
+
+    timer.report(f"turn {turn_counter} (session {session_id})")
+    _last_turn_timings[session_id] = dict(timer.timings)
@@ -0,0 +1,366 @@
+# gemini_interface/backends.py
+
+"""
+Where call_gemini_with_tools / stream_gemini_text get their responses from:
+
+    live       the Gemini API (default)
+    record     the Gemini API, appending every response to LLM_RECORDINGS_PATH
+    recorded   replays responses from LLM_RECORDINGS_PATH, synthetic on a miss
+    synthetic  canned text and tool calls after a configurable delay, no network
+
+Pick one with LLM_BACKEND (shared with gpt_interface), or set_backend() from code.
+A backend's start_chat() returns a chat whose send(content) (or await asend(content),
+on the shared loop in utils/llm_async.py) gives a reply dict {"text", "tool_calls",
+"usage"}: tool_calls is a list of {"name", "args"} with plain args, text is None when
+the response has none, and usage is {"prompt_tokens", "response_tokens"} or None.
+stream_text() yields {"text", "usage"}. The tool loop itself stays in
+call_gemini_with_tools.
+"""
+
+import asyncio
+import copy
+from abc import ABC, abstractmethod
+import os
+import threading
+import time
+from collections import OrderedDict
+import google.generativeai as genai
+from dotenv import load_dotenv
+from world_tools import WORLD_TOOLS_LIST
+from utils.llm_replay import RecordingStore, SyntheticTiming, request_key
+from utils.tokens import approx_tokens
+from utils.resilience import LLM_TIMEOUT_SECONDS
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Configure the client once at the module level
+genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+
+LLM_BACKEND = os.getenv("LLM_BACKEND", "live")
+
+# Define safety settings to allow for mature content like violence in a fantasy game
+SAFETY_SETTINGS = {
+    "HARM_CATEGORY_HARASSMENT": "BLOCK_NONE",
+    "HARM_CATEGORY_HATE_SPEECH": "BLOCK_NONE",
+    "HARM_CATEGORY_SEXUALLY_EXPLICIT": "BLOCK_NONE",
+    "HARM_CATEGORY_DANGEROUS_CONTENT": "BLOCK_NONE",
+}
+
+# What the synthetic backend answers when it isn't calling tools: a logic engine
+# verdict, which the other call sites simply treat as text.
+SYNTHETIC_TEXT = '{"outcome_summary": "The action succeeds, though not without cost.", "tool_calls": []}'
+
+# Built models, keyed by (model name, tool names, system instruction). A GenerativeModel
+# only holds configuration, so one instance serves any number of chats and threads.
+MODEL_REGISTRY_SIZE = int(os.getenv("GEMINI_MODEL_REGISTRY_SIZE", "32"))
+_models = OrderedDict()
+_models_lock = threading.Lock()
+
+def get_model(model_name='gemini-2.5-pro', tools=WORLD_TOOLS_LIST, system_instruction=None):
+    """Returns a Gemini model with a specific toolset and system instruction, building it on first use."""
+    key = (model_name, tuple(tool_names(tools)), system_instruction)
+    with _models_lock:
+        model = _models.get(key)
+        if model is not None:
+            _models.move_to_end(key)
+            return model
+    model = genai.GenerativeModel(
+        model_name=model_name,
+        tools=tools,
+        system_instruction=system_instruction,
+        safety_settings=SAFETY_SETTINGS
+    )
+    with _models_lock:
+        _models[key] = model
+        while len(_models) > MODEL_REGISTRY_SIZE:
+            _models.popitem(last=False)
+    return model
+
+def _to_plain(value):
+    """Converts the proto map/list wrappers in function call args into plain dicts and lists."""
+    if hasattr(value, 'items'):
+        return {k: _to_plain(v) for k, v in value.items()}
+    if hasattr(value, '__iter__') and not isinstance(value, (str, bytes)):
+        return [_to_plain(v) for v in value]
+    return value
+
+def tool_names(tools) -> list[str]:
+    return [fd.name for tool in tools or [] for fd in getattr(tool, 'function_declarations', None) or []]
+
+def _is_function_response(content) -> bool:
+    return isinstance(content, list) and any(isinstance(part, dict) and 'function_response' in part for part in content)
+
+class GeminiChat(ABC):
+    @abstractmethod
+    def send(self, content) -> dict:
+        ...
+
+    async def asend(self, content) -> dict:
+        # Chats without a native async call answer from a worker thread.
+        return await asyncio.to_thread(self.send, content)
+
+class GeminiBackend(ABC):
+    @abstractmethod
+    def start_chat(self, model_name, tools, system_instruction, history):
+        ...
+
+    @abstractmethod
+    def stream_text(self, model_name, system_instruction, history):
+        ...
+
+# --- Live ---
+
+def _usage(response) -> dict:
+    usage = getattr(response, 'usage_metadata', None)
+    if usage is None:
+        return None
+    return {
+        "prompt_tokens": getattr(usage, 'prompt_token_count', None),
+        "response_tokens": getattr(usage, 'candidates_token_count', None),
+    }
+
+def _reply_from_response(response) -> dict:
+    tool_calls = []
+    if (response.candidates and
+        len(response.candidates) > 0 and
+        response.candidates[0].content and
+        response.candidates[0].content.parts):
+        for part in response.candidates[0].content.parts:
+            if hasattr(part, 'function_call') and part.function_call:
+                tool_calls.append({"name": part.function_call.name, "args": _to_plain(part.function_call.args)})
+
+    text = None
+    if not tool_calls:
+        try:
+            text = response.text
+        except ValueError as e:
+            print(f"Error getting response text: {e}")
+            text_parts = []
+            for candidate in response.candidates:
+                for part in candidate.content.parts:
+                    if hasattr(part, 'text') and part.text:
+                        text_parts.append(part.text)
+            text = ''.join(text_parts) or None
+    return {"text": text, "tool_calls": tool_calls, "usage": _usage(response)}
+
+class LiveGeminiChat(GeminiChat):
+    def __init__(self, chat):
+        self._chat = chat
+
+    def send(self, content) -> dict:
+        return _reply_from_response(self._chat.send_message(content, request_options={"timeout": LLM_TIMEOUT_SECONDS}))
+
+    async def asend(self, content) -> dict:
+        # The SDK's async transport is a gRPC channel owned by the loop it first runs on,
+        # which is why every async call goes through the one shared loop.
+        response = await self._chat.send_message_async(content, request_options={"timeout": LLM_TIMEOUT_SECONDS})
+        return _reply_from_response(response)
+
+class LiveGeminiBackend(GeminiBackend):
+    def start_chat(self, model_name, tools, system_instruction, history):
+        model = get_model(model_name=model_name, tools=tools, system_instruction=system_instruction)
+        return LiveGeminiChat(model.start_chat(history=history))
+
+    def stream_text(self, model_name, system_instruction, history):
+        model = get_model(model_name=model_name, tools=None, system_instruction=system_instruction)
+        for chunk in model.generate_content(history, stream=True, request_options={"timeout": LLM_TIMEOUT_SECONDS}):
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunks carrying only safety/finish metadata have no text.
+                text = None
+            yield {"text": text, "usage": _usage(chunk)}
+
+# --- Synthetic ---
+
+def _chat_key(model_name, tools, system_instruction, transcript) -> str:
+    return request_key("gemini", {
+        "model": model_name,
+        "tools": tool_names(tools),
+        "system_instruction": system_instruction,
+        "transcript": transcript,
+    })
+
+class SyntheticGeminiChat(GeminiChat):
+    def __init__(self, backend, model_name, tools, system_instruction, history):
+        self.backend = backend
+        self.model_name = model_name
+        self.tools = tools
+        self.available = set(tool_names(tools))
+        self.system_instruction = system_instruction
+        self.transcript = list(history)
+
+    def send(self, content) -> dict:
+        self.transcript.append(content)
+        self.backend.timing.delay(_chat_key(self.model_name, self.tools, self.system_instruction, self.transcript))
+        return self._reply(content)
+
+    async def asend(self, content) -> dict:
+        self.transcript.append(content)
+        await self.backend.timing.adelay(_chat_key(self.model_name, self.tools, self.system_instruction, self.transcript))
+        return self._reply(content)
+
+    def _reply(self, content) -> dict:
+        # Canned tool calls answer the first message of a chat; the function responses get text.
+        tool_calls = []
+        if not _is_function_response(content):
+            tool_calls = [copy.deepcopy(call) for call in self.backend.tool_calls if call["name"] in self.available]
+        text = None if tool_calls else self.backend.text
+        reply = {
+            "text": text,
+            "tool_calls": tool_calls,
+            "usage": {
+                "prompt_tokens": approx_tokens(str(self.transcript)),
+                "response_tokens": approx_tokens(text or str(tool_calls)),
+            },
+        }
+        self.transcript.append({"reply": reply["text"], "tool_calls": tool_calls})
+        return reply
+
+class SyntheticGeminiBackend(GeminiBackend):
+    """
+    Answers with canned tool calls (those present in the chat's toolset) and then text.
+    tool_calls is a list of {"name", "args"} dicts.
+    """
+    def __init__(self, text: str = SYNTHETIC_TEXT, tool_calls: list = None, timing: SyntheticTiming = None):
+        self.text = text
+        self.tool_calls = tool_calls or []
+        self.timing = timing or SyntheticTiming()
+
+    def start_chat(self, model_name, tools, system_instruction, history):
+        return SyntheticGeminiChat(self, model_name, tools, system_instruction, history)
+
+    def stream_text(self, model_name, system_instruction, history):
+        self.timing.delay(_chat_key(model_name, None, system_instruction, history))
+        words = self.text.split(" ")
+        for i, word in enumerate(words):
+            yield {"text": word if i == 0 else " " + word, "usage": None}
+            self.timing.chunk_delay()
+        yield {"text": None, "usage": {"prompt_tokens": approx_tokens(str(history)), "response_tokens": approx_tokens(self.text)}}
+
+# --- Recorded / recording ---
+
+class RecordedGeminiChat(GeminiChat):
+    def __init__(self, backend, model_name, tools, system_instruction, history):
+        self.backend = backend
+        self.args = (model_name, tools, system_instruction, history)
+        self.transcript = list(history)
+        self._fallback_chat = None
+
+    def send(self, content) -> dict:
+        self.transcript.append(content)
+        model_name, tools, system_instruction, _ = self.args
+        response = self.backend.store.next(_chat_key(model_name, tools, system_instruction, self.transcript))
+        if response is None:
+            self.backend.misses += 1
+            if self.backend.fallback is None:
+                raise KeyError(f"No recorded Gemini response for this {model_name} request in {self.backend.store.path}.")
+            if self._fallback_chat is None:
+                self._fallback_chat = self.backend.fallback.start_chat(*self.args)
+            reply = self._fallback_chat.send(content)
+        else:
+            if self.backend.replay_latency:
+                time.sleep(response.get("latency_ms", 0) / 1000)
+            reply = {"text": response["text"], "tool_calls": response["tool_calls"], "usage": response["usage"]}
+        self.transcript.append({"reply": reply["text"], "tool_calls": reply["tool_calls"]})
+        return reply
+
+class RecordedGeminiBackend(GeminiBackend):
+    """
+    Replays responses saved by RecordingGeminiBackend. A chat is matched on its whole
+    transcript so far. Requests that were never recorded go to fallback (counted in
+    misses), or raise KeyError without one.
+    """
+    def __init__(self, path: str = None, fallback: GeminiBackend = None, replay_latency: bool = False):
+        self.store = RecordingStore(path)
+        self.fallback = fallback
+        self.replay_latency = replay_latency
+        self.misses = 0
+
+    def start_chat(self, model_name, tools, system_instruction, history):
+        return RecordedGeminiChat(self, model_name, tools, system_instruction, history)
+
+    def stream_text(self, model_name, system_instruction, history):
+        response = self.store.next(request_key("gemini_stream", {
+            "model": model_name, "system_instruction": system_instruction, "history": history,
+        }))
+        if response is None:
+            self.misses += 1
+            if self.fallback is None:
+                raise KeyError(f"No recorded Gemini stream for this {model_name} request in {self.store.path}.")
+            yield from self.fallback.stream_text(model_name, system_instruction, history)
+            return
+        if self.replay_latency:
+            time.sleep(response.get("latency_ms", 0) / 1000)
+        yield {"text": response["text"], "usage": response["usage"]}
+
+class RecordingGeminiChat(GeminiChat):
+    def __init__(self, backend, chat, model_name, tools, system_instruction, history):
+        self.backend = backend
+        self.chat = chat
+        self.key_args = (model_name, tools, system_instruction)
+        self.transcript = list(history)
+
+    def send(self, content) -> dict:
+        self.transcript.append(content)
+        start = time.perf_counter()
+        reply = self.chat.send(content)
+        self.backend.store.append(_chat_key(*self.key_args, self.transcript), "gemini",
+                                  {**reply, "latency_ms": (time.perf_counter() - start) * 1000})
+        self.transcript.append({"reply": reply["text"], "tool_calls": reply["tool_calls"]})
+        return reply
+
+class RecordingGeminiBackend(GeminiBackend):
+    """
+    Passes requests to inner (the live backend by default) and records every response.
+    """
+    def __init__(self, inner: GeminiBackend = None, path: str = None):
+        self.inner = inner or LiveGeminiBackend()
+        self.store = RecordingStore(path)
+
+    def start_chat(self, model_name, tools, system_instruction, history):
+        chat = self.inner.start_chat(model_name, tools, system_instruction, history)
+        return RecordingGeminiChat(self, chat, model_name, tools, system_instruction, history)
+
+    def stream_text(self, model_name, system_instruction, history):
+        start = time.perf_counter()
+        parts, usage = [], None
+        for chunk in self.inner.stream_text(model_name, system_instruction, history):
+            parts.append(chunk["text"] or "")
+            usage = chunk["usage"] or usage
+            yield chunk
+        key = request_key("gemini_stream", {"model": model_name, "system_instruction": system_instruction, "history": history})
+        self.store.append(key, "gemini_stream", {
+            "text": "".join(parts), "usage": usage, "latency_ms": (time.perf_counter() - start) * 1000,
+        })
+
+def make_backend(name: str) -> GeminiBackend:
+    if name == "live":
+        return LiveGeminiBackend()
+    if name == "record":
+        return RecordingGeminiBackend()
+    if name == "recorded":
+        return RecordedGeminiBackend(fallback=SyntheticGeminiBackend())
+    if name == "synthetic":
+        return SyntheticGeminiBackend()
+    raise ValueError(f"Unknown LLM backend '{name}'. Expected live, record, recorded or synthetic.")
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_backend() -> GeminiBackend:
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = make_backend(LLM_BACKEND)
+        return _backend
+
+def set_backend(backend: GeminiBackend) -> GeminiBackend:
+    """
+    Replaces the active backend. Returns the previous one.
+    """
+    global _backend
+    with _backend_lock:
+        previous, _backend = _backend, backend
+        return previous
@@ -1,39 +1,37 @@
 # gemini_interface/gemini_client.py
 
-import os
-import google.generativeai as genai
-from dotenv import load_dotenv
-from world_tools import WORLD_TOOLS_LIST, FUNCTION_HANDLERS
-
-# Load environment variables from .env file
-load_dotenv()
-
-# Configure the client once at the module level
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-
-# Define safety settings to allow for mature content like violence in a fantasy game
-SAFETY_SETTINGS = {
-    "HARM_CATEGORY_HARASSMENT": "BLOCK_NONE",
-    "HARM_CATEGORY_HATE_SPEECH": "BLOCK_NONE",
-    "HARM_CATEGORY_SEXUALLY_EXPLICIT": "BLOCK_NONE",
-    "HARM_CATEGORY_DANGEROUS_CONTENT": "BLOCK_NONE",
-}
-
-def get_model(model_name='gemini-2.5-pro', tools=WORLD_TOOLS_LIST, system_instruction=None):
-    """Initializes and returns a Gemini model with a specific toolset and system instruction."""
-    return genai.GenerativeModel(
-        model_name=model_name,
-        tools=tools,
-        system_instruction=system_instruction,
-        safety_settings=SAFETY_SETTINGS
-    )
-
-def call_gemini_with_tools(db_session, session_id, messages, model_name='gemini-2.5-pro', tools=WORLD_TOOLS_LIST, return_after_tools=False):
+import asyncio
+from world_tools import WORLD_TOOLS_LIST, FUNCTION_HANDLERS, execute_tool_calls
+from utils.tracing import span
+# get_model, SAFETY_SETTINGS and _to_plain live with the live backend; re-exported here.
+from gemini_interface.backends import get_backend, get_model, SAFETY_SETTINGS, _to_plain, tool_names
+from utils.llm_cache import cached_call, acached_call
+from utils import llm_async, resilience
+
+def _record_usage(s: dict, reply: dict):
+    """Copies token counts and the number of requested function calls into a trace span."""
+    usage = reply.get("usage")
+    if usage is not None:
+        s["prompt_tokens"] = usage["prompt_tokens"]
+        s["response_tokens"] = usage["response_tokens"]
+    s["tool_calls"] += len(reply.get("tool_calls") or [])
+
+def _send(chat, model_name, content):
+    with span("llm.gemini", model=model_name) as s:
+        reply = resilience.call(model_name, lambda: chat.send(content))
+        _record_usage(s, reply)
+    return reply
+
+async def _asend(chat, model_name, content):
+    with span("llm.gemini", model=model_name) as s:
+        reply = await resilience.acall(model_name, lambda: llm_async.limited(chat.asend(content)))
+        _record_usage(s, reply)
+    return reply
+
+def _to_gemini_history(messages):
     """
-    Calls the Gemini model with a set of tools and a message history, then manually
-    executes any function calls the model requests in a loop.
+    Converts OpenAI-style messages into (system_instruction, gemini_history).
     """
-    # 1. SETUP
     if isinstance(messages, str):
         messages = [{"role": "user", "content": messages}]
     elif not isinstance(messages, list):
@@ -50,95 +48,172 @@ def call_gemini_with_tools(db_session, session_id, messages, model_name='gemini-
     for msg in history:
         role = 'model' if msg['role'] == 'assistant' else 'user'
         gemini_history.append({'role': role, 'parts': [{'text': msg['content']}]})
+    return system_instruction, gemini_history
+
+def stream_gemini_text(messages, model_name='gemini-2.5-pro'):
+    """
+    Streams a plain-text Gemini response (no tools) as text deltas.
+    """
+    system_instruction, gemini_history = _to_gemini_history(messages)
+    if not gemini_history:
+        return
+    with span("llm.gemini_stream", model=model_name) as s:
+        for chunk in resilience.stream(model_name, lambda: get_backend().stream_text(model_name, system_instruction, gemini_history)):
+            # The running token counts arrive with the chunks; the last one has the totals.
+            _record_usage(s, chunk)
+            if chunk["text"]:
+                yield chunk["text"]
+
+def _is_cacheable(result) -> bool:
+    # Failures come back as text; they must not be replayed.
+    if isinstance(result, str):
+        return bool(result) and not result.startswith(("ERROR:", "Error", "I encountered an issue", "No message to process."))
+    return result is not None
+
+def call_gemini_with_tools(db_session, session_id, messages, model_name='gemini-2.5-pro', tools=WORLD_TOOLS_LIST, return_after_tools=False, return_tool_calls=False, cache=False):
+    """
+    Calls the Gemini model with a set of tools and a message history, then manually
+    executes any function calls the model requests in a loop.
+
+    With return_tool_calls=True nothing is executed: the first batch of requested calls
+    is returned as a list of {"name": ..., "args": {...}} dicts (or the response text if
+    the model didn't call a tool), so the caller can apply them itself.
+
+    With cache=True the call's result is stored in utils/llm_cache.py and an identical
+    request (messages, model, toolset, return mode) gets it back without calling the
+    model. Tools are not run again on a hit, so only cache calls whose tools have no
+    side effects, or that return the tool calls for the caller to apply.
+    """
+    if cache:
+        request = {
+            "messages": messages,
+            "tools": tool_names(tools),
+            "return_after_tools": return_after_tools,
+            "return_tool_calls": return_tool_calls,
+            "backend": type(get_backend()).__name__,
+        }
+        return cached_call("gemini", model_name, request, lambda: _call_gemini_with_tools(
+            db_session, session_id, messages, model_name, tools, return_after_tools, return_tool_calls
+        ), cacheable=_is_cacheable)
+    return _call_gemini_with_tools(db_session, session_id, messages, model_name, tools, return_after_tools, return_tool_calls)
+
+def _call_gemini_with_tools(db_session, session_id, messages, model_name, tools, return_after_tools, return_tool_calls):
+    # 1. SETUP
+    system_instruction, gemini_history = _to_gemini_history(messages)
 
-    model = get_model(model_name=model_name, tools=tools, system_instruction=system_instruction)
-    chat = model.start_chat(history=gemini_history[:-1] if gemini_history else [])
-    
     if not gemini_history:
         return "No message to process."
-        
-    response = chat.send_message(gemini_history[-1]['parts'][0]['text'])
+
+    chat = get_backend().start_chat(model_name, tools, system_instruction, gemini_history[:-1])
+    response = _send(chat, model_name, gemini_history[-1]['parts'][0]['text'])
 
     max_iterations = 10
     iteration_count = 0
+    seen = {}
     
     while iteration_count < max_iterations:
         iteration_count += 1
-        
-        tool_calls = []
-        if (response.candidates and 
-            len(response.candidates) > 0 and 
-            response.candidates[0].content and
-            response.candidates[0].content.parts):
+        done, result = _handle_tool_calls(db_session, session_id, response, seen, return_after_tools, return_tool_calls)
+        if done:
+            return result
+        response = _send(chat, model_name, result)
             
-            for part in response.candidates[0].content.parts:
-                if hasattr(part, 'function_call') and part.function_call:
-                    tool_calls.append(part.function_call)
+    return _final_text(response, iteration_count, max_iterations)
 
-        if not tool_calls:
-            break
-            
-        api_responses = []
-        tool_results = [] # <-- New list to store the results of tool calls
-
-        for tool_call in tool_calls:
-            func_name = tool_call.name
-            print(f"Model wants to call tool: {func_name} with args: {dict(tool_call.args)}")
-
-            if func_name in FUNCTION_HANDLERS:
-                func_to_call = FUNCTION_HANDLERS[func_name]
-                args = dict(tool_call.args)
-
-                if func_name not in ['select_relevant_memories']:
-                    args['db_session'] = db_session
-                    if func_name not in ['finalize_character_and_world']:
-                        args['session_id'] = session_id
-                
-                result = func_to_call(**args)
-                
-                # The finalize tool is unique and should always exit immediately.
-                if func_name == 'finalize_character_and_world':
-                    return result
-                
-                tool_results.append(result) # <-- Store the result of the tool call
-                
-                api_responses.append({
-                    "function_response": {
-                        "name": func_name,
-                        "response": {"result": result},
-                    }
-                })
-            else:
-                api_responses.append({
-                    "function_response": {
-                        "name": func_name,
-                        "response": {"error": "Tool not found."},
-                    }
-                })
+async def acall_gemini_with_tools(db_session, session_id, messages, model_name='gemini-2.5-pro', tools=WORLD_TOOLS_LIST, return_after_tools=False, return_tool_calls=False, cache=False):
+    """
+    Async version of call_gemini_with_tools, for the shared LLM loop (utils/llm_async.py).
+    Each model request counts against LLM_MAX_CONCURRENCY. Requested tools run in a worker
+    thread (asyncio.to_thread) so their database work doesn't block the loop; db_session
+    must not be used by anything else until the call returns.
+    """
+    if cache:
+        request = {
+            "messages": messages,
+            "tools": tool_names(tools),
+            "return_after_tools": return_after_tools,
+            "return_tool_calls": return_tool_calls,
+            "backend": type(get_backend()).__name__,
+        }
+        return await acached_call("gemini", model_name, request, lambda: _acall_gemini_with_tools(
+            db_session, session_id, messages, model_name, tools, return_after_tools, return_tool_calls
+        ), cacheable=_is_cacheable)
+    return await _acall_gemini_with_tools(db_session, session_id, messages, model_name, tools, return_after_tools, return_tool_calls)
+
+async def _acall_gemini_with_tools(db_session, session_id, messages, model_name, tools, return_after_tools, return_tool_calls):
+    system_instruction, gemini_history = _to_gemini_history(messages)
+
+    if not gemini_history:
+        return "No message to process."
+
+    chat = get_backend().start_chat(model_name, tools, system_instruction, gemini_history[:-1])
+    response = await _asend(chat, model_name, gemini_history[-1]['parts'][0]['text'])
+
+    max_iterations = 10
+    iteration_count = 0
+    seen = {}
+
+    while iteration_count < max_iterations:
+        iteration_count += 1
+        done, result = await asyncio.to_thread(
+            _handle_tool_calls, db_session, session_id, response, seen, return_after_tools, return_tool_calls
+        )
+        if done:
+            return result
+        response = await _asend(chat, model_name, result)
+
+    return _final_text(response, iteration_count, max_iterations)
+
+def _handle_tool_calls(db_session, session_id, response, seen, return_after_tools, return_tool_calls):
+    """
+    One step of the tool loop. Returns (True, final result) when the conversation is
+    over, or (False, function responses to send back to the model).
+    """
+    tool_calls = response["tool_calls"]
+
+    if not tool_calls:
+        return True, _final_text(response)
+
+    if return_tool_calls:
+        return True, [{"name": tc["name"], "args": dict(tc["args"])} for tc in tool_calls]
         
-        # --- THIS IS THE FIX ---
-        # If the flag is set, stop the conversation and return the results of the tools.
-        if return_after_tools:
-            # If only one tool was called, return its result directly. Otherwise, return the list.
-            return tool_results[0] if len(tool_results) == 1 else tool_results
-
-        if api_responses:
-            response = chat.send_message(api_responses)
-        else:
-            break
-            
-    if iteration_count >= max_iterations:
+    for tool_call in tool_calls:
+        print(f"Model wants to call tool: {tool_call['name']} with args: {tool_call['args']}")
+
+    # One unit of work per batch; calls the model already made earlier in this
+    # conversation are answered with their earlier result instead of running again.
+    results = execute_tool_calls(db_session, session_id, tool_calls, seen=seen)
+
+    # The finalize tool is unique and should always exit immediately.
+    for result in results:
+        if result["name"] == 'finalize_character_and_world':
+            return True, result["result"]
+
+    tool_results = [r["result"] for r in results if r["name"] in FUNCTION_HANDLERS]
+    api_responses = [
+        {
+            "function_response": {
+                "name": r["name"],
+                "response": {"result": r["result"]} if r["name"] in FUNCTION_HANDLERS else {"error": "Tool not found."},
+            }
+        }
+        for r in results
+    ]
+
+    # --- THIS IS THE FIX ---
+    # If the flag is set, stop the conversation and return the results of the tools.
+    if return_after_tools:
+        # If only one tool was called, return its result directly. Otherwise, return the list.
+        return True, tool_results[0] if len(tool_results) == 1 else tool_results
+
+    return False, api_responses
+
+def _final_text(response, iteration_count=0, max_iterations=None):
+    if max_iterations is not None and iteration_count >= max_iterations:
         error_message = f"ERROR: Loop stopper triggered after {max_iterations} iterations. The last attempted tool call was likely part of a loop. Please check the console logs for details."
         print(error_message)
         return error_message
 
-    try:
-        return response.text
-    except ValueError as e:
-        print(f"Error getting response text: {e}")
-        text_parts = []
-        for candidate in response.candidates:
-            for part in candidate.content.parts:
-                if hasattr(part, 'text') and part.text:
-                    text_parts.append(part.text)
-        return ''.join(text_parts) if text_parts else "I encountered an issue processing your request. Please try again."
+    if response["text"] is None:
+        return "I encountered an issue processing your request. Please try again."
+    return response["text"]
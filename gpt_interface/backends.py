@@ -0,0 +1,293 @@
+# gpt_interface/backends.py
+
+"""
+Where call_chat_model / stream_chat_model get their completions from:
+
+    live       Azure OpenAI (default)
+    record     Azure OpenAI, appending every response to LLM_RECORDINGS_PATH
+    recorded   replays responses from LLM_RECORDINGS_PATH, synthetic on a miss
+    synthetic  canned text after a configurable delay, no network
+
+Pick one with LLM_BACKEND, or set_backend() from code (benchmarks, replays).
+complete() returns {"text", "finish_reason", "usage"}; stream() yields deltas of the
+same shape. usage is {"prompt_tokens", "response_tokens"} or None. acomplete() is the
+coroutine version of complete(), awaited on the shared loop in utils/llm_async.py.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from dotenv import load_dotenv
+from utils.llm_replay import RecordingStore, SyntheticTiming, request_key
+from utils.tokens import approx_tokens
+from utils.resilience import LLM_TIMEOUT_SECONDS
+from utils import llm_async
+
+load_dotenv()
+
+LLM_BACKEND = os.getenv("LLM_BACKEND", "live")
+
+DEPLOYMENTS = {
+    "gpt4o": os.getenv("AZURE_OPENAI_DEPLOYMENT_GPT4O"),
+    "gpt35": os.getenv("AZURE_OPENAI_DEPLOYMENT_GPT35"),
+}
+
+# Ask for a final usage chunk on streamed completions so narration token counts are traced.
+# Off by default: Azure API versions older than 2024-09-01-preview reject stream_options
+# with a 400, which is not retried. Set to true on newer deployments.
+STREAM_USAGE = os.getenv("AZURE_OPENAI_STREAM_USAGE", "false").lower() == "true"
+
+SYNTHETIC_TEXT = (
+    "The torchlight gutters as you move, throwing long shadows across the damp stone. "
+    "Somewhere ahead water drips in a slow, patient rhythm, and the air carries the smell "
+    "of old smoke and older earth. Nothing stirs, but the silence feels watchful, as if "
+    "the place itself is waiting to see what you will do next."
+)
+
+class ChatBackend(ABC):
+    @abstractmethod
+    def complete(self, messages, model, temperature, max_tokens) -> dict:
+        ...
+
+    def stream(self, messages, model, temperature, max_tokens):
+        # Backends without real streaming deliver the whole reply as one delta.
+        yield self.complete(messages, model, temperature, max_tokens)
+
+    async def acomplete(self, messages, model, temperature, max_tokens) -> dict:
+        # Backends without a native async client answer from a worker thread.
+        return await asyncio.to_thread(self.complete, messages, model, temperature, max_tokens)
+
+def _usage(usage) -> dict:
+    if usage is None:
+        return None
+    return {"prompt_tokens": usage.prompt_tokens, "response_tokens": usage.completion_tokens}
+
+def _reply_from_completion(response) -> dict:
+    choice = response.choices[0]
+    return {
+        "text": choice.message.content,
+        "finish_reason": choice.finish_reason,
+        "usage": _usage(getattr(response, "usage", None)),
+    }
+
+def _make_async_client():
+    from openai import AsyncAzureOpenAI
+    # Shares the loop's pooled keep-alive connections (utils/llm_async.py).
+    return AsyncAzureOpenAI(
+        api_key=os.getenv("AZURE_OPENAI_KEY"),
+        api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
+        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+        http_client=llm_async.get_http_client(),
+        timeout=LLM_TIMEOUT_SECONDS,
+        max_retries=0,
+    )
+
+class AzureChatBackend(ChatBackend):
+    def __init__(self):
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                from openai import AzureOpenAI
+                self._client = AzureOpenAI(
+                    api_key=os.getenv("AZURE_OPENAI_KEY"),
+                    api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
+                    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+                    # Retries are done by utils/resilience.py, which also rate limits them.
+                    timeout=LLM_TIMEOUT_SECONDS,
+                    max_retries=0,
+                )
+            return self._client
+
+    def complete(self, messages, model, temperature, max_tokens) -> dict:
+        response = self.client.chat.completions.create(
+            model=DEPLOYMENTS[model],
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+        )
+        return _reply_from_completion(response)
+
+    async def acomplete(self, messages, model, temperature, max_tokens) -> dict:
+        client = llm_async.get_client("azure_openai", _make_async_client)
+        response = await client.chat.completions.create(
+            model=DEPLOYMENTS[model],
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+        )
+        return _reply_from_completion(response)
+
+    def stream(self, messages, model, temperature, max_tokens):
+        stream = self.client.chat.completions.create(
+            model=DEPLOYMENTS[model],
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True,
+            **({"stream_options": {"include_usage": True}} if STREAM_USAGE else {}),
+        )
+        for chunk in stream:
+            usage = _usage(getattr(chunk, "usage", None))
+            # Azure sends a content-filter chunk with no choices before the first token,
+            # and the usage chunk after the last one.
+            if not chunk.choices:
+                if usage:
+                    yield {"text": None, "finish_reason": None, "usage": usage}
+                continue
+            choice = chunk.choices[0]
+            yield {
+                "text": choice.delta.content if choice.delta else None,
+                "finish_reason": choice.finish_reason,
+                "usage": usage,
+            }
+
+class SyntheticChatBackend(ChatBackend):
+    """
+    Replies with canned text. rules is a list of (substring, reply) pairs checked against
+    the last message; the first match wins, otherwise text is used.
+    """
+    def __init__(self, text: str = SYNTHETIC_TEXT, rules: list = None, timing: SyntheticTiming = None):
+        self.text = text
+        self.rules = rules or []
+        self.timing = timing or SyntheticTiming()
+
+    def _reply(self, messages, model, temperature, max_tokens):
+        prompt = messages[-1]["content"] if messages else ""
+        text = next((reply for pattern, reply in self.rules if pattern in prompt), self.text)
+        key = request_key("chat", {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens})
+        usage = {
+            "prompt_tokens": sum(approx_tokens(m["content"]) for m in messages),
+            "response_tokens": approx_tokens(text),
+        }
+        return key, text, usage
+
+    def complete(self, messages, model, temperature, max_tokens) -> dict:
+        key, text, usage = self._reply(messages, model, temperature, max_tokens)
+        self.timing.delay(key)
+        return {"text": text, "finish_reason": "stop", "usage": usage}
+
+    async def acomplete(self, messages, model, temperature, max_tokens) -> dict:
+        key, text, usage = self._reply(messages, model, temperature, max_tokens)
+        await self.timing.adelay(key)
+        return {"text": text, "finish_reason": "stop", "usage": usage}
+
+    def stream(self, messages, model, temperature, max_tokens):
+        key, text, usage = self._reply(messages, model, temperature, max_tokens)
+        self.timing.delay(key)
+        words = text.split(" ")
+        for i, word in enumerate(words):
+            yield {"text": word if i == 0 else " " + word, "finish_reason": None, "usage": None}
+            self.timing.chunk_delay()
+        yield {"text": None, "finish_reason": "stop", "usage": usage}
+
+def _chat_key(messages, model, temperature, max_tokens) -> str:
+    # Streamed and non-streamed requests share keys, so either can replay the other.
+    return request_key("chat", {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens})
+
+class RecordedChatBackend(ChatBackend):
+    """
+    Replays responses saved by RecordingChatBackend. Requests that were never recorded go
+    to fallback (counted in misses), or raise KeyError without one. With replay_latency
+    the recorded response time is slept before answering.
+    """
+    def __init__(self, path: str = None, fallback: ChatBackend = None, replay_latency: bool = False):
+        self.store = RecordingStore(path)
+        self.fallback = fallback
+        self.replay_latency = replay_latency
+        self.misses = 0
+
+    def _lookup(self, messages, model, temperature, max_tokens):
+        response = self.store.next(_chat_key(messages, model, temperature, max_tokens))
+        if response is None:
+            self.misses += 1
+            if self.fallback is None:
+                raise KeyError(f"No recorded chat response for this {model} request in {self.store.path}.")
+        elif self.replay_latency:
+            time.sleep(response.get("latency_ms", 0) / 1000)
+        return response
+
+    def complete(self, messages, model, temperature, max_tokens) -> dict:
+        response = self._lookup(messages, model, temperature, max_tokens)
+        if response is None:
+            return self.fallback.complete(messages, model, temperature, max_tokens)
+        return {"text": response["text"], "finish_reason": response["finish_reason"], "usage": response["usage"]}
+
+    def stream(self, messages, model, temperature, max_tokens):
+        response = self._lookup(messages, model, temperature, max_tokens)
+        if response is None:
+            yield from self.fallback.stream(messages, model, temperature, max_tokens)
+            return
+        yield {"text": response["text"], "finish_reason": response["finish_reason"], "usage": response["usage"]}
+
+class RecordingChatBackend(ChatBackend):
+    """
+    Passes requests to inner (the live backend by default) and records every response.
+    """
+    def __init__(self, inner: ChatBackend = None, path: str = None):
+        self.inner = inner or AzureChatBackend()
+        self.store = RecordingStore(path)
+
+    def complete(self, messages, model, temperature, max_tokens) -> dict:
+        start = time.perf_counter()
+        reply = self.inner.complete(messages, model, temperature, max_tokens)
+        self.store.append(_chat_key(messages, model, temperature, max_tokens), "chat",
+                          {**reply, "latency_ms": (time.perf_counter() - start) * 1000})
+        return reply
+
+    async def acomplete(self, messages, model, temperature, max_tokens) -> dict:
+        start = time.perf_counter()
+        reply = await self.inner.acomplete(messages, model, temperature, max_tokens)
+        self.store.append(_chat_key(messages, model, temperature, max_tokens), "chat",
+                          {**reply, "latency_ms": (time.perf_counter() - start) * 1000})
+        return reply
+
+    def stream(self, messages, model, temperature, max_tokens):
+        start = time.perf_counter()
+        parts, finish_reason, usage = [], None, None
+        for delta in self.inner.stream(messages, model, temperature, max_tokens):
+            parts.append(delta["text"] or "")
+            finish_reason = delta["finish_reason"] or finish_reason
+            usage = delta["usage"] or usage
+            yield delta
+        self.store.append(_chat_key(messages, model, temperature, max_tokens), "chat", {
+            "text": "".join(parts),
+            "finish_reason": finish_reason,
+            "usage": usage,
+            "latency_ms": (time.perf_counter() - start) * 1000,
+        })
+
+def make_backend(name: str) -> ChatBackend:
+    if name == "live":
+        return AzureChatBackend()
+    if name == "record":
+        return RecordingChatBackend()
+    if name == "recorded":
+        return RecordedChatBackend(fallback=SyntheticChatBackend())
+    if name == "synthetic":
+        return SyntheticChatBackend()
+    raise ValueError(f"Unknown LLM backend '{name}'. Expected live, record, recorded or synthetic.")
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_backend() -> ChatBackend:
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = make_backend(LLM_BACKEND)
+        return _backend
+
+def set_backend(backend: ChatBackend) -> ChatBackend:
+    """
+    Replaces the active backend. Returns the previous one.
+    """
+    global _backend
+    with _backend_lock:
+        previous, _backend = _backend, backend
+        return previous
@@ -1,34 +1,57 @@
 # gpt_interface/gpt_client.py
 
-import os
-from openai import AzureOpenAI
-from dotenv import load_dotenv
-
-load_dotenv()
-
-client = AzureOpenAI(
-    api_key=os.getenv("AZURE_OPENAI_KEY"),
-    api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
-    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-)
-
-DEPLOYMENTS = {
-    "gpt4o": os.getenv("AZURE_OPENAI_DEPLOYMENT_GPT4O"),
-    "gpt35": os.getenv("AZURE_OPENAI_DEPLOYMENT_GPT35"),
-}
-
-def call_chat_model(messages, model="gpt4o", temperature=0.7, max_tokens=2048):
-    deployment = DEPLOYMENTS[model]
-    response = client.chat.completions.create(
-        model=deployment,
-        messages=messages,
-        temperature=temperature,
-        max_tokens=max_tokens,
-    )
-    
-    choice = response.choices[0]
-    content = choice.message.content
-    finish_reason = choice.finish_reason
+from utils.tracing import span
+from gpt_interface.backends import get_backend
+from utils.llm_cache import cached_call, acached_call
+from utils import llm_async, resilience
+
+TRUNCATION_NOTICE = "\n\n*[The story was cut short as the narration became too long. You can ask for a summary or to continue.]*"
+
+def _record_usage(s: dict, usage):
+    if usage is not None:
+        s["prompt_tokens"] = usage["prompt_tokens"]
+        s["response_tokens"] = usage["response_tokens"]
+
+def call_chat_model(messages, model="gpt4o", temperature=0.7, max_tokens=2048, cache=False):
+    """
+    Returns the completion text. With cache=True an identical earlier request (same
+    messages, model and sampling parameters) is answered from utils/llm_cache.py; only
+    use it where the same answer is as good as a fresh one.
+    """
+    if cache:
+        request = {"messages": messages, "temperature": temperature, "max_tokens": max_tokens,
+                   "backend": type(get_backend()).__name__}
+        return cached_call("chat", model, request, lambda: _call_chat_model(messages, model, temperature, max_tokens))
+    return _call_chat_model(messages, model, temperature, max_tokens)
+
+def _call_chat_model(messages, model, temperature, max_tokens):
+    with span("llm.chat", model=model) as s:
+        reply = resilience.call(model, lambda: get_backend().complete(messages, model, temperature, max_tokens))
+        _record_usage(s, reply["usage"])
+    return _final_text(reply)
+
+async def acall_chat_model(messages, model="gpt4o", temperature=0.7, max_tokens=2048, cache=False):
+    """
+    Async version of call_chat_model, for the shared LLM loop (utils/llm_async.py): the
+    request uses the loop's pooled connections and counts against LLM_MAX_CONCURRENCY.
+    """
+    if cache:
+        request = {"messages": messages, "temperature": temperature, "max_tokens": max_tokens,
+                   "backend": type(get_backend()).__name__}
+        return await acached_call("chat", model, request, lambda: _acall_chat_model(messages, model, temperature, max_tokens))
+    return await _acall_chat_model(messages, model, temperature, max_tokens)
+
+async def _acall_chat_model(messages, model, temperature, max_tokens):
+    with span("llm.chat", model=model) as s:
+        reply = await resilience.acall(model, lambda: llm_async.limited(
+            get_backend().acomplete(messages, model, temperature, max_tokens)
+        ))
+        _record_usage(s, reply["usage"])
+    return _final_text(reply)
+
+def _final_text(reply: dict) -> str:
+    content = reply["text"]
+    finish_reason = reply["finish_reason"]
 
     # --- THIS IS THE FIX ---
     # Start with the content, or an empty string if content is None
@@ -36,6 +59,34 @@ def call_chat_model(messages, model="gpt4o", temperature=0.7, max_tokens=2048):
 
     # If the AI was cut off because of the token limit, add a warning.
     if finish_reason == "length":
-        final_response += "\n\n*[The story was cut short as the narration became too long. You can ask for a summary or to continue.]*"
+        final_response += TRUNCATION_NOTICE
+
+    return final_response
+
+def stream_chat_model(messages, model="gpt4o", temperature=0.7, max_tokens=2048, hedge=False):
+    """
+    Generator version of call_chat_model that yields the completion text as it arrives.
+    Leading whitespace is dropped, and if the model was cut off by the token limit the
+    truncation warning is yielded as the final delta, just like call_chat_model.
 
-    return final_response
\ No newline at end of file
+    With hedge=True a second request is raced against the first when it is slower than
+    usual to start (see hedged_stream in utils/resilience.py).
+    """
+    open_stream = resilience.hedged_stream if hedge else resilience.stream
+    with span("llm.chat_stream", model=model) as s:
+        finish_reason = None
+        started = False
+        for chunk in open_stream(model, lambda: get_backend().stream(messages, model, temperature, max_tokens)):
+            _record_usage(s, chunk["usage"])
+            delta = chunk["text"]
+            if delta:
+                if not started:
+                    delta = delta.lstrip()
+                    started = bool(delta)
+                if delta:
+                    yield delta
+            if chunk["finish_reason"]:
+                finish_reason = chunk["finish_reason"]
+
+    if finish_reason == "length":
+        yield TRUNCATION_NOTICE
@@ -1,22 +1,29 @@
 # launcher.py
 
 import streamlit as st
-from sqlalchemy.orm import sessionmaker
 from sqlalchemy import desc
+import itertools
 import traceback # Import the traceback module
 
-from db.engine import get_engine
+from db.engine import SessionLocal
+from db.world_cache import invalidate_world_state
+from db.migrations import start_migrations, wait_for_migrations, get_migration_status
 # Import all schema models needed for deletion/restarting
-from db.schema import Session as SessionModel, Turn, PlayerState, NPC, Quest, WorldFlag, Rumor, Location, ConversationContext, JournalEntry
+from db.schema import Session as SessionModel, Turn, TurnMetric, PlayerState, NPC, Quest, WorldFlag, Rumor, Location, ConversationContext, JournalEntry
 from session_zero import run_session_zero_turn
-from game_loop import run_game_turn 
+from game_loop import run_game_turn_stream, get_last_turn_timings
+from utils.background_jobs import get_job_status, has_pending_jobs, wait_for_session_jobs
+from utils.resilience import LLMUnavailableError
+from memory.index import delete_session_memory
+from memory.ingest import wait_for_ingestion
 from gemini_interface.gemini_client import call_gemini_with_tools
 from dotenv import load_dotenv
 
 load_dotenv()
 
 # --- Configuration and Setup ---
-SessionFactory = sessionmaker(bind=get_engine())
+# Schema upgrades run in the background so a large database doesn't hold up the first page.
+start_migrations()
 st.set_page_config(page_title="AI RPG GM", layout="centered")
 st.title("🎮 AI RPG Game Master")
 
@@ -28,11 +35,31 @@ if "screen" not in st.session_state:
     st.session_state.confirm_delete = False
     st.session_state.confirm_restart = False
 
+def wait_for_schema():
+    """
+    Anything that writes to the database waits for the start-up migrations first.
+    """
+    if not wait_for_migrations(timeout=0):
+        with st.spinner("Upgrading the database (this only happens once)..."):
+            wait_for_migrations()
+
+def show_migration_status():
+    status = get_migration_status()
+    with st.sidebar:
+        if status["state"] == "running":
+            progress = f", {status['progress']}" if status["progress"] else ""
+            st.caption(f"Upgrading the database: {status['current'] or 'starting'}{progress}")
+        elif status["state"] == "failed":
+            st.error(f"Database upgrade failed: {status['error']}")
+
 # --- Deletion and Restart Logic ---
 def delete_campaign(db, session_id_to_delete):
     """
     Deletes all data associated with a specific session_id from the database.
     """
+    wait_for_schema()
+    wait_for_session_jobs(session_id_to_delete)
+    wait_for_ingestion(session_id_to_delete)
     try:
         # Delete all dependent records first
         db.query(ConversationContext).filter(ConversationContext.session_id == session_id_to_delete).delete()
@@ -42,6 +69,7 @@ def delete_campaign(db, session_id_to_delete):
         db.query(PlayerState).filter(PlayerState.session_id == session_id_to_delete).delete()
         db.query(Quest).filter(Quest.session_id == session_id_to_delete).delete()
         db.query(Rumor).filter(Rumor.session_id == session_id_to_delete).delete()
+        db.query(TurnMetric).filter(TurnMetric.session_id == session_id_to_delete).delete()
         db.query(Turn).filter(Turn.session_id == session_id_to_delete).delete()
         db.query(WorldFlag).filter(WorldFlag.session_id == session_id_to_delete).delete()
         
@@ -50,6 +78,8 @@ def delete_campaign(db, session_id_to_delete):
             db.delete(session_to_delete)
         
         db.commit()
+        invalidate_world_state(session_id_to_delete)
+        delete_session_memory(session_id_to_delete)
         st.success(f"Campaign {session_id_to_delete} has been permanently deleted.")
         st.session_state.confirm_delete = False
     except Exception as e:
@@ -60,6 +90,9 @@ def restart_campaign(db, session_id_to_restart):
     """
     Deletes all progress for a campaign, but keeps the character and world state.
     """
+    wait_for_schema()
+    wait_for_session_jobs(session_id_to_restart)
+    wait_for_ingestion(session_id_to_restart)
     try:
         # Delete all progress-related records, but NOT PlayerState or Session
         db.query(ConversationContext).filter(ConversationContext.session_id == session_id_to_restart).delete()
@@ -68,10 +101,13 @@ def restart_campaign(db, session_id_to_restart):
         db.query(NPC).filter(NPC.session_id == session_id_to_restart).delete()
         db.query(Quest).filter(Quest.session_id == session_id_to_restart).delete()
         db.query(Rumor).filter(Rumor.session_id == session_id_to_restart).delete()
+        db.query(TurnMetric).filter(TurnMetric.session_id == session_id_to_restart).delete()
         db.query(Turn).filter(Turn.session_id == session_id_to_restart).delete()
         db.query(WorldFlag).filter(WorldFlag.session_id == session_id_to_restart).delete()
         
         db.commit()
+        invalidate_world_state(session_id_to_restart)
+        delete_session_memory(session_id_to_restart)
         st.success(f"Campaign {session_id_to_restart} has been restarted.")
         st.session_state.confirm_restart = False
     except Exception as e:
@@ -82,7 +118,7 @@ def restart_campaign(db, session_id_to_restart):
 # --- UI View Functions ---
 
 def show_home_screen():
-    with SessionFactory() as db:
+    with SessionLocal() as db:
         sessions = db.query(SessionModel).order_by(SessionModel.id).all()
         session_map = {f"{s.id} - {s.genre} ({s.tone})": s.id for s in sessions}
         st.subheader("Start or Continue a Game")
@@ -106,6 +142,7 @@ def show_home_screen():
                     turn_count = db.query(Turn).filter_by(session_id=session_id).count()
 
                     if turn_count == 0:
+                        wait_for_schema()
                         with st.spinner("The stage is being set..."):
                             session = db.query(SessionModel).get(session_id)
                             player = db.query(PlayerState).filter_by(session_id=session_id).first()
@@ -125,7 +162,10 @@ def show_home_screen():
                             Set the scene, establish the mood, and end with a prompt that draws the player into the world, asking them "What do you do?".
                             Do not give the player any choices, just describe their current situation.
                             """
-                            opening_scene = call_gemini_with_tools(db, session_id, messages=[{"role": "user", "content": intro_prompt}])
+                            # Plain narration, no tools. Cached: reruns and reloads of a fresh
+                            # campaign show the same opening.
+                            opening_scene = call_gemini_with_tools(db, session_id, messages=[{"role": "user", "content": intro_prompt}],
+                                                                   tools=None, cache=True)
                             st.session_state.messages.append({"role": "assistant", "content": opening_scene})
                     else:
                         turns = db.query(Turn).filter_by(session_id=session_id).order_by(Turn.turn_number).all()
@@ -153,7 +193,7 @@ def show_home_screen():
             c1, c2 = st.columns(2)
             with c1:
                 if st.button("Yes, Delete It", use_container_width=True, type="primary"):
-                    with SessionFactory() as db_for_delete:
+                    with SessionLocal() as db_for_delete:
                         delete_campaign(db_for_delete, st.session_state.session_to_delete)
                     st.rerun()
             with c2:
@@ -166,7 +206,7 @@ def show_home_screen():
             c1, c2 = st.columns(2)
             with c1:
                 if st.button("Yes, Restart It", use_container_width=True, type="primary"):
-                    with SessionFactory() as db_for_restart:
+                    with SessionLocal() as db_for_restart:
                         restart_campaign(db_for_restart, st.session_state.session_to_restart)
                     st.rerun()
             with c2:
@@ -187,8 +227,9 @@ def show_session_zero_ui():
             st.markdown(prompt)
 
         with st.chat_message("assistant"):
+            wait_for_schema()
             with st.spinner("GM is thinking..."):
-                with SessionFactory() as db:
+                with SessionLocal() as db:
                     response = run_session_zero_turn(db, st.session_state.messages)
                     st.markdown(response)
         
@@ -200,8 +241,32 @@ def show_session_zero_ui():
             if st.button("Back to Main Menu"):
                 st.rerun()
 
+def show_background_jobs(session_id):
+    jobs = get_job_status(session_id)
+    if not jobs:
+        return
+    with st.sidebar:
+        # The next turn waits for these, so say so while one is still in flight.
+        st.caption("World simulation (updating...)" if has_pending_jobs(session_id) else "World simulation")
+        for job in reversed(jobs[-5:]):
+            label = f"#{job['id']} {job['name']}: {job['status']}"
+            if job["error"]:
+                label += f" ({job['error']})"
+            st.caption(label)
+
+def show_turn_timings(session_id):
+    timings = get_last_turn_timings(session_id)
+    if not timings:
+        return
+    with st.sidebar:
+        st.caption("Last turn")
+        for stage, ms in sorted(timings.items(), key=lambda item: -item[1]):
+            st.caption(f"{stage}: {ms:.0f} ms")
+
 def show_game_screen():
     st.subheader("⚔️ Adventure in Progress")
+    show_background_jobs(st.session_state.session_id)
+    show_turn_timings(st.session_state.session_id)
     
     for message in st.session_state.messages:
         with st.chat_message(message["role"]):
@@ -213,10 +278,27 @@ def show_game_screen():
             st.markdown(prompt)
 
         with st.chat_message("assistant"):
-            with st.spinner("GM is thinking..."):
-                with SessionFactory() as db:
-                    response = run_game_turn(db, st.session_state.session_id, prompt)
-                    st.markdown(response)
+            wait_for_schema()
+            try:
+                with SessionLocal() as db:
+                    narration = run_game_turn_stream(db, st.session_state.session_id, prompt)
+                    try:
+                        # Keep the spinner up through the logic engine, then render tokens as they arrive.
+                        with st.spinner("GM is thinking..."):
+                            first_delta = next(narration, "")
+                        response = st.write_stream(itertools.chain([first_delta], narration))
+                    finally:
+                        # A rerun or stop abandons the stream mid-way. The turn only commits once
+                        # the stream is exhausted, so closing it early discards the whole turn.
+                        narration.close()
+                        db.rollback()
+            except LLMUnavailableError as e:
+                # The model kept failing even after retries. Nothing from the turn was committed
+                # (see run_game_turn_stream), so the player can safely send the action again.
+                print(f"Turn failed: {e}")
+                st.session_state.messages.pop()
+                st.warning("The GM can't reach the AI service right now. Please wait a moment and try your action again.")
+                return
         
         st.session_state.messages.append({"role": "assistant", "content": response})
         st.rerun()
@@ -224,6 +306,7 @@ def show_game_screen():
 # --- Main App Router ---
 # --- THIS IS THE FIX: Added console printing to the error handler ---
 try:
+    show_migration_status()
     if st.session_state.screen == "home":
         show_home_screen()
     elif st.session_state.screen == "session_zero":
@@ -1,33 +1,230 @@
 # memory/embeddings.py
 
+import hashlib
 import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+import numpy as np
 from sentence_transformers import SentenceTransformer
 from openai import OpenAI
+from utils.tracing import span
 
 _use_openai = os.getenv("USE_OPENAI_EMBEDDINGS", "false").lower() == "true"
+LOCAL_MODEL_NAME = "all-MiniLM-L6-v2"
+OPENAI_MODEL_NAME = "text-embedding-3-small"
+
+# Two cache tiers, both keyed by a hash of (model, text):
+#   - an in-process LRU of the most recently used vectors
+#   - an on-disk SQLite table, so restarts and other workers reuse past embeddings
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.db")
+LRU_CACHE_SIZE = int(os.getenv("EMBEDDING_LRU_SIZE", "4096"))
+# Extra time the first caller waits for concurrent callers to join its batch (0 = don't wait;
+# requests that arrive while a batch is encoding are still folded into the next one).
+BATCH_WINDOW_MS = float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "0"))
+
 _model = None
+_openai_client = None
 
 def load_embedding_model():
     global _model
     if _model is None:
-        _model = SentenceTransformer("all-MiniLM-L6-v2")
+        _model = SentenceTransformer(LOCAL_MODEL_NAME)
     return _model
 
-def embed_text(texts):
-    """
-    Returns list of vector embeddings.
-    Uses OpenAI if USE_OPENAI_EMBEDDINGS=true in .env
-    """
+def _get_openai_client():
+    global _openai_client
+    if _openai_client is None:
+        _openai_client = OpenAI()
+    return _openai_client
+
+def _model_name() -> str:
+    return OPENAI_MODEL_NAME if _use_openai else LOCAL_MODEL_NAME
+
+def _encode(texts: list[str]) -> np.ndarray:
     if _use_openai:
         return _embed_with_openai(texts)
-    else:
-        model = load_embedding_model()
-        return model.encode(texts, convert_to_numpy=True)
+    model = load_embedding_model()
+    return np.asarray(model.encode(texts, convert_to_numpy=True), dtype="float32")
 
 def _embed_with_openai(texts):
-    client = OpenAI()
-    response = client.embeddings.create(
-        model="text-embedding-3-small",
+    response = _get_openai_client().embeddings.create(
+        model=OPENAI_MODEL_NAME,
         input=texts
     )
-    return [e.embedding for e in response.data]
+    return np.asarray([e.embedding for e in response.data], dtype="float32")
+
+# --- Counters ---
+
+_stats_lock = threading.Lock()
+_stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "batches": 0, "encoded_texts": 0}
+
+def _count(name: str, amount: int = 1):
+    if amount:
+        with _stats_lock:
+            _stats[name] += amount
+
+def get_embedding_stats() -> dict:
+    with _stats_lock:
+        return dict(_stats)
+
+# --- In-memory LRU tier ---
+
+_lru = OrderedDict()
+_lru_lock = threading.Lock()
+
+def _lru_get(key: str):
+    with _lru_lock:
+        vector = _lru.get(key)
+        if vector is not None:
+            _lru.move_to_end(key)
+        return vector
+
+def _lru_put(key: str, vector: np.ndarray):
+    with _lru_lock:
+        _lru[key] = vector
+        _lru.move_to_end(key)
+        while len(_lru) > LRU_CACHE_SIZE:
+            _lru.popitem(last=False)
+
+# --- On-disk tier ---
+
+_disk = None
+_disk_lock = threading.Lock()
+
+def _get_disk_cache():
+    global _disk
+    if _disk is None:
+        _disk = sqlite3.connect(EMBEDDING_CACHE_PATH, check_same_thread=False)
+        _disk.execute("PRAGMA journal_mode=WAL")
+        _disk.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, model TEXT NOT NULL, dim INTEGER NOT NULL, vector BLOB NOT NULL)"
+        )
+        _disk.commit()
+    return _disk
+
+def _disk_get_many(keys: list[str]) -> dict:
+    found = {}
+    with _disk_lock:
+        db = _get_disk_cache()
+        # Stay well under SQLite's bound-parameter limit.
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = db.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch)
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype="float32")
+    return found
+
+def _disk_put_many(items: dict):
+    model = _model_name()
+    with _disk_lock:
+        db = _get_disk_cache()
+        db.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, model, dim, vector) VALUES (?, ?, ?, ?)",
+            [(key, model, len(vector), vector.tobytes()) for key, vector in items.items()]
+        )
+        db.commit()
+
+# --- Micro-batching ---
+
+class _MicroBatcher:
+    """
+    Coalesces concurrent encode requests into a single model call. The first caller
+    becomes the leader and keeps draining the queue until it is empty; everyone else
+    just waits for their result.
+    """
+    def __init__(self, window_ms: float):
+        self.window_s = window_ms / 1000
+        self._lock = threading.Lock()
+        self._pending = []
+        self._draining = False
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        future = Future()
+        with self._lock:
+            self._pending.append((texts, future))
+            leader = not self._draining
+            self._draining = True
+
+        if leader:
+            if self.window_s:
+                time.sleep(self.window_s)
+            while True:
+                with self._lock:
+                    batch, self._pending = self._pending, []
+                    if not batch:
+                        self._draining = False
+                        break
+                self._run(batch)
+
+        return future.result()
+
+    def _run(self, batch):
+        all_texts = [text for texts, _ in batch for text in texts]
+        try:
+            vectors = _encode(all_texts)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        _count("batches")
+        _count("encoded_texts", len(all_texts))
+        offset = 0
+        for texts, future in batch:
+            future.set_result(vectors[offset:offset + len(texts)])
+            offset += len(texts)
+
+_batcher = _MicroBatcher(BATCH_WINDOW_MS)
+
+def _cache_key(text: str) -> str:
+    return hashlib.sha256(f"{_model_name()}\x00{text}".encode("utf-8")).hexdigest()
+
+def embed_text(texts):
+    """
+    Returns a float32 array of vector embeddings, one row per text.
+    Uses OpenAI if USE_OPENAI_EMBEDDINGS=true in .env
+    Previously seen texts are served from the LRU / on-disk cache; the rest are
+    encoded together in one (micro-batched) model call.
+    """
+    if isinstance(texts, str):
+        texts = [texts]
+    with span("embedding", model=_model_name()):
+        return _embed_cached(texts)
+
+def _embed_cached(texts: list[str]) -> np.ndarray:
+    keys = [_cache_key(text) for text in texts]
+    vectors = {}
+
+    for key in keys:
+        vector = _lru_get(key)
+        if vector is not None:
+            vectors[key] = vector
+    _count("memory_hits", sum(1 for key in keys if key in vectors))
+
+    missing = list(dict.fromkeys(key for key in keys if key not in vectors))
+    if missing:
+        from_disk = _disk_get_many(missing)
+        _count("disk_hits", len(from_disk))
+        for key, vector in from_disk.items():
+            vectors[key] = vector
+            _lru_put(key, vector)
+
+    to_encode = {key: text for key, text in zip(keys, texts) if key not in vectors}
+    if to_encode:
+        _count("misses", len(to_encode))
+        encoded = _batcher.encode(list(to_encode.values()))
+        new_items = {}
+        for key, vector in zip(to_encode.keys(), encoded):
+            vector = np.ascontiguousarray(vector, dtype="float32")
+            vectors[key] = vector
+            new_items[key] = vector
+            _lru_put(key, vector)
+        _disk_put_many(new_items)
+
+    if not keys:
+        return np.zeros((0, 0), dtype="float32")
+    return np.stack([vectors[key] for key in keys])
@@ -1,36 +1,429 @@
 # memory/index.py
 
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import faiss
 import numpy as np
 from memory.embeddings import embed_text
+from memory.chunker import chunk_text
+from utils.tracing import span
 
-# Each session gets its own FAISS index
-# Maps: session_id -> (index, id_to_chunk)
+# Each session's memories are persisted under MEMORY_DIR as four files:
+#   session_<id>.json         -> header ({"dim": 384}, plus the ANN snapshot info once migrated)
+#   session_<id>.vec          -> raw float32 vectors, appended to on every add
+#   session_<id>.meta         -> raw CHUNK_META_DTYPE records, one per vector
+#   session_<id>.chunks.jsonl -> one JSON line per chunk, in the same order as the vectors
+# Nothing is ever rewritten in place, so a turn only costs an append.
+MEMORY_DIR = os.getenv("MEMORY_DIR", "memory_store")
+LOAD_BLOCK_SIZE = 4096
+
+# Sessions start on an exact IndexFlatL2. Once a session holds ANN_THRESHOLD chunks it is
+# migrated to an approximate index ("hnsw", "ivf" or "ivfpq"; "flat" disables migration).
+# The migrated index is snapshotted to session_<id>.<kind>.faiss; chunks added after the
+# snapshot are replayed from the vector file on load, and the snapshot is rebuilt (and
+# IVF lists retrained) whenever the session doubles in size. Migrations are built in the
+# background, without any lock; the session keeps searching its current index until the
+# new one is swapped in.
+ANN_INDEX_KINDS = ("flat", "hnsw", "ivf", "ivfpq")
+ANN_INDEX_KIND = os.getenv("MEMORY_ANN_INDEX", "hnsw")
+ANN_THRESHOLD = int(os.getenv("MEMORY_ANN_THRESHOLD", "5000"))
+HNSW_M = 32
+HNSW_EF_SEARCH = 64
+IVF_NPROBE = 16
+PQ_SUBVECTOR_DIM = 8
+
+# Compact per-chunk metadata, kept as a numpy structured array so stages after the
+# vector search can filter and weight hits without touching the database.
+CHUNK_META_DTYPE = np.dtype([
+    ("turn_number", "<i4"),   # -1 when the chunk isn't tied to a turn
+    ("created_at", "<f8"),    # unix timestamp
+    ("source_type", "u1"),    # index into SOURCE_TYPES
+])
+SOURCE_TYPES = ("turn", "journal", "simulation", "other")
+
+class SessionMemory:
+    """
+    In-memory view of one session's memories: the FAISS index, the chunk texts and
+    their metadata, all sharing the same row ids.
+    """
+    def __init__(self, index, chunks: list[str], meta: np.ndarray, ann_rows: int = 0):
+        self.index = index
+        self.chunks = chunks
+        self.meta = meta
+        self.ann_rows = ann_rows  # rows covered by the on-disk ANN snapshot, 0 if none
+        self.migrating = False
+
+    def __len__(self):
+        return len(self.chunks)
+
+# Each session gets its own memory (loaded lazily from disk)
+# Maps: session_id -> SessionMemory
 _index_store = {}
+# _store_lock only guards the two dicts. Loading, rebuilding or appending to a session's
+# memory holds that session's own lock, so a slow re-embed never stalls the other sessions.
+_store_lock = threading.Lock()
+_session_locks = {}  # session_id -> RLock
+_migration_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gm-memory-ann")
+
+def _session_lock(session_id: int):
+    with _store_lock:
+        return _session_locks.setdefault(session_id, threading.RLock())
+
+def _session_paths(session_id: int):
+    base = os.path.join(MEMORY_DIR, f"session_{session_id}")
+    return base + ".json", base + ".vec", base + ".meta", base + ".chunks.jsonl"
+
+def _read_chunks(chunks_path: str) -> list[str]:
+    chunks = []
+    with open(chunks_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                chunks.append(json.loads(line)["text"])
+            except (json.JSONDecodeError, KeyError):
+                # A torn final line from a crash mid-append; everything after it is unusable.
+                break
+    return chunks
+
+def _read_header(session_id: int) -> dict:
+    with open(_session_paths(session_id)[0], "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _write_header(session_id: int, header: dict):
+    header_path = _session_paths(session_id)[0]
+    tmp_path = header_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(header, f)
+    os.replace(tmp_path, header_path)
+
+def _ann_path(session_id: int, kind: str) -> str:
+    return os.path.join(MEMORY_DIR, f"session_{session_id}.{kind}.faiss")
+
+def build_index(kind: str, dim: int, training_vectors: np.ndarray = None):
+    """
+    Index factory. Returns an empty FAISS index of the given kind, trained on
+    training_vectors if the kind needs training (ivf, ivfpq).
+    """
+    if kind not in ANN_INDEX_KINDS:
+        raise ValueError(f"Unknown index kind '{kind}'. Expected one of {ANN_INDEX_KINDS}.")
+
+    if kind == "flat":
+        return faiss.IndexFlatL2(dim)
+
+    if kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, HNSW_M)
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+        return index
+
+    n = len(training_vectors)
+    # ~4*sqrt(n) lists, but never so many that a list gets fewer than ~39 training points.
+    nlist = max(1, min(int(4 * np.sqrt(n)), n // 39))
+    quantizer = faiss.IndexFlatL2(dim)
+    if kind == "ivf":
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+    else:
+        m = max(1, dim // PQ_SUBVECTOR_DIM)
+        while dim % m:
+            m -= 1
+        # 8-bit codes need ~256*39 training points; use smaller codebooks for smaller sessions.
+        nbits = int(min(8, max(4, np.log2(max(n, 1) / 39))))
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, m, nbits)
+    index.train(np.ascontiguousarray(training_vectors, dtype="float32"))
+    index.nprobe = min(IVF_NPROBE, nlist)
+    return index
+
+def _add_from_file(index, vec_path: str, dim: int, start: int, stop: int):
+    if stop <= start:
+        return
+    vectors = np.memmap(vec_path, dtype="float32", mode="r", shape=(stop, dim))
+    for block in range(start, stop, LOAD_BLOCK_SIZE):
+        index.add(np.ascontiguousarray(vectors[block:min(block + LOAD_BLOCK_SIZE, stop)]))
+    del vectors
+
+def _is_current(session_id: int, memory) -> bool:
+    with _store_lock:
+        return _index_store.get(session_id) is memory
+
+def _migrate_to_ann(session_id: int, memory):
+    """
+    Rebuilds a session's index as ANN_INDEX_KIND from the vector file and snapshots it.
+    The build holds no lock (the rows it reads are never rewritten); only the swap takes
+    the session's lock, and catches the new index up on chunks added in the meantime.
+    """
+    kind = ANN_INDEX_KIND
+    ann_path = _ann_path(session_id, kind)
+    try:
+        with _session_lock(session_id):
+            if not _is_current(session_id, memory):
+                return
+            dim, n = _read_header(session_id)["dim"], len(memory)
+        vec_path = _session_paths(session_id)[1]
+
+        print(f"Migrating memory index for session {session_id} to '{kind}' ({n} chunks)...")
+        vectors = np.memmap(vec_path, dtype="float32", mode="r", shape=(n, dim))
+        sample_ids = np.random.default_rng(0).choice(n, size=min(n, 100_000), replace=False)
+        index = build_index(kind, dim, training_vectors=np.array(vectors[np.sort(sample_ids)]))
+        del vectors
+        _add_from_file(index, vec_path, dim, 0, n)
+        faiss.write_index(index, ann_path + ".tmp")
+
+        with _session_lock(session_id):
+            if not _is_current(session_id, memory):
+                # Deleted (or reloaded) while we were building.
+                os.remove(ann_path + ".tmp")
+                return
+            os.replace(ann_path + ".tmp", ann_path)
+            header = _read_header(session_id)
+            header["ann"] = {"kind": kind, "rows": n}
+            _write_header(session_id, header)
+            _add_from_file(index, vec_path, dim, n, len(memory))
+            memory.index = index
+            memory.ann_rows = n
+    except Exception as e:
+        # A session deleted mid-build takes its vector file with it; nothing to report.
+        if _is_current(session_id, memory):
+            print(f"ERROR migrating memory index for session {session_id}: {e}")
+    finally:
+        memory.migrating = False
+
+def _make_meta(count: int, turn_number: int = None, source_type: str = "turn", created_at: float = None) -> np.ndarray:
+    meta = np.zeros(count, dtype=CHUNK_META_DTYPE)
+    meta["turn_number"] = -1 if turn_number is None else turn_number
+    meta["created_at"] = time.time() if created_at is None else created_at
+    meta["source_type"] = SOURCE_TYPES.index(source_type)
+    return meta
 
-def _get_or_create_index(session_id: int, dim: int = 384):
-    if session_id not in _index_store:
+def _load_from_disk(session_id: int):
+    """
+    Memory-maps the session's vector file and loads it into a fresh FAISS index.
+    Returns None if the session has never been persisted.
+    """
+    header_path, vec_path, meta_path, chunks_path = _session_paths(session_id)
+    if not (os.path.exists(header_path) and os.path.exists(vec_path) and os.path.exists(chunks_path)):
+        return None
+
+    header = _read_header(session_id)
+    dim = header["dim"]
+    chunks = _read_chunks(chunks_path)
+    row_bytes = dim * np.dtype("float32").itemsize
+    vec_rows = os.path.getsize(vec_path) // row_bytes
+
+    if not os.path.exists(meta_path):
+        # Written before metadata was tracked: backfill with "unknown turn" records.
+        with open(meta_path, "wb") as f:
+            f.write(_make_meta(min(vec_rows, len(chunks)), created_at=0.0).tobytes())
+    meta_rows = os.path.getsize(meta_path) // CHUNK_META_DTYPE.itemsize
+
+    # If we crashed between the appends, trim every file back to the rows they agree on.
+    n = min(vec_rows, meta_rows, len(chunks))
+    if os.path.getsize(vec_path) != n * row_bytes:
+        os.truncate(vec_path, n * row_bytes)
+    if os.path.getsize(meta_path) != n * CHUNK_META_DTYPE.itemsize:
+        os.truncate(meta_path, n * CHUNK_META_DTYPE.itemsize)
+    if len(chunks) != n:
+        chunks = chunks[:n]
+        with open(chunks_path, "w", encoding="utf-8") as f:
+            for chunk in chunks:
+                f.write(json.dumps({"text": chunk}) + "\n")
+
+    meta = np.fromfile(meta_path, dtype=CHUNK_META_DTYPE, count=n)
+    ann = header.get("ann")
+    ann_rows = 0
+    if ann and ann["rows"] <= n and os.path.exists(_ann_path(session_id, ann["kind"])):
+        # Start from the ANN snapshot and replay only the chunks added since it was taken.
+        index = faiss.read_index(_ann_path(session_id, ann["kind"]))
+        ann_rows = ann["rows"]
+        _add_from_file(index, vec_path, dim, ann_rows, n)
+    else:
         index = faiss.IndexFlatL2(dim)
-        id_to_chunk = []
-        _index_store[session_id] = (index, id_to_chunk)
-    return _index_store[session_id]
+        _add_from_file(index, vec_path, dim, 0, n)
+
+    print(f"Loaded {n} memory chunks for session {session_id} from disk.")
+    memory = SessionMemory(index, chunks, meta, ann_rows=ann_rows)
+    _maybe_migrate(session_id, memory)
+    return memory
+
+def _append_to_disk(session_id: int, vectors: np.ndarray, meta: np.ndarray, chunks: list[str]):
+    header_path, vec_path, meta_path, chunks_path = _session_paths(session_id)
+    os.makedirs(MEMORY_DIR, exist_ok=True)
+    if not os.path.exists(header_path):
+        with open(header_path, "w", encoding="utf-8") as f:
+            json.dump({"dim": int(vectors.shape[1])}, f)
+
+    # Vectors and metadata first: on load, any rows without a matching chunk line are trimmed.
+    with open(vec_path, "ab") as f:
+        f.write(vectors.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    with open(meta_path, "ab") as f:
+        f.write(meta.tobytes())
+    with open(chunks_path, "a", encoding="utf-8") as f:
+        for chunk in chunks:
+            f.write(json.dumps({"text": chunk}) + "\n")
+
+def _maybe_migrate(session_id: int, memory):
+    """
+    Queues a migration if the session has outgrown its index. Called with the session's lock held.
+    """
+    if ANN_INDEX_KIND == "flat" or len(memory) < ANN_THRESHOLD or memory.migrating:
+        return
+    if memory.ann_rows == 0 or len(memory) >= 2 * memory.ann_rows:
+        memory.migrating = True
+        _migration_executor.submit(_migrate_to_ann, session_id, memory)
+
+def _rebuild_from_turns(session_id: int):
+    """
+    Re-embeds the session's stored turns when its memory files are missing
+    (e.g. a database carried over from before memories were persisted).
+    """
+    # Imported here so the memory package doesn't need a database just to be imported.
+    from db.engine import get_session
+    from db.schema import Turn
+
+    db = get_session()
+    try:
+        turns = db.query(Turn).filter_by(session_id=session_id).order_by(Turn.turn_number).all()
+        chunks, metas = [], []
+        for t in turns:
+            turn_chunks = chunk_text(f"Player: {t.player_input}\nGM: {t.gm_response}")
+            created_at = t.timestamp.timestamp() if t.timestamp else 0.0
+            chunks.extend(turn_chunks)
+            metas.append(_make_meta(len(turn_chunks), turn_number=t.turn_number, created_at=created_at))
+    finally:
+        db.close()
 
-def add_chunks(chunks: list[str], session_id: int):
-    vectors = embed_text(chunks)
-    index, id_to_chunk = _get_or_create_index(session_id, dim=vectors.shape[1])
-    index.add(np.array(vectors))
-    id_to_chunk.extend(chunks)
+    if not chunks:
+        return None
 
-def search_chunks(query: str, session_id: int, k: int = 5) -> list[str]:
-    index, id_to_chunk = _get_or_create_index(session_id)
-    query_vec = embed_text([query])
+    print(f"Rebuilding memory index for session {session_id} from {len(turns)} stored turns...")
+    vectors = np.asarray(embed_text(chunks), dtype="float32")
+    meta = np.concatenate(metas)
+    _append_to_disk(session_id, vectors, meta, chunks)
+    index = faiss.IndexFlatL2(vectors.shape[1])
+    index.add(vectors)
+    memory = SessionMemory(index, list(chunks), meta)
+    _maybe_migrate(session_id, memory)
+    return memory
+
+def _get_or_create_index(session_id: int, dim: int = 384) -> SessionMemory:
+    with _store_lock:
+        memory = _index_store.get(session_id)
+    if memory is not None:
+        return memory
+    with _session_lock(session_id):
+        with _store_lock:
+            memory = _index_store.get(session_id)
+        if memory is None:
+            memory = _load_from_disk(session_id)
+            if memory is None and session_id is not None:
+                memory = _rebuild_from_turns(session_id)
+            if memory is None:
+                memory = SessionMemory(faiss.IndexFlatL2(dim), [], np.zeros(0, dtype=CHUNK_META_DTYPE))
+            with _store_lock:
+                _index_store[session_id] = memory
+        return memory
+
+def delete_session_memory(session_id: int):
+    """
+    Forgets a session's memories: drops the loaded index and deletes its files. Called when
+    a campaign is deleted or restarted, since SQLite can hand a deleted session's id to the
+    next campaign.
+    """
+    with _session_lock(session_id):
+        with _store_lock:
+            _index_store.pop(session_id, None)
+        header_path = _session_paths(session_id)[0]
+        paths = list(_session_paths(session_id)) + [header_path + ".tmp"]
+        paths += [_ann_path(session_id, kind) + suffix for kind in ANN_INDEX_KINDS for suffix in ("", ".tmp")]
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+def add_chunks(chunks: list[str], session_id: int, turn_number: int = None, source_type: str = "turn"):
+    if not chunks:
+        return
+    vectors = np.asarray(embed_text(chunks), dtype="float32")
+    meta = _make_meta(len(chunks), turn_number=turn_number, source_type=source_type)
+    with _session_lock(session_id):
+        memory = _get_or_create_index(session_id, dim=vectors.shape[1])
+        # A rebuild from the turns table may already have picked up the turn being stored.
+        if turn_number is not None and np.any(
+            (memory.meta["turn_number"] == turn_number) & (memory.meta["source_type"] == meta["source_type"][0])
+        ):
+            return
+        _append_to_disk(session_id, vectors, meta, chunks)
+        memory.index.add(vectors)
+        memory.chunks.extend(chunks)
+        memory.meta = np.concatenate([memory.meta, meta])
+        _maybe_migrate(session_id, memory)
+
+def embed_query(query: str) -> np.ndarray:
+    return np.asarray(embed_text([query]), dtype="float32")[0]
+
+def get_chunk_vectors(session_id: int, ids: list[int]) -> np.ndarray:
+    """
+    Reads the stored vectors for the given chunk ids straight from the session's vector file.
+    """
+    vec_path = _session_paths(session_id)[1]
+    if not ids or not os.path.exists(vec_path):
+        return np.zeros((0, 0), dtype="float32")
+    vectors = np.memmap(vec_path, dtype="float32", mode="r").reshape(-1, _read_header(session_id)["dim"])
+    return np.array(vectors[ids])
+
+def _make_hit(memory: SessionMemory, session_id: int, chunk_id: int, distance: float) -> dict:
+    record = memory.meta[chunk_id]
+    turn_number = int(record["turn_number"])
+    return {
+        "id": chunk_id,
+        "session_id": session_id,
+        "text": memory.chunks[chunk_id],
+        "distance": distance,  # squared L2 distance to the query; lower is closer
+        "turn_number": turn_number if turn_number >= 0 else None,
+        "created_at": float(record["created_at"]),
+        "source_type": SOURCE_TYPES[record["source_type"]],
+    }
+
+def get_hits(session_id: int, ids: list[int], query_vec: np.ndarray) -> list[dict]:
+    """
+    Builds hit records for specific chunk ids, scored against the query like a FAISS search.
+    """
+    memory = _get_or_create_index(session_id)
+    ids = [i for i in ids if 0 <= i < len(memory)]
+    if not ids:
+        return []
+    vectors = get_chunk_vectors(session_id, ids)
+    distances = ((vectors - query_vec.reshape(1, -1)) ** 2).sum(axis=1)
+    return [_make_hit(memory, session_id, i, float(d)) for i, d in zip(ids, distances)]
+
+def search_chunks(query: str, session_id: int, k: int = 5, query_vec: np.ndarray = None) -> list[dict]:
+    """
+    Returns up to k hit records, nearest first. Each hit carries the chunk id, text,
+    distance, session_id, turn_number, created_at and source_type.
+    Pass query_vec to reuse an embedding the caller already has.
+    """
+    memory = _get_or_create_index(session_id)
 
     # Make sure we don't ask for more chunks than exist
-    k = min(k, len(id_to_chunk))
+    k = min(k, len(memory))
     if k == 0:
         return []
 
-    D, I = index.search(np.array(query_vec), k)
+    if query_vec is None:
+        query_vec = embed_query(query)
+    with span("faiss_search", model=type(memory.index).__name__):
+        D, I = memory.index.search(query_vec.reshape(1, -1), k)
 
     # Filter out invalid indices
-    return [id_to_chunk[i] for i in I[0] if 0 <= i < len(id_to_chunk)]
+    return [
+        _make_hit(memory, session_id, int(i), float(d))
+        for d, i in zip(D[0], I[0]) if 0 <= i < len(memory)
+    ]
+
+def get_recent_chunk_ids(session_id: int, n: int = 20) -> list[int]:
+    """
+    Returns the ids of the session's n most recently stored chunks, oldest first.
+    """
+    total = len(_get_or_create_index(session_id))
+    return list(range(max(0, total - n), total)) if n > 0 else []
@@ -1,13 +1,48 @@
 # memory/ingest.py
 
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 from memory.chunker import chunk_text
 from memory.index import add_chunks
 
-def chunk_and_store(text: str, session_id: int, max_words: int = 200, overlap: int = 20) -> list[str]:
+# Embedding a turn is pure CPU/network work that nothing in the current turn depends on,
+# so it can run after the turn returns. One worker keeps each session's chunks in order.
+_ingest_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gm-memory")
+_pending = {}   # session_id -> set of Futures
+_pending_lock = threading.Lock()
+
+def chunk_and_store(text: str, session_id: int, max_words: int = 200, overlap: int = 20, turn_number: int = None, source_type: str = "turn") -> list[str]:
     """
     Chunks text, embeds, and adds to vector index for session.
     Returns the list of text chunks stored.
     """
     chunks = chunk_text(text, max_words=max_words, overlap=overlap)
-    add_chunks(chunks, session_id)
+    add_chunks(chunks, session_id, turn_number=turn_number, source_type=source_type)
     return chunks
+
+def _forget(session_id: int, future):
+    with _pending_lock:
+        _pending.get(session_id, set()).discard(future)
+    if future.exception():
+        print(f"ERROR storing memory for session {session_id}: {future.exception()}")
+
+def chunk_and_store_async(text: str, session_id: int, **kwargs):
+    """
+    Queues chunk_and_store to run in the background. Returns the Future.
+    """
+    future = _ingest_executor.submit(chunk_and_store, text, session_id, **kwargs)
+    with _pending_lock:
+        _pending.setdefault(session_id, set()).add(future)
+    future.add_done_callback(lambda f: _forget(session_id, f))
+    return future
+
+def wait_for_ingestion(session_id: int, timeout: float = None) -> bool:
+    """
+    Blocks until the session's queued memories have been stored. Returns False on timeout.
+    """
+    with _pending_lock:
+        pending = list(_pending.get(session_id, ()))
+    if not pending:
+        return True
+    _, not_done = wait(pending, timeout=timeout)
+    return not not_done
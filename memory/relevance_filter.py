@@ -1,6 +1,7 @@
 # memory/relevance_filter.py
 
 from gemini_interface.gemini_client import call_gemini_with_tools
+from world_tools import RELEVANCE_TOOLS
 
 def filter_relevant_chunks(user_input: str, chunks: list, top_n: int = 5):
     """
@@ -29,7 +30,9 @@ Prior memory:
     # --- THIS IS THE FIX ---
     # We now call with return_after_tools=True. This tells the client to execute the
     # 'select_relevant_memories' tool and return its result directly, preventing a loop.
-    response = call_gemini_with_tools(None, None, prompt, model_name='gemini-2.5-flash', return_after_tools=True)
+    # The selection only depends on the prompt, so repeated queries are served from the cache.
+    response = call_gemini_with_tools(None, None, prompt, model_name='gemini-2.5-flash',
+                                      tools=RELEVANCE_TOOLS, return_after_tools=True, cache=True)
 
     if isinstance(response, list):
         try:
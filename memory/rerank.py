@@ -0,0 +1,105 @@
+# memory/rerank.py
+
+import os
+import numpy as np
+from memory.index import get_chunk_vectors
+from memory.relevance_filter import filter_relevant_chunks
+
+# Local rerankers run in milliseconds and need no network:
+#   "threshold"     -> drop hits further than MEMORY_MAX_DISTANCE (keeping at least
+#                      MEMORY_MIN_HITS), keep the nearest top_n
+#   "mmr"           -> threshold, then Maximal Marginal Relevance to avoid near-duplicate memories
+#   "cross-encoder" -> threshold, then score (query, chunk) pairs with a small CPU cross-encoder
+# "llm" keeps the old Gemini relevance filter, which is also the fallback if the
+# cross-encoder can't be loaded.
+RERANK_MODES = ("threshold", "mmr", "cross-encoder", "llm")
+RERANK_MODE = os.getenv("MEMORY_RERANK_MODE", "mmr")
+
+# FAISS returns squared L2 distances; for normalized embeddings d = 2 - 2*cosine, so 1.2
+# keeps hits with cosine >= 0.4. MiniLM puts loosely related but useful turns below that,
+# so the MIN_HITS nearest hits are always kept, however far they are; the threshold only
+# trims the tail beyond them.
+MAX_DISTANCE = float(os.getenv("MEMORY_MAX_DISTANCE", "1.2"))
+MIN_HITS = int(os.getenv("MEMORY_MIN_HITS", "2"))
+MMR_LAMBDA = float(os.getenv("MEMORY_MMR_LAMBDA", "0.7"))
+CROSS_ENCODER_MODEL = os.getenv("MEMORY_CROSS_ENCODER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+
+_cross_encoder = None
+
+def load_cross_encoder():
+    global _cross_encoder
+    if _cross_encoder is None:
+        from sentence_transformers import CrossEncoder
+        _cross_encoder = CrossEncoder(CROSS_ENCODER_MODEL, device="cpu")
+    return _cross_encoder
+
+def threshold_hits(hits: list[dict], max_distance: float = None, min_hits: int = None) -> list[dict]:
+    """
+    The hits within max_distance, nearest first, but never fewer than the min_hits nearest.
+    """
+    max_distance = MAX_DISTANCE if max_distance is None else max_distance
+    min_hits = MIN_HITS if min_hits is None else min_hits
+    ranked = sorted(hits, key=lambda hit: hit["distance"])
+    return [hit for i, hit in enumerate(ranked) if i < min_hits or hit["distance"] <= max_distance]
+
+def mmr_select(query_vec: np.ndarray, hits: list[dict], session_id: int, top_n: int, lambda_mult: float = None) -> list[dict]:
+    """
+    Maximal Marginal Relevance: greedily picks hits that are close to the query
+    but far from the hits already picked.
+    """
+    lambda_mult = MMR_LAMBDA if lambda_mult is None else lambda_mult
+    if len(hits) <= 1 or query_vec is None:
+        return hits[:top_n]
+
+    vectors = get_chunk_vectors(session_id, [hit["id"] for hit in hits])
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.maximum(norms, 1e-12)
+    query = query_vec / max(np.linalg.norm(query_vec), 1e-12)
+
+    query_sim = vectors @ query
+    pair_sim = vectors @ vectors.T
+
+    selected = []
+    remaining = list(range(len(hits)))
+    while remaining and len(selected) < top_n:
+        if selected:
+            redundancy = pair_sim[np.ix_(remaining, selected)].max(axis=1)
+        else:
+            redundancy = np.zeros(len(remaining))
+        scores = lambda_mult * query_sim[remaining] - (1 - lambda_mult) * redundancy
+        best = remaining[int(np.argmax(scores))]
+        selected.append(best)
+        remaining.remove(best)
+
+    return [hits[i] for i in selected]
+
+def cross_encoder_select(user_input: str, hits: list[dict], top_n: int) -> list[dict]:
+    if not hits:
+        return []
+    model = load_cross_encoder()
+    scores = model.predict([(user_input, hit["text"]) for hit in hits])
+    order = np.argsort(-np.asarray(scores))
+    return [hits[i] for i in order[:top_n]]
+
+def rerank_hits(user_input: str, query_vec, hits: list[dict], session_id: int, top_n: int = 5, mode: str = None) -> list[dict]:
+    """
+    Narrows scored vector hits down to the top_n memories worth putting in the prompt.
+    """
+    mode = mode or RERANK_MODE
+    if mode not in RERANK_MODES:
+        raise ValueError(f"Unknown rerank mode '{mode}'. Expected one of {RERANK_MODES}.")
+
+    if mode == "llm":
+        return filter_relevant_chunks(user_input, hits, top_n=top_n)
+
+    candidates = threshold_hits(hits)
+    if mode == "threshold":
+        return candidates[:top_n]
+    if mode == "mmr":
+        return mmr_select(query_vec, candidates, session_id, top_n)
+
+    try:
+        return cross_encoder_select(user_input, candidates, top_n)
+    except Exception as e:
+        print(f"Warning: Cross-encoder reranker unavailable ({e}). Falling back to the LLM relevance filter.")
+        return filter_relevant_chunks(user_input, candidates, top_n=top_n)
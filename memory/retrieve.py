@@ -1,13 +1,55 @@
 # memory/retrieve.py
 
-from memory.index import search_chunks
-from memory.relevance_filter import filter_relevant_chunks
+import os
+from memory.index import search_chunks, get_recent_chunk_ids, get_hits, embed_query
+from memory.rerank import rerank_hits
+from memory.ingest import wait_for_ingestion
+from utils.timing import StageTimer
 
-def retrieve_relevant_chunks(user_input: str, session_id: int, top_k: int = 8):
+# How memories are retrieved for a turn:
+#   "vector"        -> FAISS similarity search only
+#   "vector+rerank" -> FAISS search, then one rerank pass over the hits
+#   "rerank"        -> rerank pass over the most recent chunks, no vector search
+# The reranker itself is chosen by MEMORY_RERANK_MODE (see memory/rerank.py).
+RETRIEVAL_MODES = ("vector", "vector+rerank", "rerank")
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "vector+rerank")
+RERANK_ONLY_WINDOW = 20
+
+def retrieve_relevant_chunks(user_input: str, session_id: int, top_k: int = 8, top_n: int = 5, mode: str = None, timer: StageTimer = None):
     """
-    Retrieves top-k relevant memory chunks for the given session and query.
-    Uses vector similarity + GPT relevance filter.
+    Retrieves the relevant memory hits for the given session and query in a single pass.
+    Returns the hit records from search_chunks (each has at least a "text" key).
+    Each stage (vector search, rerank) runs at most once per call; pass a StageTimer to
+    collect the per-stage timings, otherwise they are printed.
     """
-    rough_matches = search_chunks(user_input, session_id, k=top_k)
-    refined = filter_relevant_chunks(user_input, rough_matches, top_n=5)
-    return [{"text": chunk} for chunk in refined]
+    mode = mode or RETRIEVAL_MODE
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown retrieval mode '{mode}'. Expected one of {RETRIEVAL_MODES}.")
+
+    report = timer is None
+    timer = timer or StageTimer()
+
+    # The previous turn's memories may still be embedding in the background.
+    with timer.stage("wait_for_ingestion"):
+        wait_for_ingestion(session_id)
+
+    with timer.stage("embed_query"):
+        query_vec = embed_query(user_input)
+
+    if mode == "rerank":
+        with timer.stage("recent_chunks"):
+            ids = get_recent_chunk_ids(session_id, n=RERANK_ONLY_WINDOW)
+            candidates = get_hits(session_id, ids, query_vec)
+    else:
+        with timer.stage("vector_search"):
+            candidates = search_chunks(user_input, session_id, k=top_k, query_vec=query_vec)
+
+    if mode == "vector":
+        selected = candidates[:top_n]
+    else:
+        with timer.stage("rerank"):
+            selected = rerank_hits(user_input, query_vec, candidates, session_id, top_n=top_n)
+
+    if report:
+        timer.report(f"retrieval ({mode})")
+    return selected
@@ -0,0 +1,93 @@
+# prompt_builder/budget.py
+
+"""
+Token budgets for the prompt sections. A section whose items don't fit its budget
+keeps its highest-ranked items and drops the rest; build_prompt records what was
+dropped (see get_last_prompt_report in prompt_builder/builder.py).
+
+Token counts come from tiktoken when it is installed and its encoding can be loaded,
+and from a four-characters-per-token estimate otherwise.
+"""
+
+import os
+from datetime import datetime
+from functools import lru_cache
+from utils.tokens import approx_tokens
+
+TOKENIZER_ENCODING = os.getenv("PROMPT_TOKENIZER_ENCODING", "o200k_base")
+
+SECTION_TOKEN_BUDGETS = {
+    "npcs": int(os.getenv("PROMPT_BUDGET_NPCS", "1000")),
+    "quests": int(os.getenv("PROMPT_BUDGET_QUESTS", "400")),
+    "flags": int(os.getenv("PROMPT_BUDGET_FLAGS", "400")),
+    "journal": int(os.getenv("PROMPT_BUDGET_JOURNAL", "600")),
+    "dialogue": int(os.getenv("PROMPT_BUDGET_DIALOGUE", "1500")),
+    "memories": int(os.getenv("PROMPT_BUDGET_MEMORIES", "1500")),
+}
+
+_encoding = None
+_encoding_loaded = False
+
+def _get_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+        except Exception as e:
+            # Not installed, or the encoding file can't be downloaded.
+            print(f"tiktoken unavailable ({e}); estimating prompt tokens from length.")
+    return _encoding
+
+@lru_cache(maxsize=4096)
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding is None:
+        return approx_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+def fit_items(ranked: list, line, budget: int) -> tuple[list, list]:
+    """
+    Takes items best first while their lines (line(item)) fit in budget tokens.
+    Returns (kept, dropped), each in ranked order.
+    """
+    kept, dropped, used = [], [], 0
+    for item in ranked:
+        cost = count_tokens(line(item)) + 1
+        if used + cost <= budget:
+            kept.append(item)
+            used += cost
+        else:
+            dropped.append(item)
+    return kept, dropped
+
+# --- Ranking ---
+
+def mentions(player_input: str, name) -> bool:
+    if not name:
+        return False
+    text = player_input.lower()
+    name = str(name).lower()
+    return name in text or name.replace("_", " ") in text
+
+def rank_npcs(npcs: list, player_input: str, last_talked: dict) -> list:
+    """
+    NPCs named in the player input first, then by how recently the player talked to
+    them (last_talked maps npc id to ConversationContext.last_updated), then newest.
+    """
+    return sorted(npcs, key=lambda n: (
+        mentions(player_input, n["name"]),
+        last_talked.get(n["id"]) or datetime.min,
+        n["id"],
+    ), reverse=True)
+
+def rank_quests(quests: list, player_input: str) -> list:
+    return sorted(quests, key=lambda q: (
+        mentions(player_input, q["name"]),
+        q["status"] == "active",
+        q["id"],
+    ), reverse=True)
+
+def rank_flags(flags: list, player_input: str) -> list:
+    return sorted(flags, key=lambda f: (mentions(player_input, f["key"]), f["id"]), reverse=True)
@@ -1,64 +1,177 @@
 # prompt_builder/builder.py
 
 import json
+from concurrent.futures import ThreadPoolExecutor
 from memory.retrieve import retrieve_relevant_chunks
-from memory.relevance_filter import filter_relevant_chunks
-from db.schema import NPC, Quest, WorldFlag, Session, Turn, ConversationContext, JournalEntry
+from utils.timing import StageTimer
+from utils.tracing import span, submit_traced
+from db.schema import Turn, JournalEntry, ConversationContext
+from db.world_cache import get_world_state
+from prompt_builder.section_cache import render_section
+from prompt_builder.budget import SECTION_TOKEN_BUDGETS, count_tokens, fit_items, rank_npcs, rank_quests, rank_flags
 from sqlalchemy.orm import Session as DBSession
 from sqlalchemy import desc
 
 RECENT_TURN_LIMIT = 3
 JOURNAL_ENTRY_LIMIT = 5
 
-def build_prompt(db: DBSession, session_id: int, player_input: str) -> str:
-    # --- Context Gathering ---
-    raw_chunks = retrieve_relevant_chunks(player_input, session_id)
-    memory_chunks = filter_relevant_chunks(player_input, raw_chunks)
-    memory_section = "\n".join(c["text"] for c in memory_chunks)
-
-    recent_turns = db.query(Turn).filter_by(session_id=session_id)\
-        .order_by(desc(Turn.turn_number)).limit(RECENT_TURN_LIMIT).all()
-    recent_turns.reverse()
-    dialogue_section = "\n".join(
-        f"Player: {t.player_input}\nGM: {t.gm_response}" for t in recent_turns
-    )
-
-    journal_entries = db.query(JournalEntry).filter_by(session_id=session_id)\
-        .order_by(desc(JournalEntry.turn_number)).limit(JOURNAL_ENTRY_LIMIT).all()
-    journal_entries.reverse()
-    journal_section = "\n".join(
-        f"- {entry.entry_text}" for entry in journal_entries
-    )
-
-    npcs = db.query(NPC).filter_by(session_id=session_id).all()
-    quests = db.query(Quest).filter_by(session_id=session_id).all()
-    flags = db.query(WorldFlag).filter_by(session_id=session_id).all()
-    config = db.query(Session).get(session_id)
-    
-    active_quests = [q for q in quests if q.status == 'active']
-    quest_focus_section = ""
-    if active_quests:
-        main_quest = active_quests[0]
-        quest_focus_section = f"""
-[Active Quest Focus]
-You are a master storyteller. Your primary goal is to advance the quest: '{main_quest.name}'.
-The current status is '{main_quest.status}'. The known milestones are: {main_quest.milestones}.
+# Memory retrieval (embedding + vector search + rerank) doesn't use the caller's DB session,
+# so it runs here while the world-state queries run on the calling thread.
+_retrieval_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="gm-retrieval")
+
+_last_prompt_reports = {}
+
+# --- Section renderers ---
+
+def _render_world_key() -> str:
+    return "[Game World Key]\nPower Level Scale: 1 (Child) to 100 (God-like Entity)."
+
+def _render_config(config: dict) -> str:
+    return "[Session Config]\n" + f"Genre: {config['genre']}\nTone: {config['tone']}\nRealism: {config['realism']}\nPower Fantasy: {config['power_fantasy']}"
+
+def _npc_line(n: dict) -> str:
+    return f"{n['name']} ({n['role']}) - Status: {n['status']} (Power: {n['power_level']}, Style: {n['combat_style']})"
+
+def _quest_line(q: dict) -> str:
+    return f"{q['name']}: {q['status']}"
+
+def _flag_line(f: dict) -> str:
+    return f"{f['key']} = {f['value']}"
+
+def _journal_line(entry) -> str:
+    return f"- {entry.entry_text}"
+
+def _dialogue_line(t) -> str:
+    return f"Player: {t.player_input}\nGM: {t.gm_response}"
+
+def _memory_line(chunk: dict) -> str:
+    return chunk["text"]
+
+def _render_list(header: str, line, items: list) -> str:
+    return f"[{header}]\n" + "\n".join(line(item) for item in items).strip()
+
+def _render_quest_focus(quests: list) -> str:
+    active_quests = [q for q in quests if q['status'] == 'active']
+    if not active_quests:
+        return ""
+    main_quest = active_quests[0]
+    return f"""[Active Quest Focus]
+You are a master storyteller. Your primary goal is to advance the quest: '{main_quest['name']}'.
+The current status is '{main_quest['status']}'. The known milestones are: {main_quest['milestones']}.
 Your narration MUST subtly guide the player towards this quest. Mention details in the world that are relevant to this goal.
-If the player seems lost or is acting randomly, use environmental storytelling or NPC dialogue to remind them of their purpose without breaking character.
-"""
+If the player seems lost or is acting randomly, use environmental storytelling or NPC dialogue to remind them of their purpose without breaking character."""
+
+# --- Budgets ---
+
+def _fit(name: str, items: list, line, rank, report: dict, label) -> list:
+    """
+    Returns the items of a section that fit its token budget, in their original order
+    (so the section renders the same way while nothing changes). rank() orders them
+    best first and is only called when they don't all fit.
+    """
+    budget = SECTION_TOKEN_BUDGETS[name]
+    total = sum(count_tokens(line(item)) + 1 for item in items)
+    if total <= budget:
+        report[name] = {"budget": budget, "tokens": total, "kept": len(items), "dropped": []}
+        return items
+
+    kept, dropped = fit_items(rank(), line, budget)
+    report[name] = {
+        "budget": budget,
+        "tokens": sum(count_tokens(line(item)) + 1 for item in kept),
+        "kept": len(kept),
+        "dropped": [label(item) for item in dropped],
+    }
+    kept_ids = {id(item) for item in kept}
+    return [item for item in items if id(item) in kept_ids]
+
+def _last_talked(db: DBSession, session_id: int) -> dict:
+    return dict(db.query(ConversationContext.npc_id, ConversationContext.last_updated)
+                .filter(ConversationContext.session_id == session_id).all())
+
+def get_last_prompt_report(session_id: int) -> dict:
+    """
+    What the last build_prompt for the session kept and dropped, per budgeted section:
+    {section: {"budget", "tokens", "kept", "dropped": [labels]}}.
+    """
+    return _last_prompt_reports.get(session_id, {})
+
+def _print_dropped(report: dict):
+    dropped = {name: section["dropped"] for name, section in report.items() if section["dropped"]}
+    if dropped:
+        print("[prompt] Over budget, dropped: " + "; ".join(
+            f"{name} ({len(items)}): {', '.join(map(str, items[:5]))}{' ...' if len(items) > 5 else ''}"
+            for name, items in dropped.items()
+        ))
+
+def build_prompt(db: DBSession, session_id: int, player_input: str, timer: StageTimer = None) -> str:
+    """
+    Builds the game-state context for the logic engine and narrator prompts.
+    Sections are ordered from least to most often changing, so consecutive turns share a
+    long identical prefix that the providers' prompt caching can reuse; the player input
+    comes last. Sections are rendered once per change of the state they show (see
+    prompt_builder/section_cache.py).
+    Lists that outgrow their token budget (prompt_builder/budget.py) keep the items most
+    relevant to this turn: NPCs, quests and flags named in the player input, NPCs talked
+    to recently, active quests, the newest journal entries and turns, the best memories.
+    """
+    report = {}
+
+    # --- Context Gathering ---
+    # retrieve_relevant_chunks already applies the relevance filter (see RETRIEVAL_MODE),
+    # so its result goes straight into the prompt.
+    memory_future = submit_traced(_retrieval_executor, retrieve_relevant_chunks, player_input, session_id, timer=timer)
+
+    with span("db.context_queries"):
+        recent_turns = db.query(Turn).filter_by(session_id=session_id)\
+            .order_by(desc(Turn.turn_number)).limit(RECENT_TURN_LIMIT).all()
+        recent_turns.reverse()
+
+        journal_entries = db.query(JournalEntry).filter_by(session_id=session_id)\
+            .order_by(desc(JournalEntry.turn_number)).limit(JOURNAL_ENTRY_LIMIT).all()
+        journal_entries.reverse()
+
+        # NPCs, quests, flags and the session config only change through world_tools, so
+        # they come from the world-state cache (see db/world_cache.py).
+        world = get_world_state(db, session_id)
+        versions = world["versions"]
+
+        npcs = _fit("npcs", world["npcs"], _npc_line,
+                    lambda: rank_npcs(world["npcs"], player_input, _last_talked(db, session_id)),
+                    report, lambda n: n["name"])
+    quests = _fit("quests", world["quests"], _quest_line,
+                  lambda: rank_quests(world["quests"], player_input), report, lambda q: q["name"])
+    flags = _fit("flags", world["flags"], _flag_line,
+                 lambda: rank_flags(world["flags"], player_input), report, lambda f: f["key"])
+    journal_entries = _fit("journal", journal_entries, _journal_line,
+                           lambda: journal_entries[::-1], report, lambda e: f"turn {e.turn_number}")
+    recent_turns = _fit("dialogue", recent_turns, _dialogue_line,
+                        lambda: recent_turns[::-1], report, lambda t: f"turn {t.turn_number}")
 
     # --- Assemble the Final Prompt ---
+    # A section's cache version includes which of its items made the cut.
     prompt_sections = [
-        "[Player Input]\n" + player_input.strip(),
-        quest_focus_section.strip(),
-        "\n[Game World Key]\nPower Level Scale: 1 (Child) to 100 (God-like Entity).",
-        "\n[Campaign Journal (Recent Events)]\n" + journal_section.strip(),
-        "\n[Recent Dialogue Transcript]\n" + dialogue_section.strip(),
-        "\n[Relevant Memories]\n" + memory_section.strip(),
-        "\n[NPCs]\n" + "\n".join(f"{n.name} ({n.role}) - Status: {n.status} (Power: {n.power_level}, Style: {n.combat_style})" for n in npcs),
-        "\n[Quests]\n" + "\n".join(f"{q.name}: {q.status}" for q in quests),
-        "\n[World Flags]\n" + "\n".join(f"{f.key} = {f.value}" for f in flags),
-        "\n[Session Config]\n" + f"Genre: {config.genre}\nTone: {config.tone}\nRealism: {config.realism}\nPower Fantasy: {config.power_fantasy}"
+        render_section(session_id, "world_key", None, _render_world_key),
+        render_section(session_id, "config", versions["config"], _render_config, world["config"]),
+        render_section(session_id, "npcs", (versions["npcs"], tuple(n["id"] for n in npcs)),
+                       _render_list, "NPCs", _npc_line, npcs),
+        render_section(session_id, "quests", (versions["quests"], tuple(q["id"] for q in quests)),
+                       _render_list, "Quests", _quest_line, quests),
+        render_section(session_id, "flags", (versions["flags"], tuple(f["id"] for f in flags)),
+                       _render_list, "World Flags", _flag_line, flags),
+        render_section(session_id, "quest_focus", versions["quests"], _render_quest_focus, world["quests"]),
+        render_section(session_id, "journal", tuple(e.id for e in journal_entries),
+                       _render_list, "Campaign Journal (Recent Events)", _journal_line, journal_entries),
+        render_section(session_id, "dialogue", tuple(t.id for t in recent_turns),
+                       _render_list, "Recent Dialogue Transcript", _dialogue_line, recent_turns),
     ]
 
-    return "\n\n".join(section for section in prompt_sections if section.strip() and ":" in section or "]" in section)
+    memory_chunks = memory_future.result()
+    memory_chunks = _fit("memories", memory_chunks, _memory_line, lambda: memory_chunks, report,
+                         lambda c: f"turn {c['turn_number']}" if c.get("turn_number") is not None else c["text"][:40])
+    prompt_sections.append(_render_list("Relevant Memories", _memory_line, memory_chunks))
+    prompt_sections.append("[Player Input]\n" + player_input.strip())
+
+    _last_prompt_reports[session_id] = report
+    _print_dropped(report)
+    return "\n\n".join(section for section in prompt_sections if section)
@@ -0,0 +1,46 @@
+# prompt_builder/section_cache.py
+
+"""
+Rendered prompt sections, cached per session. Each section is stored with the version
+of the state it was rendered from (world-state part versions from db/world_cache.py,
+or the ids of the rows it shows) and is only rendered again once that version changes.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+SECTION_CACHE_MAX_SESSIONS = int(os.getenv("SECTION_CACHE_MAX_SESSIONS", "32"))
+
+_sections = OrderedDict()   # session_id -> {name: (version, text)}, least recently used first
+_lock = threading.Lock()
+_stats = {"hits": 0, "renders": 0}
+
+def render_section(session_id: int, name: str, version, render, *args) -> str:
+    """
+    Returns the section's cached text if it was rendered for this version, otherwise
+    render(*args), which is then cached. version can be anything comparable with ==.
+    """
+    with _lock:
+        cached = _sections.get(session_id, {}).get(name)
+        if cached is not None and cached[0] == version:
+            _sections.move_to_end(session_id)
+            _stats["hits"] += 1
+            return cached[1]
+
+    text = render(*args)
+    with _lock:
+        _sections.setdefault(session_id, {})[name] = (version, text)
+        _sections.move_to_end(session_id)
+        while len(_sections) > SECTION_CACHE_MAX_SESSIONS:
+            _sections.popitem(last=False)
+        _stats["renders"] += 1
+    return text
+
+def get_section_cache_stats() -> dict:
+    with _lock:
+        return dict(_stats)
+
+def clear_section_cache():
+    with _lock:
+        _sections.clear()
@@ -2,8 +2,8 @@
 
 from sqlalchemy.orm import Session as DBSession
 from gemini_interface.gemini_client import call_gemini_with_tools
-# This now correctly imports the main tool list from its proper source.
-from world_tools import WORLD_TOOLS_LIST
+# Session zero can only finish by creating the world and character.
+from world_tools import SESSION_ZERO_TOOLS
 
 def run_session_zero_turn(db: DBSession, messages: list):
     """
@@ -31,9 +31,8 @@ Ask one open-ended question at a time. Be engaging and conversational.
     # Combine system instruction with the message history
     full_history = [system_instruction] + messages
 
-    # The call now correctly uses the imported WORLD_TOOLS_LIST
     response_text = call_gemini_with_tools(
-        db, None, messages=full_history, tools=WORLD_TOOLS_LIST
+        db, None, messages=full_history, tools=SESSION_ZERO_TOOLS
     )
 
     return response_text
\ No newline at end of file
@@ -0,0 +1,45 @@
+# tests/conftest.py
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+# Ensure root directory is in path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+# The modules under test read these at import time, so they are set before importing them.
+WORK_DIR = tempfile.mkdtemp(prefix="gm-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(WORK_DIR, 'app.db')}"
+os.environ["MEMORY_DIR"] = os.path.join(WORK_DIR, "memory_store")
+os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(WORK_DIR, "embedding_cache.db")
+os.environ["LLM_CACHE_PATH"] = os.path.join(WORK_DIR, "llm_cache.db")
+os.environ["LLM_BACKEND"] = "synthetic"
+
+from sqlalchemy.orm import Session
+
+from db.engine import make_engine
+from db.schema import Base, Session as SessionModel
+
+@pytest.fixture
+def engine(tmp_path):
+    """An engine with the app's SQLite profile on a fresh, empty database file."""
+    engine = make_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    yield engine
+    engine.dispose()
+
+@pytest.fixture
+def db(engine):
+    """A session on a fresh database with every table created."""
+    Base.metadata.create_all(engine)
+    with Session(bind=engine) as session:
+        yield session
+
+@pytest.fixture
+def session_id(db):
+    campaign = SessionModel(genre="fantasy", tone="grim", realism=True)
+    db.add(campaign)
+    db.commit()
+    return campaign.id
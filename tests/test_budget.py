@@ -0,0 +1,49 @@
+# tests/test_budget.py
+
+from prompt_builder import budget
+from prompt_builder.budget import fit_items, rank_quests
+from utils.tokens import approx_tokens
+
+def _count_words(text):
+    return len(text.split())
+
+def test_fit_items_keeps_best_items_within_budget(monkeypatch):
+    monkeypatch.setattr(budget, "count_tokens", _count_words)
+    ranked = ["one two", "three four five", "six"]
+    # Each line costs its words plus one for the newline.
+    kept, dropped = fit_items(ranked, lambda item: item, budget=7)
+    assert kept == ["one two", "three four five"]
+    assert dropped == ["six"]
+
+def test_fit_items_lets_a_later_smaller_item_fill_the_gap(monkeypatch):
+    monkeypatch.setattr(budget, "count_tokens", _count_words)
+    ranked = ["a b c", "d e f g h i", "j"]
+    kept, dropped = fit_items(ranked, lambda item: item, budget=6)
+    assert kept == ["a b c", "j"]
+    assert dropped == ["d e f g h i"]
+
+def test_fit_items_formats_items_with_line(monkeypatch):
+    monkeypatch.setattr(budget, "count_tokens", _count_words)
+    npcs = [{"name": "Mara"}, {"name": "Old Tom"}]
+    kept, dropped = fit_items(npcs, lambda npc: f"- {npc['name']}", budget=3)
+    assert kept == [npcs[0]]
+    assert dropped == [npcs[1]]
+
+def test_fit_items_with_zero_budget_drops_everything():
+    kept, dropped = fit_items(["x", "y"], lambda item: item, budget=0)
+    assert kept == []
+    assert dropped == ["x", "y"]
+
+def test_rank_quests_puts_mentioned_then_active_first():
+    quests = [
+        {"id": 1, "name": "Lost_Ring", "status": "active"},
+        {"id": 2, "name": "Bandits", "status": "completed"},
+        {"id": 3, "name": "Old Debts", "status": "active"},
+    ]
+    ranked = rank_quests(quests, "I ask about the lost ring")
+    assert [q["id"] for q in ranked] == [1, 3, 2]
+
+def test_approx_tokens():
+    assert approx_tokens("") == 0
+    assert approx_tokens(None) == 0
+    assert approx_tokens("abcdefgh") == 3
@@ -0,0 +1,50 @@
+# tests/test_engine.py
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from db.engine import atomic_session
+
+@pytest.fixture
+def table(engine):
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE notes (id INTEGER PRIMARY KEY, body TEXT)"))
+    return engine
+
+def _bodies(engine):
+    with engine.connect() as conn:
+        return [row[0] for row in conn.execute(text("SELECT body FROM notes ORDER BY id"))]
+
+def test_write_after_a_read_survives_another_connections_commit(table):
+    # A read must not pin a WAL snapshot: the turn reads, streams for a while, then writes.
+    with Session(bind=table) as reader, Session(bind=table) as other:
+        assert reader.execute(text("SELECT COUNT(*) FROM notes")).scalar() == 0
+        other.execute(text("INSERT INTO notes (body) VALUES ('other')"))
+        other.commit()
+        reader.execute(text("INSERT INTO notes (body) VALUES ('reader')"))
+        reader.commit()
+    assert _bodies(table) == ["other", "reader"]
+
+def test_savepoint_rollback_keeps_the_outer_transaction(table):
+    with Session(bind=table) as session:
+        session.execute(text("INSERT INTO notes (body) VALUES ('outer')"))
+        savepoint = session.begin_nested()
+        session.execute(text("INSERT INTO notes (body) VALUES ('inner')"))
+        savepoint.rollback()
+        session.commit()
+    assert _bodies(table) == ["outer"]
+
+def test_atomic_session_commits_together_or_not_at_all(table):
+    with atomic_session(table) as session:
+        session.execute(text("INSERT INTO notes (body) VALUES ('one')"))
+        session.commit()
+        session.execute(text("INSERT INTO notes (body) VALUES ('two')"))
+    assert _bodies(table) == ["one", "two"]
+
+    with pytest.raises(RuntimeError):
+        with atomic_session(table) as session:
+            session.execute(text("INSERT INTO notes (body) VALUES ('three')"))
+            session.commit()
+            raise RuntimeError("job failed")
+    assert _bodies(table) == ["one", "two"]
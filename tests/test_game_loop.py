@@ -0,0 +1,26 @@
+# tests/test_game_loop.py
+
+from game_loop import extract_outcome_summary, parse_logic_response
+
+def test_extract_outcome_summary_waits_for_the_closing_quote():
+    assert extract_outcome_summary('{"outcome_summary": "The door creaks op') is None
+    assert extract_outcome_summary('{"outcome_summary": "The door creaks open."') == "The door creaks open."
+
+def test_extract_outcome_summary_unescapes_json_strings():
+    partial = '{"outcome_summary": "She says \\"halt\\" and\\nwaits.", "tool_c'
+    assert extract_outcome_summary(partial) == 'She says "halt" and\nwaits.'
+
+def test_extract_outcome_summary_ignores_other_keys():
+    assert extract_outcome_summary('{"tool_calls": [], "note": "x"') is None
+    assert extract_outcome_summary('{"tool_calls": [], "outcome_summary": "Done."}') == "Done."
+
+def test_parse_logic_response_finds_the_json_in_surrounding_text():
+    text = 'Sure!\n```json\n{"outcome_summary": "Hit.", "tool_calls": [{"name": "create_rumor", "args": {}}]}\n```'
+    result = parse_logic_response(text)
+    assert result["outcome_summary"] == "Hit."
+    assert result["tool_calls"] == [{"name": "create_rumor", "args": {}}]
+
+def test_parse_logic_response_falls_back_on_invalid_json():
+    result = parse_logic_response("no json here")
+    assert result["tool_calls"] == []
+    assert result["outcome_summary"]
@@ -0,0 +1,101 @@
+# tests/test_memory_index.py
+
+import json
+import os
+
+import numpy as np
+import pytest
+
+from memory import index
+
+DIM = 4
+
+@pytest.fixture(autouse=True)
+def memory_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(index, "MEMORY_DIR", str(tmp_path))
+    monkeypatch.setattr(index, "ANN_INDEX_KIND", "flat")
+    # Sessions with no files would otherwise be rebuilt from the turns table.
+    monkeypatch.setattr(index, "_rebuild_from_turns", lambda session_id: None)
+    # One deterministic vector per chunk, so nothing needs the embedding model.
+    monkeypatch.setattr(index, "embed_text", lambda chunks: [_vector(len(chunk)) for chunk in chunks])
+    index._index_store.clear()
+    yield tmp_path
+    index._index_store.clear()
+
+def _vector(seed):
+    return np.random.default_rng(seed).random(DIM).astype("float32")
+
+def _store(session_id, count, turn_number=None):
+    vectors = np.stack([_vector(i) for i in range(count)])
+    chunks = [f"chunk {i}" for i in range(count)]
+    index._append_to_disk(session_id, vectors, index._make_meta(count, turn_number=turn_number), chunks)
+
+def test_load_from_disk_reads_back_what_was_appended():
+    _store(1, 3, turn_number=7)
+    memory = index._load_from_disk(1)
+    assert len(memory) == 3
+    assert memory.index.ntotal == 3
+    assert memory.chunks == ["chunk 0", "chunk 1", "chunk 2"]
+    assert list(memory.meta["turn_number"]) == [7, 7, 7]
+
+def test_load_from_disk_trims_a_torn_append():
+    _store(1, 3)
+    _, vec_path, meta_path, chunks_path = index._session_paths(1)
+    # A crash mid-append: half a vector, and a chunk line that was cut off.
+    with open(vec_path, "ab") as f:
+        f.write(_vector(9).tobytes()[:DIM * 2])
+    with open(chunks_path, "a", encoding="utf-8") as f:
+        f.write('{"text": "chunk 3"}\n{"text": "chu')
+
+    memory = index._load_from_disk(1)
+    assert len(memory) == 3
+    assert os.path.getsize(vec_path) == 3 * DIM * 4
+    assert os.path.getsize(meta_path) == 3 * index.CHUNK_META_DTYPE.itemsize
+    with open(chunks_path, encoding="utf-8") as f:
+        assert [json.loads(line)["text"] for line in f] == ["chunk 0", "chunk 1", "chunk 2"]
+
+def test_load_from_disk_drops_vectors_without_a_chunk_line():
+    _store(1, 3)
+    chunks_path = index._session_paths(1)[3]
+    with open(chunks_path, encoding="utf-8") as f:
+        lines = f.readlines()
+    with open(chunks_path, "w", encoding="utf-8") as f:
+        f.writelines(lines[:2])
+
+    memory = index._load_from_disk(1)
+    assert len(memory) == 2
+    assert memory.index.ntotal == 2
+
+def test_load_from_disk_backfills_missing_metadata():
+    _store(1, 2, turn_number=4)
+    os.remove(index._session_paths(1)[2])
+    memory = index._load_from_disk(1)
+    assert list(memory.meta["turn_number"]) == [-1, -1]
+    assert list(memory.meta["created_at"]) == [0.0, 0.0]
+
+def test_load_from_disk_without_files_returns_none():
+    assert index._load_from_disk(1) is None
+
+def test_add_chunks_skips_a_turn_that_is_already_stored():
+    index.add_chunks(["first telling"], 1, turn_number=3)
+    index.add_chunks(["second telling"], 1, turn_number=3)
+    index.add_chunks(["a journal entry"], 1, turn_number=3, source_type="journal")
+    memory = index._get_or_create_index(1)
+    assert memory.chunks == ["first telling", "a journal entry"]
+
+def test_search_chunks_returns_hits_nearest_first():
+    index.add_chunks(["aa", "bbbb", "cccccc"], 1, turn_number=1)
+    hits = index.search_chunks("", 1, k=3, query_vec=_vector(4))
+    assert hits[0]["text"] == "bbbb"
+    assert hits[0]["distance"] == pytest.approx(0.0, abs=1e-6)
+    assert [h["distance"] for h in hits] == sorted(h["distance"] for h in hits)
+    assert all(h["turn_number"] == 1 and h["source_type"] == "turn" for h in hits)
+
+def test_delete_session_memory_removes_files_and_loaded_index():
+    index.add_chunks(["something"], 1, turn_number=1)
+    index.add_chunks(["elsewhere"], 2, turn_number=1)
+    index.delete_session_memory(1)
+    assert not any(os.path.exists(path) for path in index._session_paths(1))
+    assert 1 not in index._index_store
+    assert len(index._get_or_create_index(1)) == 0
+    assert len(index._get_or_create_index(2)) == 1
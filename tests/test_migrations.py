@@ -0,0 +1,82 @@
+# tests/test_migrations.py
+
+import os
+
+from sqlalchemy import inspect, text
+
+from db.migrations import MIGRATIONS, get_applied_versions, run_migrations
+
+OLD_SCHEMA = [
+    # turns as created before prompt_snapshot replaced prompt_used, with no unique index.
+    "CREATE TABLE turns (id INTEGER PRIMARY KEY, session_id INTEGER, turn_number INTEGER, "
+    "player_input TEXT, gm_response TEXT, summary TEXT, timestamp DATETIME, "
+    "prompt_snapshot TEXT, prompt_used TEXT)",
+    "CREATE TABLE npcs (id INTEGER PRIMARY KEY, session_id INTEGER, name VARCHAR, role VARCHAR, "
+    "status VARCHAR, motivation TEXT, power_level INTEGER, combat_style TEXT)",
+]
+
+def _old_database(engine):
+    with engine.begin() as conn:
+        for statement in OLD_SCHEMA:
+            conn.execute(text(statement))
+        conn.execute(text(
+            "INSERT INTO turns (session_id, turn_number, player_input, gm_response, prompt_used) VALUES "
+            "(1, 1, 'look', 'A cave.', 'prompt one'), (1, 1, 'walk', 'A tunnel.', 'prompt two'), "
+            "(1, 2, 'run', 'A light.', NULL), (2, 1, 'wait', 'Rain.', 'prompt three')"
+        ))
+        conn.execute(text(
+            "INSERT INTO npcs (session_id, name, status) VALUES "
+            "(1, 'Mara', 'alive'), (1, 'Mara', 'dead'), (2, 'Mara', 'alive')"
+        ))
+
+def test_migrations_upgrade_an_old_database(engine):
+    _old_database(engine)
+    applied = run_migrations(engine)
+    assert applied == [name for _, name, _ in MIGRATIONS]
+
+    with engine.connect() as conn:
+        turns = conn.execute(text(
+            "SELECT session_id, turn_number, player_input, prompt_snapshot FROM turns ORDER BY id"
+        )).all()
+        npcs = conn.execute(text("SELECT session_id, status FROM npcs ORDER BY id")).all()
+    assert turns == [
+        (1, 1, "look", "prompt one"),
+        (1, 2, "walk", "prompt two"),
+        (1, 3, "run", None),
+        (2, 1, "wait", "prompt three"),
+    ]
+    # The lowest id of a duplicate is the one kept.
+    assert npcs == [(1, "alive"), (2, "alive")]
+
+    inspector = inspect(engine)
+    assert "prompt_used" not in {c["name"] for c in inspector.get_columns("turns")}
+    assert "ux_turns_session_turn_number" in {ix["name"] for ix in inspector.get_indexes("turns")}
+
+def test_migrations_are_applied_once(engine):
+    run_migrations(engine)
+    assert run_migrations(engine) == []
+    assert set(get_applied_versions(engine)) == {version for version, _, _ in MIGRATIONS}
+
+def test_each_migration_can_run_again(engine):
+    # A migration interrupted after its work but before it was recorded runs again.
+    _old_database(engine)
+    run_migrations(engine)
+    with engine.connect() as conn:
+        before = conn.execute(text("SELECT * FROM turns ORDER BY id")).all()
+    for _, _, migrate in MIGRATIONS:
+        migrate(engine)
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT * FROM turns ORDER BY id")).all() == before
+
+def test_renumbering_turns_drops_the_stale_memory_of_that_session(engine, tmp_path, monkeypatch):
+    from memory import index
+    monkeypatch.setattr(index, "MEMORY_DIR", str(tmp_path / "memory_store"))
+    for session_id in (1, 2):
+        (tmp_path / "memory_store").mkdir(exist_ok=True)
+        for path in index._session_paths(session_id):
+            open(path, "w").close()
+
+    _old_database(engine)
+    run_migrations(engine)
+    assert not any(os.path.exists(path) for path in index._session_paths(1))
+    assert all(os.path.exists(path) for path in index._session_paths(2))
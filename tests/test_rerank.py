@@ -0,0 +1,51 @@
+# tests/test_rerank.py
+
+import numpy as np
+import pytest
+
+from memory import index
+from memory.rerank import threshold_hits, mmr_select
+
+def _hit(chunk_id, distance):
+    return {"id": chunk_id, "distance": distance, "text": f"chunk {chunk_id}"}
+
+def test_threshold_hits_sorts_and_drops_far_hits():
+    hits = [_hit(0, 0.9), _hit(1, 0.1), _hit(2, 1.5), _hit(3, 0.5)]
+    kept = threshold_hits(hits, max_distance=1.0, min_hits=0)
+    assert [h["id"] for h in kept] == [1, 3, 0]
+
+def test_threshold_hits_keeps_the_nearest_min_hits_however_far():
+    hits = [_hit(0, 1.9), _hit(1, 1.7), _hit(2, 1.8)]
+    kept = threshold_hits(hits, max_distance=1.0, min_hits=2)
+    assert [h["id"] for h in kept] == [1, 2]
+
+def test_threshold_hits_min_hits_larger_than_hits():
+    assert [h["id"] for h in threshold_hits([_hit(0, 5.0)], max_distance=1.0, min_hits=3)] == [0]
+    assert threshold_hits([], max_distance=1.0, min_hits=3) == []
+
+@pytest.fixture
+def stored_vectors(tmp_path, monkeypatch):
+    """Writes vectors for session 1 straight to its memory files."""
+    monkeypatch.setattr(index, "MEMORY_DIR", str(tmp_path))
+
+    def store(vectors):
+        vectors = np.asarray(vectors, dtype="float32")
+        index._append_to_disk(1, vectors, index._make_meta(len(vectors)), [f"chunk {i}" for i in range(len(vectors))])
+    return store
+
+def test_mmr_select_skips_near_duplicates(stored_vectors):
+    # Equally relevant to the query; 0 and 1 say nearly the same thing.
+    stored_vectors([[1.0, 0.0, 0.0], [1.0, 0.01, 0.0], [0.0, 0.0, 1.0]])
+    hits = [_hit(0, 0.6), _hit(1, 0.6), _hit(2, 0.6)]
+    selected = mmr_select(np.array([1.0, 0.0, 1.0], dtype="float32"), hits, session_id=1, top_n=2, lambda_mult=0.5)
+    assert [h["id"] for h in selected] == [0, 2]
+
+def test_mmr_select_with_lambda_one_is_plain_relevance(stored_vectors):
+    stored_vectors([[0.0, 1.0], [1.0, 0.0], [0.7, 0.7]])
+    hits = [_hit(0, 0.0), _hit(1, 0.0), _hit(2, 0.0)]
+    selected = mmr_select(np.array([1.0, 0.0], dtype="float32"), hits, session_id=1, top_n=3, lambda_mult=1.0)
+    assert [h["id"] for h in selected] == [1, 2, 0]
+
+def test_mmr_select_without_query_vector_keeps_order():
+    hits = [_hit(0, 0.1), _hit(1, 0.2), _hit(2, 0.3)]
+    assert mmr_select(None, hits, session_id=1, top_n=2) == hits[:2]
@@ -0,0 +1,113 @@
+# tests/test_resilience.py
+
+import time
+
+import pytest
+
+from utils import resilience
+from utils.resilience import CircuitBreaker, LLMUnavailableError, TokenBucket
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    resilience.reset_resilience()
+    # No real waiting between retries.
+    monkeypatch.setattr(resilience, "LLM_BACKOFF_SECONDS", 0.0)
+    monkeypatch.setattr(resilience, "LLM_RETRIES", 2)
+    yield
+    resilience.reset_resilience()
+
+class RateLimitError(Exception):
+    status_code = 429
+
+def test_token_bucket_allows_a_burst_then_makes_callers_wait():
+    bucket = TokenBucket(per_minute=600, burst=2)
+    assert bucket._take() == 0.0
+    assert bucket._take() == 0.0
+    wait = bucket._take()
+    assert 0.0 < wait <= 0.1
+
+def test_token_bucket_acquire_sleeps_until_a_token_is_free():
+    bucket = TokenBucket(per_minute=1200, burst=1)
+    assert bucket.acquire() == 0.0
+    start = time.monotonic()
+    waited = bucket.acquire()
+    assert waited > 0.0
+    assert time.monotonic() - start >= waited * 0.9
+
+def test_token_bucket_without_a_rate_is_unlimited():
+    bucket = TokenBucket(per_minute=None, burst=1)
+    assert all(bucket._take() == 0.0 for _ in range(100))
+
+def test_token_bucket_pause_blocks_every_take():
+    bucket = TokenBucket(per_minute=None)
+    bucket.pause(5)
+    assert bucket._take() > 4
+
+def test_circuit_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(threshold=2, reset_seconds=60)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+def test_circuit_breaker_success_resets_the_count():
+    breaker = CircuitBreaker(threshold=2, reset_seconds=60)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+
+def test_circuit_breaker_half_open_lets_one_trial_through():
+    breaker = CircuitBreaker(threshold=1, reset_seconds=0.01)
+    breaker.record_failure()
+    assert not breaker.allow()
+    time.sleep(0.02)
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert not breaker.allow()
+    # A failed trial reopens it at once; a successful one closes it.
+    breaker.record_failure()
+    assert breaker.state == "open"
+    time.sleep(0.02)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+def test_call_retries_transient_errors():
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise TimeoutError("slow")
+        return "ok"
+
+    assert resilience.call("test-flaky", flaky) == "ok"
+    assert resilience.get_resilience_stats()["test-flaky"]["retries"] == 2
+
+def test_call_does_not_retry_request_errors():
+    attempts = []
+
+    def bad_request():
+        attempts.append(1)
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        resilience.call("test-bad", bad_request)
+    assert len(attempts) == 1
+
+def test_call_gives_up_with_llm_unavailable():
+    def always_limited():
+        raise RateLimitError("slow down")
+
+    with pytest.raises(LLMUnavailableError):
+        resilience.call("test-limited", always_limited)
+    stats = resilience.get_resilience_stats()["test-limited"]
+    assert stats["calls"] == 3
+    assert stats["rate_limited"] == 3
+
+def test_is_transient_error():
+    assert resilience.is_transient_error(TimeoutError())
+    assert resilience.is_transient_error(RateLimitError())
+    assert not resilience.is_transient_error(ValueError())
@@ -0,0 +1,76 @@
+# tests/test_world_tools.py
+
+import pytest
+
+from db.schema import Quest, Rumor
+from world_tools import execute_tool_calls, unit_of_work, _commit
+
+def _rumor(content):
+    return {"name": "create_rumor", "args": {"rumor_content": content, "is_confirmed": False}}
+
+def _contents(db, session_id):
+    return sorted(r.content for r in db.query(Rumor).filter_by(session_id=session_id))
+
+def test_unit_of_work_commits_once_at_the_outermost_block(db, session_id, engine):
+    with unit_of_work(db):
+        with unit_of_work(db):
+            db.add(Rumor(session_id=session_id, content="inner"))
+            _commit(db)
+        # Only flushed so far: another connection doesn't see it yet.
+        with engine.connect() as other:
+            assert other.exec_driver_sql("SELECT COUNT(*) FROM rumors").scalar() == 0
+    with engine.connect() as other:
+        assert other.exec_driver_sql("SELECT COUNT(*) FROM rumors").scalar() == 1
+
+def test_unit_of_work_rolls_everything_back_on_error(db, session_id):
+    with pytest.raises(RuntimeError):
+        with unit_of_work(db):
+            db.add(Rumor(session_id=session_id, content="first"))
+            _commit(db)
+            with unit_of_work(db):
+                db.add(Rumor(session_id=session_id, content="second"))
+                _commit(db)
+            raise RuntimeError("narration failed")
+    assert _contents(db, session_id) == []
+    assert not db.info["unit_of_work_depth"]
+
+def test_execute_tool_calls_skips_repeated_calls(db, session_id):
+    results = execute_tool_calls(db, session_id, [_rumor("dragons"), _rumor("dragons"), _rumor("wolves")])
+    assert [r["duplicate"] for r in results] == [False, True, False]
+    assert results[1]["result"] == results[0]["result"]
+    assert _contents(db, session_id) == ["dragons", "wolves"]
+
+def test_execute_tool_calls_shares_seen_across_batches(db, session_id):
+    seen = {}
+    execute_tool_calls(db, session_id, [_rumor("dragons")], seen=seen)
+    results = execute_tool_calls(db, session_id, [_rumor("dragons")], seen=seen)
+    assert results[0]["duplicate"]
+    assert _contents(db, session_id) == ["dragons"]
+
+def test_execute_tool_calls_reruns_a_call_after_a_different_write_to_its_rows(db, session_id):
+    db.add(Quest(session_id=session_id, name="Lost Ring", status="active"))
+    db.commit()
+
+    def status(value):
+        return {"name": "update_quest_status", "args": {"quest_name": "Lost Ring", "new_status": value, "reason": "test"}}
+
+    results = execute_tool_calls(db, session_id, [status("failed"), status("active"), status("failed")])
+    assert [r["duplicate"] for r in results] == [False, False, False]
+    assert db.query(Quest).filter_by(session_id=session_id).one().status == "failed"
+
+def test_execute_tool_calls_rolls_back_only_the_failing_call(db, session_id):
+    missing_quest = {"name": "update_quest_status", "args": {"quest_name": "Nope", "new_status": "done", "reason": "test"}}
+    results = execute_tool_calls(db, session_id, [_rumor("before"), missing_quest, _rumor("after")])
+    assert [r["ok"] for r in results] == [True, False, True]
+    assert results[1]["result"].startswith("Error")
+    assert _contents(db, session_id) == ["after", "before"]
+
+def test_execute_tool_calls_reports_unknown_tools(db, session_id):
+    results = execute_tool_calls(db, session_id, [{"name": "summon_meteor", "args": {}}])
+    assert results[0]["result"] == "Error: Tool not found."
+    assert not results[0]["ok"]
+
+def test_database_tool_without_a_session_returns_an_error(session_id):
+    results = execute_tool_calls(None, session_id, [_rumor("dragons")])
+    assert results[0]["result"].startswith("Error")
+    assert not results[0]["ok"]
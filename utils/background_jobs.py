@@ -0,0 +1,94 @@
+# utils/background_jobs.py
+
+import itertools
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+from db.engine import SessionLocal
+from db.world_cache import invalidate_world_state
+
+# Work that doesn't need to finish before the player sees the narration (NPC simulation,
+# progression) runs here, one job at a time, each in its own database session. The session
+# holds no transaction, so a job's reads and model calls don't keep SQLite's write lock:
+# jobs collect their world changes first and apply them at the end in one short
+# atomic_session, so they land all at once or not at all.
+# run_game_turn waits for a session's jobs before building the next prompt.
+MAX_JOBS_KEPT_PER_SESSION = 20
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gm-background")
+_job_ids = itertools.count(1)
+_jobs = {}      # session_id -> list of job records, oldest first
+_futures = {}   # job id -> Future
+_lock = threading.Lock()
+
+def _run_job(job: dict, func, bind):
+    job["status"] = "running"
+    job["started_at"] = datetime.utcnow()
+    try:
+        job_db = SessionLocal(bind=bind) if bind is not None else SessionLocal()
+        with job_db:
+            func(job_db, job["session_id"])
+        job["status"] = "done"
+    except Exception as e:
+        job["status"] = "failed"
+        job["error"] = str(e)
+        print(f"--- BACKGROUND JOB '{job['name']}' FAILED ---")
+        print(traceback.format_exc())
+    finally:
+        # The job's world changes became visible (or were discarded) when its transaction
+        # ended, so cached world state read in the meantime is dropped.
+        invalidate_world_state(job["session_id"])
+        job["finished_at"] = datetime.utcnow()
+        with _lock:
+            _futures.pop(job["id"], None)
+
+def submit_job(session_id: int, name: str, func, bind=None) -> dict:
+    """
+    Queues func(db_session, session_id) to run in the background.
+    bind is the engine (or connection) the job's session should use; defaults to the app engine.
+    Returns the job record, which is updated in place as the job progresses.
+    """
+    job = {
+        "id": next(_job_ids),
+        "session_id": session_id,
+        "name": name,
+        "status": "queued",
+        "error": None,
+        "submitted_at": datetime.utcnow(),
+        "started_at": None,
+        "finished_at": None,
+    }
+    with _lock:
+        session_jobs = _jobs.setdefault(session_id, [])
+        session_jobs.append(job)
+        del session_jobs[:-MAX_JOBS_KEPT_PER_SESSION]
+        _futures[job["id"]] = _executor.submit(_run_job, job, func, bind)
+    print(f"Queued background job '{name}' (#{job['id']}) for session {session_id}.")
+    return job
+
+def wait_for_session_jobs(session_id: int, timeout: float = None) -> bool:
+    """
+    Blocks until every queued or running job for the session has finished.
+    Returns False if the timeout expired first.
+    """
+    with _lock:
+        pending = [
+            _futures[job["id"]] for job in _jobs.get(session_id, [])
+            if job["id"] in _futures
+        ]
+    if not pending:
+        return True
+    print(f"Waiting for {len(pending)} background job(s) for session {session_id}...")
+    _, not_done = wait(pending, timeout=timeout)
+    return not not_done
+
+def get_job_status(session_id: int) -> list[dict]:
+    """
+    Returns copies of the session's recent job records, oldest first.
+    """
+    with _lock:
+        return [dict(job) for job in _jobs.get(session_id, [])]
+
+def has_pending_jobs(session_id: int) -> bool:
+    return any(job["status"] in ("queued", "running") for job in get_job_status(session_id))
@@ -2,6 +2,7 @@
 
 from sqlalchemy.orm import Session as DBSession
 from gemini_interface.gemini_client import call_gemini_with_tools
+from world_tools import execute_tool_calls, DIALOGUE_TOOLS
 
 def update_conversation_context(db: DBSession, session_id: int, player_input: str, gm_response: str):
     """
@@ -19,4 +20,9 @@ GM response:
 {gm_response}
 """
     # --- MODIFIED: Use the new, cheaper Flash model ---
-    call_gemini_with_tools(db, session_id, messages=prompt, model_name='gemini-2.5-flash')
\ No newline at end of file
+    # The model's tool calls are cached and applied here, so a repeated turn (rerun,
+    # retry) saves the same context again without another request.
+    tool_calls = call_gemini_with_tools(db, session_id, messages=prompt, model_name='gemini-2.5-flash',
+                                        tools=DIALOGUE_TOOLS, return_tool_calls=True, cache=True)
+    if isinstance(tool_calls, list):
+        execute_tool_calls(db, session_id, tool_calls)
\ No newline at end of file
@@ -0,0 +1,94 @@
+# utils/llm_async.py
+
+"""
+The event loop the async LLM clients (acall_chat_model, acall_gemini_with_tools) run on.
+
+One long-lived loop in a daemon thread owns everything that must stay on a single loop:
+the pooled HTTP client (keepalive connections are reused from turn to turn instead of
+being re-opened per request), the SDK clients built on it, and the semaphore that caps
+how many model requests are in flight at once across the whole app.
+
+Synchronous code (background jobs, benchmarks) runs a coroutine there with run(coro);
+its contextvars, and so the active trace, go with it.
+"""
+
+import asyncio
+import os
+import threading
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "20"))
+LLM_HTTP_KEEPALIVE_SECONDS = float(os.getenv("LLM_HTTP_KEEPALIVE_SECONDS", "60"))
+
+_loop = None
+_loop_thread = None
+_loop_lock = threading.Lock()
+_semaphore = None
+_clients = {}
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """Returns the shared loop, starting its thread on first use."""
+    global _loop, _loop_thread
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            _loop_thread = threading.Thread(target=_loop.run_forever, name="gm-llm-loop", daemon=True)
+            _loop_thread.start()
+        return _loop
+
+def run(coro, timeout: float = None):
+    """
+    Runs coro on the shared loop and blocks until it finishes. Must not be called from
+    the loop itself (await the coroutine there instead).
+    """
+    loop = get_loop()
+    if threading.current_thread() is _loop_thread:
+        raise RuntimeError("utils.llm_async.run() called from the LLM event loop; await the coroutine instead.")
+    # The callback that starts the task is scheduled with this thread's context.
+    return asyncio.run_coroutine_threadsafe(coro, loop).result(timeout)
+
+def _check_loop():
+    if asyncio.get_running_loop() is not _loop:
+        raise RuntimeError("The async LLM clients must run on the shared loop; use utils.llm_async.run().")
+
+def get_semaphore() -> asyncio.Semaphore:
+    """The app-wide cap on in-flight model requests (LLM_MAX_CONCURRENCY)."""
+    global _semaphore
+    _check_loop()
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(max(1, LLM_MAX_CONCURRENCY))
+    return _semaphore
+
+async def limited(coro):
+    """Awaits coro while holding a slot of the request semaphore."""
+    async with get_semaphore():
+        return await coro
+
+def get_http_client():
+    """
+    The pooled httpx.AsyncClient shared by the async SDK clients. Connections are kept
+    alive for LLM_HTTP_KEEPALIVE_SECONDS between requests.
+    """
+    _check_loop()
+    if "http" not in _clients:
+        import httpx
+        from utils.resilience import LLM_TIMEOUT_SECONDS
+        _clients["http"] = httpx.AsyncClient(
+            timeout=LLM_TIMEOUT_SECONDS,
+            limits=httpx.Limits(
+                max_connections=LLM_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_HTTP_MAX_CONNECTIONS,
+                keepalive_expiry=LLM_HTTP_KEEPALIVE_SECONDS,
+            ),
+        )
+    return _clients["http"]
+
+def get_client(name: str, factory):
+    """
+    Returns the loop's client called name, building it with factory() on first use.
+    Clients must only be used from the shared loop.
+    """
+    _check_loop()
+    if name not in _clients:
+        _clients[name] = factory()
+    return _clients[name]
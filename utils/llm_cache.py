@@ -0,0 +1,142 @@
+# utils/llm_cache.py
+
+"""
+Persistent cache of LLM responses for calls that are deterministic enough to reuse:
+the same model, prompt, tools and sampling parameters get the stored answer back
+without a network round trip (Streamlit reruns, retries after a crash, re-summarizing
+the same turn).
+
+Call sites opt in with cache=True on call_chat_model / call_gemini_with_tools (and
+their async counterparts).
+Entries are keyed by request_key (utils/llm_replay.py) over the whole request,
+including the active backend's name. They expire after LLM_CACHE_TTL_SECONDS, and the
+least recently used are evicted beyond LLM_CACHE_MAX_ENTRIES. Set
+LLM_CACHE_ENABLED=false to bypass the cache everywhere.
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from utils.llm_replay import request_key
+from utils.tracing import record_span
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.db")
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "20000"))
+# Eviction runs every this many stores rather than on every one.
+EVICT_EVERY = 100
+
+_db = None
+_lock = threading.Lock()
+_stores_since_evict = 0
+_stats = {"hits": 0, "misses": 0, "stores": 0, "evicted": 0}
+
+def _get_db():
+    global _db
+    if _db is None:
+        _db = sqlite3.connect(LLM_CACHE_PATH, check_same_thread=False)
+        _db.execute("PRAGMA journal_mode=WAL")
+        _db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, api TEXT NOT NULL, model TEXT, response TEXT NOT NULL, "
+            "created_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        _db.execute("CREATE INDEX IF NOT EXISTS ix_responses_last_used ON responses (last_used)")
+        _db.commit()
+    return _db
+
+def cache_key(api: str, request: dict) -> str:
+    return request_key(f"cache:{api}", request)
+
+def get(key: str):
+    """
+    Returns the cached response for the key, or None if there is none or it expired.
+    """
+    now = time.time()
+    with _lock:
+        db = _get_db()
+        row = db.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None or now - row[1] > LLM_CACHE_TTL_SECONDS:
+            _stats["misses"] += 1
+            return None
+        db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+        db.commit()
+        _stats["hits"] += 1
+    return json.loads(row[0])
+
+def put(key: str, api: str, model: str, response):
+    global _stores_since_evict
+    now = time.time()
+    with _lock:
+        db = _get_db()
+        db.execute(
+            "INSERT OR REPLACE INTO responses (key, api, model, response, created_at, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+            (key, api, model, json.dumps(response), now, now)
+        )
+        db.commit()
+        _stats["stores"] += 1
+        _stores_since_evict += 1
+        if _stores_since_evict >= EVICT_EVERY:
+            _stores_since_evict = 0
+            _evict(db, now)
+
+def _evict(db, now: float):
+    expired = db.execute("DELETE FROM responses WHERE created_at < ?", (now - LLM_CACHE_TTL_SECONDS,)).rowcount
+    over = db.execute(
+        "DELETE FROM responses WHERE key IN ("
+        "SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+        (LLM_CACHE_MAX_ENTRIES,)
+    ).rowcount
+    db.commit()
+    _stats["evicted"] += expired + over
+
+def cached_call(api: str, model: str, request: dict, func, cacheable=bool):
+    """
+    Returns the cached response for the request, or func()'s, which is stored if
+    cacheable(response) is true (by default: any non-empty response).
+    """
+    if not LLM_CACHE_ENABLED:
+        return func()
+    key = cache_key(api, {"model": model, **request})
+    start = time.perf_counter()
+    response = get(key)
+    if response is not None:
+        record_span("llm.cache_hit", (time.perf_counter() - start) * 1000, model=model)
+        return response
+    response = func()
+    if cacheable(response):
+        put(key, api, model, response)
+    return response
+
+async def acached_call(api: str, model: str, request: dict, afunc, cacheable=bool):
+    """
+    cached_call for coroutines: returns the cached response or await afunc(). The cache
+    lookup and store (and the eviction it sometimes runs) are SQLite disk I/O that may wait
+    on the cache's lock, so they run in a worker thread instead of on the event loop.
+    """
+    if not LLM_CACHE_ENABLED:
+        return await afunc()
+    key = cache_key(api, {"model": model, **request})
+    start = time.perf_counter()
+    response = await asyncio.to_thread(get, key)
+    if response is not None:
+        record_span("llm.cache_hit", (time.perf_counter() - start) * 1000, model=model)
+        return response
+    response = await afunc()
+    if cacheable(response):
+        await asyncio.to_thread(put, key, api, model, response)
+    return response
+
+def get_cache_stats() -> dict:
+    with _lock:
+        return dict(_stats)
+
+def clear_cache():
+    with _lock:
+        db = _get_db()
+        db.execute("DELETE FROM responses")
+        db.commit()
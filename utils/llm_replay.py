@@ -0,0 +1,95 @@
+# utils/llm_replay.py
+
+"""
+Shared pieces of the offline LLM backends in gpt_interface/backends.py and
+gemini_interface/backends.py: request keys, the recordings file and synthetic timing.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+
+LLM_RECORDINGS_PATH = os.getenv("LLM_RECORDINGS_PATH", "llm_recordings.jsonl")
+# Defaults for the synthetic backends: time to the first token, +/- jitter, and the
+# delay between streamed words.
+SYNTHETIC_LATENCY_MS = float(os.getenv("LLM_SYNTHETIC_LATENCY_MS", "250"))
+SYNTHETIC_JITTER_MS = float(os.getenv("LLM_SYNTHETIC_JITTER_MS", "50"))
+SYNTHETIC_CHUNK_MS = float(os.getenv("LLM_SYNTHETIC_CHUNK_MS", "5"))
+
+def request_key(api: str, request: dict) -> str:
+    """
+    Stable hash of a request. Values that aren't JSON (tool results, proto objects)
+    are hashed by their str().
+    """
+    payload = json.dumps({"api": api, **request}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class RecordingStore:
+    """
+    Responses keyed by request_key, persisted as JSON lines. A request that was
+    recorded several times replays its responses in order; the last one repeats.
+    """
+    def __init__(self, path: str = None):
+        self.path = path or LLM_RECORDINGS_PATH
+        self._responses = {}
+        self._replayed = {}
+        self._lock = threading.Lock()
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._responses.setdefault(entry["key"], []).append(entry["response"])
+
+    def __len__(self):
+        return sum(len(responses) for responses in self._responses.values())
+
+    def next(self, key: str):
+        """
+        Returns the next recorded response for the key, or None if there is none.
+        """
+        with self._lock:
+            responses = self._responses.get(key)
+            if not responses:
+                return None
+            i = self._replayed.get(key, 0)
+            self._replayed[key] = i + 1
+            return responses[min(i, len(responses) - 1)]
+
+    def append(self, key: str, api: str, response: dict):
+        with self._lock:
+            self._responses.setdefault(key, []).append(response)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"key": key, "api": api, "response": response}, default=str) + "\n")
+
+class SyntheticTiming:
+    """
+    Simulated model latency. The jitter is derived from the request key, so a replay
+    of the same requests sleeps for the same amounts.
+    """
+    def __init__(self, latency_ms: float = None, jitter_ms: float = None, chunk_ms: float = None):
+        self.latency_ms = SYNTHETIC_LATENCY_MS if latency_ms is None else latency_ms
+        self.jitter_ms = SYNTHETIC_JITTER_MS if jitter_ms is None else jitter_ms
+        self.chunk_ms = SYNTHETIC_CHUNK_MS if chunk_ms is None else chunk_ms
+
+    def _delay_ms(self, key: str) -> float:
+        jitter = random.Random(key).uniform(-self.jitter_ms, self.jitter_ms)
+        return max(0.0, self.latency_ms + jitter)
+
+    def delay(self, key: str):
+        delay_ms = self._delay_ms(key)
+        if delay_ms:
+            time.sleep(delay_ms / 1000)
+
+    async def adelay(self, key: str):
+        delay_ms = self._delay_ms(key)
+        if delay_ms:
+            await asyncio.sleep(delay_ms / 1000)
+
+    def chunk_delay(self):
+        if self.chunk_ms:
+            time.sleep(self.chunk_ms / 1000)
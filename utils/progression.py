@@ -1,12 +1,15 @@
 # utils/progression.py
 
+import asyncio
 import json
 from sqlalchemy.orm import Session as DBSession
 from db.schema import PlayerState, Turn
 # --- FIX: Import the GPT client ---
-from gpt_interface.gpt_client import call_chat_model
+from gpt_interface.gpt_client import acall_chat_model
 # --- FIX: We also need the Gemini client for its tool-calling ability ---
-from gemini_interface.gemini_client import call_gemini_with_tools
+from gemini_interface.gemini_client import acall_gemini_with_tools
+from world_tools import PROGRESSION_TOOLS, execute_tool_calls, unit_of_work
+from utils import llm_async
 from sqlalchemy import desc
 
 def evaluate_player_growth(db: DBSession, session_id: int, recent_turns: int = 5):
@@ -14,21 +17,26 @@ def evaluate_player_growth(db: DBSession, session_id: int, recent_turns: int = 5
     Evaluates the player's recent actions and calls the update_player_character tool
     to apply any deserved progression.
     """
-    player = db.query(PlayerState).filter_by(session_id=session_id).first()
+    return llm_async.run(aevaluate_player_growth(db, session_id, recent_turns))
+
+async def aevaluate_player_growth(db: DBSession, session_id: int, recent_turns: int = 5):
+    """
+    Async version of evaluate_player_growth, for the shared LLM loop. Its database reads
+    and the tool call run in worker threads; db must not be used by anything else until
+    it returns.
+    """
+    tool_calls = await aplan_player_growth(db, session_id, recent_turns)
+    await asyncio.to_thread(apply_player_growth, db, session_id, tool_calls)
+
+async def aplan_player_growth(db: DBSession, session_id: int, recent_turns: int = 5) -> list:
+    """
+    The model half of the evaluation: decides on any progression without writing anything.
+    Returns the update_player_character calls for apply_player_growth (empty if none).
+    """
+    player = await asyncio.to_thread(_load_player, db, session_id, recent_turns)
     if not player:
         print("⚠️ No player state found.")
-        return
-
-    turns = (
-        db.query(Turn)
-        .filter_by(session_id=session_id)
-        .order_by(desc(Turn.turn_number))
-        .limit(recent_turns)
-        .all()
-    )
-    turn_summary = "\n\n".join(
-        f"Player: {t.player_input}\nGM: {t.gm_response}" for t in turns
-    )
+        return []
 
     # --- FIX: This prompt is now structured for GPT-4o's reasoning ---
     prompt = f"""
@@ -39,17 +47,17 @@ You are managing player progression in an RPG. Your job is to analyze the player
 - If a skill increase pushes them into a new tier (Novice > Apprentice > Adept > Expert > Master), mention it in your reasoning.
 
 **Player Info:**
-- Name: {player.name}
-- Class: {player.character_class}
-- Current Skills: {json.dumps(player.skills)}
+- Name: {player["name"]}
+- Class: {player["character_class"]}
+- Current Skills: {json.dumps(player["skills"])}
 
 **Recent Turns:**
-{turn_summary}
+{player["turn_summary"]}
 
 Based on the rules and recent turns, provide a brief, one-sentence rationale for any skill increases. For example: "Tayschrenn successfully used necromancy to raise a corpse." If no progression is warranted, just say "No progression."
 """
     print("\n--- Evaluating Player Progression (GPT-4o) ---")
-    reasoning = call_chat_model([{"role": "user", "content": prompt}], model="gpt4o")
+    reasoning = await acall_chat_model([{"role": "user", "content": prompt}], model="gpt4o")
 
     # --- FIX: We use the reasoning from GPT-4o to drive the tool call with Gemini ---
     if "no progression" not in reasoning.lower():
@@ -58,11 +66,47 @@ Based on the rules and recent turns, provide a brief, one-sentence rationale for
 
         Rationale: "{reasoning}"
 
-        Current Skills: {json.dumps(player.skills)}
+        Current Skills: {json.dumps(player["skills"])}
         """
-        final_response = call_gemini_with_tools(db, session_id, [{"role": "user", "content": tool_prompt}])
-        print(f"Progression result: {final_response}")
+        tool_calls = await acall_gemini_with_tools(
+            None, None, [{"role": "user", "content": tool_prompt}],
+            tools=PROGRESSION_TOOLS, return_tool_calls=True
+        )
+        if isinstance(tool_calls, list):
+            return [call for call in tool_calls if call["name"] == "update_player_character"]
+        print(f"Progression result: {tool_calls}")
     else:
         print("Progression result: No progression earned.")
-        
-    print("--- Progression Evaluation Complete ---")
\ No newline at end of file
+    return []
+
+def apply_player_growth(db: DBSession, session_id: int, tool_calls: list):
+    """
+    Applies aplan_player_growth's tool calls in one transaction.
+    """
+    if tool_calls:
+        with unit_of_work(db):
+            results = execute_tool_calls(db, session_id, tool_calls)
+        print(f"Progression result: {[r['result'] for r in results]}")
+    print("--- Progression Evaluation Complete ---")
+
+def _load_player(db: DBSession, session_id: int, recent_turns: int):
+    """
+    A plain snapshot of the player and their recent turns, or None if there is no player.
+    """
+    player = db.query(PlayerState).filter_by(session_id=session_id).first()
+    if not player:
+        return None
+
+    turns = (
+        db.query(Turn)
+        .filter_by(session_id=session_id)
+        .order_by(desc(Turn.turn_number))
+        .limit(recent_turns)
+        .all()
+    )
+    return {
+        "name": player.name,
+        "character_class": player.character_class,
+        "skills": player.skills,
+        "turn_summary": "\n\n".join(f"Player: {t.player_input}\nGM: {t.gm_response}" for t in turns),
+    }
@@ -0,0 +1,416 @@
+# utils/resilience.py
+
+"""
+Retries, client-side rate limiting and circuit breaking shared by the GPT and Gemini
+clients. Every model request goes through call(deployment, func) (acall for coroutines),
+or stream(...) for streamed responses, which are only retried until their first chunk
+arrives:
+
+- Transient failures (429s, timeouts, connection errors, 5xx) are retried up to
+  LLM_RETRIES times with full-jitter exponential backoff, honouring Retry-After.
+- Each deployment has a token bucket (LLM_RATE_LIMITS, requests per minute, e.g.
+  "gpt4o=120,gemini-2.5-pro=60"; unlisted deployments are unlimited). A 429 pauses the
+  deployment's bucket for every thread, so concurrent callers back off together.
+- After LLM_CIRCUIT_FAILURES consecutive transient failures a deployment's circuit
+  opens: requests fail fast for LLM_CIRCUIT_RESET_SECONDS, then one trial is let through.
+
+When retries run out or the circuit is open, LLMUnavailableError is raised.
+
+hedged_stream() starts a second copy of a streamed request if the first hasn't produced
+a chunk within the deployment's recent p95 time to first chunk; the narrator uses it.
+
+Retries, rate-limit waits, open circuits and hedges are recorded as trace spans
+("llm.retry", "llm.rate_limit_wait", "llm.circuit_open", "llm.hedge") and counted per
+deployment in get_resilience_stats().
+"""
+
+import asyncio
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from utils.tracing import record_span, submit_traced
+
+# Per-request timeout handed to the Azure and Gemini SDKs.
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "4"))
+LLM_BACKOFF_SECONDS = float(os.getenv("LLM_BACKOFF_SECONDS", "1.0"))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "30"))
+LLM_RATE_LIMITS = {
+    name.strip(): float(rpm)
+    for name, _, rpm in (item.partition("=") for item in os.getenv("LLM_RATE_LIMITS", "").split(","))
+    if name.strip() and rpm
+}
+# Requests a deployment may make back to back before the rate limit spaces them out.
+LLM_RATE_LIMIT_BURST = int(os.getenv("LLM_RATE_LIMIT_BURST", "5"))
+LLM_CIRCUIT_FAILURES = int(os.getenv("LLM_CIRCUIT_FAILURES", "5"))
+LLM_CIRCUIT_RESET_SECONDS = float(os.getenv("LLM_CIRCUIT_RESET_SECONDS", "30"))
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "true").lower() == "true"
+# Time-to-first-chunk samples kept per deployment, and how many are needed before hedging.
+HEDGE_WINDOW = 100
+HEDGE_MIN_SAMPLES = 20
+
+class LLMUnavailableError(RuntimeError):
+    """A model deployment kept failing (retries exhausted) or its circuit is open."""
+
+def is_rate_limit_error(e: Exception) -> bool:
+    return (
+        type(e).__name__ in ("RateLimitError", "ResourceExhausted", "TooManyRequests")
+        or _status_code(e) == 429
+    )
+
+def is_transient_error(e: Exception) -> bool:
+    """
+    Errors worth retrying: rate limits, timeouts, dropped connections and server errors.
+    Matched by name and status code, so neither SDK has to be imported here.
+    """
+    if is_rate_limit_error(e) or isinstance(e, (TimeoutError, ConnectionError)):
+        return True
+    if type(e).__name__ in (
+        "APITimeoutError", "APIConnectionError", "InternalServerError",  # openai, google.api_core
+        "DeadlineExceeded", "ServiceUnavailable",  # google.api_core
+    ):
+        return True
+    status = _status_code(e)
+    return isinstance(status, int) and status >= 500
+
+def _status_code(e: Exception):
+    status = getattr(e, "status_code", None)
+    if status is None:
+        status = getattr(e, "code", None)
+    return status if isinstance(status, int) else None
+
+def _retry_after(e: Exception):
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt: int, e: Exception = None) -> float:
+    """Full-jitter exponential backoff, or the server's Retry-After if it is longer."""
+    delay = random.uniform(0, min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_SECONDS * (2 ** attempt)))
+    retry_after = _retry_after(e) if e is not None else None
+    return max(delay, retry_after) if retry_after is not None else delay
+
+# --- Rate limiting ---
+
+class TokenBucket:
+    """
+    Allows per_minute requests a minute with bursts of up to burst; None means unlimited.
+    pause() blocks every acquire() until the pause is over.
+    """
+    def __init__(self, per_minute: float = None, burst: int = LLM_RATE_LIMIT_BURST):
+        self.rate = per_minute / 60.0 if per_minute else None
+        self.capacity = float(max(1, burst))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _take(self) -> float:
+        """Takes a token and returns 0, or returns how long to wait before trying again."""
+        with self._lock:
+            now = time.monotonic()
+            if self.rate is not None:
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.paused_until > now:
+                return self.paused_until - now
+            if self.rate is None:
+                return 0.0
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self) -> float:
+        """Takes a token, sleeping until one is available. Returns the seconds waited."""
+        waited = 0.0
+        while (wait := self._take()) > 0:
+            time.sleep(wait)
+            waited += wait
+        return waited
+
+    async def aacquire(self) -> float:
+        waited = 0.0
+        while (wait := self._take()) > 0:
+            await asyncio.sleep(wait)
+            waited += wait
+        return waited
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+# --- Circuit breaker ---
+
+class CircuitBreaker:
+    """
+    Closed until `threshold` consecutive failures, then open for reset_seconds. After
+    that it is half open: one trial request goes through and closes or reopens it.
+    """
+    def __init__(self, threshold: int = LLM_CIRCUIT_FAILURES, reset_seconds: float = LLM_CIRCUIT_RESET_SECONDS):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = "half_open"
+                return True
+            return self.state == "closed"
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.threshold:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+# --- Per-deployment state ---
+
+_buckets = {}
+_breakers = {}
+_first_chunk_ms = {}
+_stats = {}
+_state_lock = threading.Lock()
+
+def _bucket(deployment: str) -> TokenBucket:
+    with _state_lock:
+        if deployment not in _buckets:
+            _buckets[deployment] = TokenBucket(LLM_RATE_LIMITS.get(deployment))
+        return _buckets[deployment]
+
+def _breaker(deployment: str) -> CircuitBreaker:
+    with _state_lock:
+        if deployment not in _breakers:
+            _breakers[deployment] = CircuitBreaker()
+        return _breakers[deployment]
+
+def _count(deployment: str, counter: str):
+    with _state_lock:
+        stats = _stats.setdefault(deployment, {
+            "calls": 0, "retries": 0, "rate_limited": 0, "rate_limit_waits": 0,
+            "circuit_open": 0, "failures": 0, "hedges": 0, "hedge_wins": 0,
+        })
+        stats[counter] += 1
+
+def get_resilience_stats() -> dict:
+    """Counters per deployment, plus each circuit's state."""
+    with _state_lock:
+        stats = {name: dict(counters) for name, counters in _stats.items()}
+        for name, breaker in _breakers.items():
+            stats.setdefault(name, {})["circuit"] = breaker.state
+        return stats
+
+def reset_resilience():
+    """Forgets every bucket, circuit, latency sample and counter (for benchmarks and tests)."""
+    with _state_lock:
+        _buckets.clear()
+        _breakers.clear()
+        _first_chunk_ms.clear()
+        _stats.clear()
+
+# --- Calls ---
+
+def _before_attempt(deployment: str, waited: float):
+    if waited:
+        _count(deployment, "rate_limit_waits")
+        record_span("llm.rate_limit_wait", waited * 1000, model=deployment)
+    _count(deployment, "calls")
+
+def _check_circuit(deployment: str, breaker: CircuitBreaker):
+    if not breaker.allow():
+        _count(deployment, "circuit_open")
+        record_span("llm.circuit_open", 0.0, model=deployment)
+        raise LLMUnavailableError(f"{deployment} is failing; not calling it for up to {LLM_CIRCUIT_RESET_SECONDS:.0f}s.")
+
+def _after_failure(deployment: str, breaker: CircuitBreaker, bucket: TokenBucket, attempt: int, e: Exception):
+    """
+    Returns how long to back off before the next attempt, or None if e should simply
+    be re-raised. Raises LLMUnavailableError when the retries are used up.
+    """
+    if not is_transient_error(e):
+        # The deployment answered; it's the request that was wrong.
+        breaker.record_success()
+        return None
+    breaker.record_failure()
+    delay = backoff_delay(attempt, e)
+    if is_rate_limit_error(e):
+        _count(deployment, "rate_limited")
+        bucket.pause(delay)
+    if attempt == LLM_RETRIES:
+        _count(deployment, "failures")
+        raise LLMUnavailableError(f"{deployment} failed after {LLM_RETRIES + 1} attempts: {type(e).__name__}: {e}") from e
+    print(f"    {deployment}: {type(e).__name__}; retrying in {delay:.1f}s ({attempt + 1}/{LLM_RETRIES})...")
+    _count(deployment, "retries")
+    record_span("llm.retry", delay * 1000, model=deployment)
+    return delay
+
+def call(deployment: str, func):
+    """
+    Returns func(), a request to the deployment, retrying transient failures with backoff
+    under the deployment's rate limit and circuit breaker. Other exceptions propagate as is.
+    """
+    breaker = _breaker(deployment)
+    bucket = _bucket(deployment)
+    for attempt in range(LLM_RETRIES + 1):
+        _check_circuit(deployment, breaker)
+        _before_attempt(deployment, bucket.acquire())
+        try:
+            result = func()
+        except Exception as e:
+            delay = _after_failure(deployment, breaker, bucket, attempt, e)
+            if delay is None:
+                raise
+            time.sleep(delay)
+        else:
+            breaker.record_success()
+            return result
+
+async def acall(deployment: str, afunc):
+    """
+    call() for coroutines: returns await afunc(), with the same retries, rate limit and
+    circuit breaker (shared with the synchronous calls to the deployment).
+    """
+    breaker = _breaker(deployment)
+    bucket = _bucket(deployment)
+    for attempt in range(LLM_RETRIES + 1):
+        _check_circuit(deployment, breaker)
+        _before_attempt(deployment, await bucket.aacquire())
+        try:
+            result = await afunc()
+        except Exception as e:
+            delay = _after_failure(deployment, breaker, bucket, attempt, e)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+        else:
+            breaker.record_success()
+            return result
+
+_END = object()
+
+def stream(deployment: str, make_stream):
+    """
+    Yields the chunks of make_stream(). Opening the stream and getting its first chunk go
+    through call(), so they are retried; a failure after that propagates, since the
+    caller has already seen part of the response.
+    """
+    def first_chunk():
+        chunks = iter(make_stream())
+        return chunks, next(chunks, _END)
+
+    chunks, chunk = call(deployment, first_chunk)
+    if chunk is _END:
+        return
+    yield chunk
+    yield from chunks
+
+# --- Hedging ---
+
+def _record_first_chunk(deployment: str, elapsed_ms: float):
+    with _state_lock:
+        _first_chunk_ms.setdefault(deployment, deque(maxlen=HEDGE_WINDOW)).append(elapsed_ms)
+
+def hedge_threshold_ms(deployment: str):
+    """p95 of the deployment's recent times to first chunk, or None while there are too few."""
+    with _state_lock:
+        samples = sorted(_first_chunk_ms.get(deployment, ()))
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return None
+    return samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+
+# Up to two streams per hedged request, for the narrator's workers (see game_loop.py).
+_hedge_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="gm-hedge")
+
+def _pump(index: int, deployment: str, make_stream, out: queue.Queue, cancelled: threading.Event):
+    chunks = stream(deployment, make_stream)
+    try:
+        for chunk in chunks:
+            if cancelled.is_set():
+                return
+            out.put((index, chunk))
+        out.put((index, _END))
+    except Exception as e:
+        out.put((index, e))
+    finally:
+        chunks.close()
+
+def hedged_stream(deployment: str, make_stream):
+    """
+    stream(), but if no chunk has arrived after hedge_threshold_ms(deployment), a second
+    identical request is started and the response that starts first is used; the other
+    is abandoned. Without enough latency samples (or with LLM_HEDGE_ENABLED=false) this
+    is a plain stream() that only records the time to first chunk.
+    """
+    start = time.perf_counter()
+    threshold = hedge_threshold_ms(deployment) if LLM_HEDGE_ENABLED else None
+    if threshold is None:
+        first = True
+        for chunk in stream(deployment, make_stream):
+            if first:
+                _record_first_chunk(deployment, (time.perf_counter() - start) * 1000)
+                first = False
+            yield chunk
+        return
+
+    out = queue.Queue()
+    cancels = [threading.Event()]
+    submit_traced(_hedge_executor, _pump, 0, deployment, make_stream, out, cancels[0])
+    winner = None
+    failed = {}
+    try:
+        while True:
+            timeout = None
+            if winner is None and len(cancels) == 1:
+                timeout = max(0.0, threshold / 1000 - (time.perf_counter() - start))
+            try:
+                index, item = out.get(timeout=timeout)
+            except queue.Empty:
+                print(f"    {deployment}: no response after {threshold:.0f}ms (p95); hedging with a second request.")
+                _count(deployment, "hedges")
+                record_span("llm.hedge", (time.perf_counter() - start) * 1000, model=deployment)
+                cancels.append(threading.Event())
+                submit_traced(_hedge_executor, _pump, 1, deployment, make_stream, out, cancels[1])
+                continue
+
+            if winner is None:
+                if isinstance(item, Exception):
+                    failed[index] = item
+                    # Keep waiting while the other request is still running.
+                    if len(failed) == len(cancels):
+                        raise item
+                    continue
+                winner = index
+                for i, cancel in enumerate(cancels):
+                    if i != winner:
+                        cancel.set()
+                if winner == 1:
+                    _count(deployment, "hedge_wins")
+                _record_first_chunk(deployment, (time.perf_counter() - start) * 1000)
+            elif index != winner:
+                continue
+
+            if item is _END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        for cancel in cancels:
+            cancel.set()
@@ -1,83 +1,230 @@
 # utils/simulation.py
 
+import asyncio
+import json
+import os
+import re
 from sqlalchemy.orm import Session as DBSession
 from sqlalchemy import desc
-from gpt_interface.gpt_client import call_chat_model
-from gemini_interface.gemini_client import call_gemini_with_tools
-from db.schema import NPC, Turn, ConversationContext
+from gpt_interface.gpt_client import acall_chat_model
+from gemini_interface.gemini_client import acall_gemini_with_tools
+from db.schema import Turn, ConversationContext
+from db.world_cache import get_world_state
+from world_tools import execute_tool_calls, unit_of_work, toolset
+from utils import llm_async
 
 NPC_SIMULATION_LIMIT = 5
-
-def run_simulation_pass(db: DBSession, session_id: int):
+# "per_npc": one reasoning call + one tool call per NPC (awaited concurrently).
+# "batched": a single structured request covering every NPC, sharing one copy of the context.
+SIMULATION_MODES = ("per_npc", "batched")
+SIMULATION_MODE = os.getenv("SIMULATION_MODE", "per_npc")
+SIMULATION_TOOLS = ("update_npc_status", "update_quest_status", "create_rumor", "set_world_flag")
+SIMULATION_TOOLSET = toolset(*SIMULATION_TOOLS)
+# How many NPCs are reasoned about at once. Each NPC costs one GPT-4o and one Gemini call;
+# rate limits and retries are handled by the clients (utils/resilience.py).
+SIMULATION_CONCURRENCY = int(os.getenv("SIMULATION_CONCURRENCY", "5"))
+
+async def _plan_npc_action(npc: dict, context_text: str):
     """
-    Runs a per-NPC simulation pass. Each key NPC gets a "turn" to act based on
-    their individual motivation and the recent actions of the player.
+    Decides one NPC's background action. Makes no database calls, so any number can be awaited at once.
+    Returns (action_description, tool_calls).
     """
-    print("\n--- Running Per-NPC Simulation Pass ---")
+    prompt = f"""
+You are simulating the off-screen actions for a single NPC in an RPG.
 
-    recent_turns = db.query(Turn).filter_by(session_id=session_id)\
-        .order_by(desc(Turn.turn_number)).limit(5).all()
-    context_text = "\n".join(
-        f"Turn {t.turn_number}: Player - {t.player_input.strip()} / GM - {t.gm_response.strip()}"
-        for t in reversed(recent_turns)
-    )
+**Game World Key:**
+- Power Level Scale: 1 (Child) to 100 (God-like Entity).
 
-    key_npcs = (
-        db.query(NPC)
-        .join(ConversationContext, NPC.id == ConversationContext.npc_id)
-        .filter(NPC.session_id == session_id)
-        .order_by(desc(ConversationContext.last_updated))
-        .limit(NPC_SIMULATION_LIMIT)
-        .all()
-    )
+**NPC Profile:**
+- Name: {npc['name']}
+- Role: {npc['role']}
+- Status: {npc['status']}
+- Motivation: "{npc['motivation']}"
+- Power Level: {npc['power_level']}
 
-    if not key_npcs:
-        print("No recently interacted-with NPCs found. Falling back to most recently created NPCs.")
-        key_npcs = db.query(NPC).filter_by(session_id=session_id)\
-            .order_by(desc(NPC.id)).limit(NPC_SIMULATION_LIMIT).all()
+**Recent Game Events:**
+{context_text}
 
-    if not key_npcs:
-        print("No key NPCs found to simulate.")
-        print("--- Simulation Pass Complete ---")
-        return
+Based on the NPC's profile and the recent events, what is a single, significant action they have taken in the background? A higher power level NPC should be capable of more impactful actions. Describe it in one sentence. For example: "The guard captain (Power: 55) has doubled the patrols near the old warehouse." If they have not done anything noteworthy, just say "No significant action."
+"""
+    npc_action_description = await acall_chat_model([{"role": "user", "content": prompt}], model="gpt4o")
 
-    print(f"Simulating agency for {len(key_npcs)} key NPC(s)...")
+    if "no significant action" in npc_action_description.lower():
+        return npc_action_description, []
 
-    for npc in key_npcs:
-        print(f"\n  > Simulating for: {npc.name} (Motivation: {npc.motivation})")
+    tool_prompt = f"""
+    An NPC has taken a background action. Based on the description below, call the most appropriate tool to update the game state.
 
-        prompt = f"""
-You are simulating the off-screen actions for a single NPC in an RPG.
+    Action Description: "{npc_action_description}"
+
+    Available Tools: `update_npc_status`, `update_quest_status`, `create_rumor`, `set_world_flag`.
+    """
+    tool_calls = await acall_gemini_with_tools(
+        None, None, tool_prompt, model_name='gemini-2.5-flash',
+        tools=SIMULATION_TOOLSET, return_tool_calls=True
+    )
+    return npc_action_description, tool_calls if isinstance(tool_calls, list) else []
+
+async def _plan_per_npc(profiles: list, context_text: str) -> list:
+    """
+    Plans every NPC's action with its own requests, concurrently.
+    Returns one (description, tool_calls) pair per profile, or an Exception if that NPC failed.
+    """
+    limit = asyncio.Semaphore(max(1, SIMULATION_CONCURRENCY))
+
+    async def plan(npc):
+        async with limit:
+            return await _plan_npc_action(npc, context_text)
+
+    return list(await asyncio.gather(*(plan(npc) for npc in profiles), return_exceptions=True))
+
+async def _plan_batched(profiles: list, context_text: str) -> list:
+    """
+    Plans every NPC's action in one request that returns a JSON array of actions.
+    Returns one (description, tool_calls) pair per profile, like _plan_per_npc.
+    """
+    npc_section = "\n".join(
+        f"- Name: {npc['name']} | Role: {npc['role']} | Status: {npc['status']} | "
+        f"Power Level: {npc['power_level']} | Motivation: \"{npc['motivation']}\""
+        for npc in profiles
+    )
+    prompt = f"""
+You are simulating the off-screen actions for several NPCs in an RPG.
 
 **Game World Key:**
 - Power Level Scale: 1 (Child) to 100 (God-like Entity).
 
-**NPC Profile:**
-- Name: {npc.name}
-- Role: {npc.role}
-- Status: {npc.status}
-- Motivation: "{npc.motivation}"
-- Power Level: {npc.power_level}
+**NPC Profiles:**
+{npc_section}
 
 **Recent Game Events:**
 {context_text}
 
-Based on the NPC's profile and the recent events, what is a single, significant action they have taken in the background? A higher power level NPC should be capable of more impactful actions. Describe it in one sentence. For example: "The guard captain (Power: 55) has doubled the patrols near the old warehouse." If they have not done anything noteworthy, just say "No significant action."
+For EACH NPC above, decide on a single, significant action they have taken in the background, based on their profile and the recent events. A higher power level NPC should be capable of more impactful actions. If an NPC has not done anything noteworthy, give them no tool calls.
+
+Express each action as tool calls using only these tools:
+- `update_npc_status` args: {{"npc_name": str, "new_status": str, "reason": str}}
+- `update_quest_status` args: {{"quest_name": str, "new_status": str, "reason": str}}
+- `create_rumor` args: {{"rumor_content": str, "is_confirmed": bool}}
+- `set_world_flag` args: {{"key": str, "value": str, "reason": str}}
+
+You MUST respond with ONLY a JSON array with one object per NPC, in the order listed:
+[{{"npc": "<name>", "action": "<one sentence, or 'No significant action.'>", "tool_calls": [{{"name": "<tool>", "args": {{...}}}}]}}]
 """
-        print("\n--- Simulating NPC Actions (GPT-4o) ---")
-        npc_action_description = call_chat_model([{"role": "user", "content": prompt}], model="gpt4o")
-
-        if "no significant action" not in npc_action_description.lower():
-            tool_prompt = f"""
-            An NPC has taken a background action. Based on the description below, call the most appropriate tool to update the game state.
-
-            Action Description: "{npc_action_description}"
-            
-            Available Tools: `update_npc_status`, `update_quest_status`, `create_rumor`, `set_world_flag`.
-            """
-            npc_action_response = call_gemini_with_tools(db, session_id, tool_prompt, model_name='gemini-2.5-flash', return_after_tools=True)
-            print(f"    Result for {npc.name}: {npc_action_response}")
-        else:
-            print(f"    Result for {npc.name}: No significant actions taken.")
+    response = await acall_chat_model([{"role": "user", "content": prompt}], model="gpt4o")
+
+    try:
+        match = re.search(r"\[.*\]", response, re.DOTALL)
+        if not match:
+            raise json.JSONDecodeError("No JSON array found in the response.", response, 0)
+        entries = json.loads(match.group(0))
+    except json.JSONDecodeError:
+        print(f"ERROR: Batched simulation did not return valid JSON. Response:\n{response}")
+        return [(None, []) for _ in profiles]
+
+    by_name = {
+        str(entry.get("npc", "")).strip().lower(): entry
+        for entry in entries if isinstance(entry, dict)
+    }
+    plans = []
+    for npc in profiles:
+        entry = by_name.get(str(npc["name"] or "").strip().lower(), {})
+        tool_calls = [
+            call for call in entry.get("tool_calls") or []
+            if isinstance(call, dict) and call.get("name") in SIMULATION_TOOLS
+        ]
+        plans.append((entry.get("action"), tool_calls))
+    return plans
+
+def run_simulation_pass(db: DBSession, session_id: int, mode: str = None):
+    """
+    Runs a per-NPC simulation pass. Each key NPC gets a "turn" to act based on
+    their individual motivation and the recent actions of the player.
+    The NPCs are planned either concurrently or in one batched request (see SIMULATION_MODE);
+    their tool calls are then applied one NPC at a time, in the order the NPCs were selected.
+    """
+    return llm_async.run(arun_simulation_pass(db, session_id, mode))
 
+async def arun_simulation_pass(db: DBSession, session_id: int, mode: str = None):
+    """
+    Async version of run_simulation_pass, for the shared LLM loop. Its database reads and
+    writes run in a worker thread (asyncio.to_thread), so they don't hold up the other
+    requests on the loop; db must not be used by anything else until the pass returns.
+    """
+    profiles, plans = await aplan_simulation_pass(db, session_id, mode)
+    await asyncio.to_thread(apply_simulation_plans, db, session_id, profiles, plans)
     print("\n--- Simulation Pass Complete ---")
+
+async def aplan_simulation_pass(db: DBSession, session_id: int, mode: str = None):
+    """
+    The model half of the pass: picks the key NPCs and plans their actions without writing
+    anything. Returns (profiles, plans) for apply_simulation_plans; both empty if there is
+    no NPC to simulate.
+    """
+    mode = mode or SIMULATION_MODE
+    if mode not in SIMULATION_MODES:
+        raise ValueError(f"Unknown simulation mode '{mode}'. Expected one of {SIMULATION_MODES}.")
+
+    print("\n--- Running Per-NPC Simulation Pass ---")
+
+    context_text, profiles = await asyncio.to_thread(_select_key_npcs, db, session_id)
+    if not profiles:
+        print("No key NPCs found to simulate.")
+        return [], []
+
+    print(f"Simulating agency for {len(profiles)} key NPC(s) ({mode})...")
+
+    if mode == "batched":
+        plans = await _plan_batched(profiles, context_text)
+    else:
+        plans = await _plan_per_npc(profiles, context_text)
+    return profiles, plans
+
+def _select_key_npcs(db: DBSession, session_id: int):
+    """
+    Returns (recent events text, profiles of the NPCs to simulate). The profiles are plain
+    dicts, so nothing from the session is held while the NPCs are planned.
+    """
+    recent_turns = db.query(Turn).filter_by(session_id=session_id)\
+        .order_by(desc(Turn.turn_number)).limit(5).all()
+    context_text = "\n".join(
+        f"Turn {t.turn_number}: Player - {t.player_input.strip()} / GM - {t.gm_response.strip()}"
+        for t in reversed(recent_turns)
+    )
+
+    # NPC rows come from the world-state cache; only the conversation order is queried.
+    npcs_by_id = {n["id"]: n for n in get_world_state(db, session_id)["npcs"]}
+    recent_npc_ids = db.query(ConversationContext.npc_id)\
+        .filter(ConversationContext.session_id == session_id)\
+        .order_by(desc(ConversationContext.last_updated)).all()
+    key_npcs = [npcs_by_id[npc_id] for (npc_id,) in recent_npc_ids if npc_id in npcs_by_id][:NPC_SIMULATION_LIMIT]
+
+    if not key_npcs:
+        print("No recently interacted-with NPCs found. Falling back to most recently created NPCs.")
+        key_npcs = sorted(npcs_by_id.values(), key=lambda n: n["id"], reverse=True)[:NPC_SIMULATION_LIMIT]
+
+    profiles = [
+        {"name": n["name"], "role": n["role"], "status": n["status"], "motivation": n["motivation"], "power_level": n["power_level"]}
+        for n in key_npcs
+    ]
+    return context_text, profiles
+
+def apply_simulation_plans(db: DBSession, session_id: int, profiles: list, plans: list):
+    """
+    Applies aplan_simulation_pass's plans, one NPC at a time, in the order the NPCs were selected.
+    """
+    # One transaction for the whole pass: a savepoint per tool call, one commit at the end.
+    with unit_of_work(db):
+        for npc, plan in zip(profiles, plans):
+            print(f"\n  > Simulating for: {npc['name']} (Motivation: {npc['motivation']})")
+            if isinstance(plan, Exception):
+                print(f"    Result for {npc['name']}: Simulation failed ({plan}).")
+                continue
+            description, tool_calls = plan
+
+            if not tool_calls:
+                print(f"    Result for {npc['name']}: No significant actions taken.")
+                continue
+
+            results = execute_tool_calls(db, session_id, tool_calls)
+            print(f"    Result for {npc['name']}: {[r['result'] for r in results]}")
@@ -27,7 +27,9 @@ Summary:"""
         ],
         model="gpt35",
         temperature=0.3,
-        max_tokens=100
+        max_tokens=100,
+        # The same turn summarized again (retries, rebuilt memories) reuses the summary.
+        cache=True
     )
 
     return response.strip()
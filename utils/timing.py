@@ -0,0 +1,36 @@
+# utils/timing.py
+
+import threading
+import time
+from contextlib import contextmanager
+from utils.tracing import record_span
+
+class StageTimer:
+    """
+    Collects wall-clock timings (in milliseconds) for the named stages of one operation,
+    e.g. the retrieval pipeline for a single turn. Stages may be timed from several threads.
+    Each recorded stage is also added to the active trace, if any (see utils/tracing.py).
+    """
+    def __init__(self):
+        self.timings = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - start) * 1000)
+
+    def record(self, name: str, elapsed_ms: float):
+        with self._lock:
+            self.timings[name] = self.timings.get(name, 0.0) + elapsed_ms
+        record_span(name, elapsed_ms)
+
+    def total_ms(self) -> float:
+        return sum(self.timings.values())
+
+    def report(self, label: str):
+        stages = ", ".join(f"{name}={ms:.1f}ms" for name, ms in self.timings.items())
+        print(f"[timing] {label}: {stages or 'no stages'} (total {self.total_ms():.1f}ms)")
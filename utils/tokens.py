@@ -0,0 +1,8 @@
+# utils/tokens.py
+
+def approx_tokens(text) -> int:
+    """
+    Token estimate for when no tokenizer is at hand (prompt budgets, synthetic usage).
+    """
+    # Roughly four characters per token for English prose.
+    return len(text) // 4 + 1 if text else 0
@@ -0,0 +1,235 @@
+# utils/tracing.py
+
+"""
+Structured spans for one turn: every LLM call, embedding, FAISS search and DB statement
+made while a trace is active is recorded with its duration, model, token counts and
+tool-call count. At the end of the turn the spans are aggregated per (stage, model)
+into the turn_metrics table, keyed to turns.id.
+
+Stage-level p50/p95 across a campaign:
+
+    python -m utils.tracing --session 1
+"""
+
+import argparse
+import contextvars
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+from sqlalchemy import event, inspect
+
+# Ensure root directory is in path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from db.schema import TurnMetric
+
+_current_trace = contextvars.ContextVar("gm_trace", default=None)
+
+class TurnTrace:
+    """
+    The spans recorded for one turn (or one background job). Spans may be added from
+    several threads, as long as those threads were started with submit_traced.
+    """
+    def __init__(self, session_id: int):
+        self.session_id = session_id
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span: dict):
+        with self._lock:
+            self.spans.append(span)
+
+    def summarize(self) -> list[dict]:
+        """
+        Aggregates the spans per (stage, model).
+        """
+        with self._lock:
+            spans = list(self.spans)
+        rows = {}
+        for span in spans:
+            row = rows.setdefault((span["stage"], span["model"]), {
+                "stage": span["stage"],
+                "model": span["model"],
+                "span_count": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "prompt_tokens": 0,
+                "response_tokens": 0,
+                "tool_calls": 0,
+            })
+            row["span_count"] += 1
+            row["total_ms"] += span["duration_ms"]
+            row["max_ms"] = max(row["max_ms"], span["duration_ms"])
+            row["prompt_tokens"] += span["prompt_tokens"] or 0
+            row["response_tokens"] += span["response_tokens"] or 0
+            row["tool_calls"] += span["tool_calls"] or 0
+        return list(rows.values())
+
+def _new_span(stage: str, model: str = None) -> dict:
+    return {
+        "stage": stage,
+        "model": model,
+        "duration_ms": 0.0,
+        "prompt_tokens": None,
+        "response_tokens": None,
+        "tool_calls": 0,
+    }
+
+def current_trace():
+    return _current_trace.get()
+
+@contextmanager
+def start_trace(session_id: int):
+    """
+    Makes a new TurnTrace the active trace for the block and yields it.
+    """
+    trace = TurnTrace(session_id)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        try:
+            _current_trace.reset(token)
+        except ValueError:
+            # A streamed turn that is abandoned mid-way is closed from another context.
+            pass
+
+@contextmanager
+def span(stage: str, model: str = None):
+    """
+    Times the block as a span of the active trace. Yields the span dict, so the caller
+    can fill in prompt_tokens, response_tokens and tool_calls. Without an active trace
+    the span is simply discarded.
+    """
+    trace = _current_trace.get()
+    record = _new_span(stage, model)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["duration_ms"] = (time.perf_counter() - start) * 1000
+        if trace is not None:
+            trace.add(record)
+
+def record_span(stage: str, duration_ms: float, model: str = None):
+    trace = _current_trace.get()
+    if trace is not None:
+        record = _new_span(stage, model)
+        record["duration_ms"] = duration_ms
+        trace.add(record)
+
+def submit_traced(executor, func, *args, **kwargs):
+    """
+    executor.submit, but func runs in a copy of the caller's context, so its spans
+    land in the caller's trace.
+    """
+    return executor.submit(contextvars.copy_context().run, func, *args, **kwargs)
+
+def instrument_engine(engine):
+    """
+    Records every SQL statement executed on the engine as a "db.query" span.
+    """
+    @event.listens_for(engine, "before_cursor_execute")
+    def _start_query(conn, cursor, statement, parameters, context, executemany):
+        context._gm_query_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _end_query(conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, "_gm_query_start", None)
+        if start is not None:
+            record_span("db.query", (time.perf_counter() - start) * 1000)
+
+    return engine
+
+# --- Persistence ---
+
+_table_ready = set()
+
+def save_turn_metrics(db, turn_id: int, trace: TurnTrace):
+    """
+    Adds the trace's per-stage aggregates for the turn to the session (the caller commits).
+    """
+    connection = db.connection()
+    url = str(connection.engine.url)
+    if url not in _table_ready:
+        # Databases created before turn_metrics existed. Created on the session's own
+        # connection, since it may already hold SQLite's write lock.
+        TurnMetric.__table__.create(connection, checkfirst=True)
+        _table_ready.add(url)
+    for row in trace.summarize():
+        db.add(TurnMetric(turn_id=turn_id, session_id=trace.session_id, **row))
+
+# --- Report ---
+
+def stage_percentiles(db, session_id: int = None) -> list[dict]:
+    """
+    Per (stage, model): p50/p95 of the per-turn time spent in the stage, across turns,
+    plus the average token and tool-call counts per turn.
+    """
+    if not inspect(db.get_bind()).has_table(TurnMetric.__tablename__):
+        return []
+    query = db.query(TurnMetric)
+    if session_id is not None:
+        query = query.filter_by(session_id=session_id)
+
+    # A turn can have several rows per stage (the turn itself and its background job),
+    # so rows are summed per turn first and each turn is one sample.
+    per_turn = {}
+    for metric in query.all():
+        totals = per_turn.setdefault((metric.stage, metric.model, metric.turn_id), {
+            "spans": 0, "total_ms": 0.0, "prompt_tokens": 0, "response_tokens": 0, "tool_calls": 0,
+        })
+        totals["spans"] += metric.span_count
+        totals["total_ms"] += metric.total_ms
+        totals["prompt_tokens"] += metric.prompt_tokens or 0
+        totals["response_tokens"] += metric.response_tokens or 0
+        totals["tool_calls"] += metric.tool_calls or 0
+
+    per_stage = {}
+    for (stage, model, _), totals in per_turn.items():
+        per_stage.setdefault((stage, model), []).append(totals)
+
+    report = []
+    for (stage, model), turns in sorted(per_stage.items(), key=lambda item: (item[0][0], item[0][1] or "")):
+        totals = np.array([t["total_ms"] for t in turns])
+        report.append({
+            "stage": stage,
+            "model": model,
+            "turns": len(turns),
+            "spans": sum(t["spans"] for t in turns),
+            "p50_ms": float(np.percentile(totals, 50)),
+            "p95_ms": float(np.percentile(totals, 95)),
+            "avg_prompt_tokens": sum(t["prompt_tokens"] for t in turns) / len(turns),
+            "avg_response_tokens": sum(t["response_tokens"] for t in turns) / len(turns),
+            "avg_tool_calls": sum(t["tool_calls"] for t in turns) / len(turns),
+        })
+    return report
+
+def print_report(db, session_id: int = None):
+    rows = stage_percentiles(db, session_id)
+    if not rows:
+        print("No turn metrics recorded yet.")
+        return
+    print(f"{'stage':<28} {'model':<22} {'turns':>6} {'spans':>7} {'p50 ms':>9} {'p95 ms':>9} {'prompt tok':>11} {'resp tok':>9} {'tools':>6}")
+    for row in rows:
+        print(
+            f"{row['stage']:<28} {row['model'] or '-':<22} {row['turns']:>6} {row['spans']:>7} "
+            f"{row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['avg_prompt_tokens']:>11.0f} "
+            f"{row['avg_response_tokens']:>9.0f} {row['avg_tool_calls']:>6.1f}"
+        )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-stage latency report from the turn_metrics table.")
+    parser.add_argument("--session", type=int, default=None, help="Session id (default: all sessions).")
+    args = parser.parse_args()
+
+    from db.engine import get_session
+    db = get_session()
+    try:
+        print_report(db, args.session)
+    finally:
+        db.close()
@@ -1,10 +1,56 @@
 # world_tools.py
 
+import json
+import time
+from contextlib import contextmanager, nullcontext
 from sqlalchemy.orm import Session as DBSession
 from db.schema import Quest, NPC, WorldFlag, Rumor, PlayerState, JournalEntry, ConversationContext, Session as SessionModel
+from db.world_cache import invalidate_world_state
+from utils.tracing import record_span
 from datetime import datetime
 from google.generativeai.types import FunctionDeclaration, Tool
 
+# =====================================================================================
+# UNIT OF WORK
+# =====================================================================================
+
+def _commit(db_session: DBSession):
+    """
+    Handlers commit through this. Inside a unit of work their changes are only flushed,
+    and the unit of work commits them all at once.
+    """
+    if db_session.info.get("unit_of_work_depth"):
+        db_session.flush()
+    else:
+        db_session.commit()
+
+def _rollback(db_session: DBSession):
+    """
+    Inside a unit of work the executor rolls the failed call's savepoint back instead.
+    """
+    if not db_session.info.get("unit_of_work_depth"):
+        db_session.rollback()
+
+@contextmanager
+def unit_of_work(db_session: DBSession):
+    """
+    Applies every handler call made in the block in one transaction: a single commit when
+    the outermost block exits cleanly, a rollback of all of it if the block raises.
+    Blocks can be nested; only the outermost one commits.
+    """
+    depth = db_session.info.get("unit_of_work_depth", 0)
+    db_session.info["unit_of_work_depth"] = depth + 1
+    try:
+        yield db_session
+        if depth == 0:
+            db_session.commit()
+    except Exception:
+        if depth == 0:
+            db_session.rollback()
+        raise
+    finally:
+        db_session.info["unit_of_work_depth"] = depth
+
 # =====================================================================================
 # FUNCTION DEFINITIONS
 # =====================================================================================
@@ -17,7 +63,8 @@ def update_quest_status(db_session: DBSession, session_id: int, quest_name: str,
         quest = db_session.query(Quest).filter_by(session_id=session_id, name=quest_name).first()
         if quest:
             quest.status = new_status
-            db_session.commit()
+            invalidate_world_state(session_id, "quests", db=db_session)
+            _commit(db_session)
             return f"Success: Quest '{quest_name}' status changed to '{new_status}' because: {reason}"
         return f"Error: Quest '{quest_name}' not found. No action was taken."
     except Exception as e:
@@ -32,7 +79,8 @@ def update_npc_status(db_session: DBSession, session_id: int, npc_name: str, new
     npc = db_session.query(NPC).filter_by(session_id=session_id, name=npc_name).first()
     if npc:
         npc.status = new_status
-        db_session.commit()
+        invalidate_world_state(session_id, "npcs", db=db_session)
+        _commit(db_session)
         return f"Success: NPC '{npc_name}' status changed to '{new_status}' because: {reason}"
     return f"Error: NPC '{npc_name}' not found."
 
@@ -47,7 +95,7 @@ def create_rumor(db_session: DBSession, session_id: int, rumor_content: str, is_
         is_confirmed=is_confirmed
     )
     db_session.add(new_rumor)
-    db_session.commit()
+    _commit(db_session)
     return f"Success: A new rumor was started: '{rumor_content}'."
 
 def set_world_flag(db_session: DBSession, session_id: int, key: str, value: str, reason: str):
@@ -61,7 +109,8 @@ def set_world_flag(db_session: DBSession, session_id: int, key: str, value: str,
     else:
         flag = WorldFlag(session_id=session_id, key=key, value=value)
         db_session.add(flag)
-    db_session.commit()
+    invalidate_world_state(session_id, "flags", db=db_session)
+    _commit(db_session)
     return f"Success: World flag '{key}' set to '{value}' because: {reason}."
 
 def update_player_character(db_session: DBSession, session_id: int, skill_updates: dict = None, new_inventory_items: list = None, new_limitations: list = None):
@@ -89,7 +138,7 @@ def update_player_character(db_session: DBSession, session_id: int, skill_update
         current_limitations.extend(l for l in new_limitations if l not in current_limitations)
         player.limitations = current_limitations
 
-    db_session.commit()
+    _commit(db_session)
     return f"Success: Player state updated. Skills: {skill_updates}, Items: {new_inventory_items}, Limitations: {new_limitations}"
 
 def create_journal_entry(db_session: DBSession, session_id: int, turn_number: int, summary_text: str):
@@ -104,7 +153,7 @@ def create_journal_entry(db_session: DBSession, session_id: int, turn_number: in
         timestamp=datetime.utcnow()
     )
     db_session.add(entry)
-    db_session.commit()
+    _commit(db_session)
     return f"Success: Journal entry created for turn {turn_number}."
 
 def update_npc_motivation(db_session: DBSession, session_id: int, npc_name: str, new_motivation: str, reason: str):
@@ -115,7 +164,8 @@ def update_npc_motivation(db_session: DBSession, session_id: int, npc_name: str,
     npc = db_session.query(NPC).filter_by(session_id=session_id, name=npc_name).first()
     if npc:
         npc.motivation = new_motivation
-        db_session.commit()
+        invalidate_world_state(session_id, "npcs", db=db_session)
+        _commit(db_session)
         return f"Success: NPC '{npc_name}' motivation changed to '{new_motivation}' because: {reason}"
     return f"Error: NPC '{npc_name}' not found."
 
@@ -127,7 +177,8 @@ def update_npc_power_level(db_session: DBSession, session_id: int, npc_name: str
     npc = db_session.query(NPC).filter_by(session_id=session_id, name=npc_name).first()
     if npc:
         npc.power_level = new_power_level
-        db_session.commit()
+        invalidate_world_state(session_id, "npcs", db=db_session)
+        _commit(db_session)
         return f"Success: NPC '{npc_name}' power level changed to '{new_power_level}' because: {reason}"
     return f"Error: NPC '{npc_name}' not found."
 
@@ -139,7 +190,8 @@ def update_npc_combat_style(db_session: DBSession, session_id: int, npc_name: st
     npc = db_session.query(NPC).filter_by(session_id=session_id, name=npc_name).first()
     if npc:
         npc.combat_style = new_combat_style
-        db_session.commit()
+        invalidate_world_state(session_id, "npcs", db=db_session)
+        _commit(db_session)
         return f"Success: NPC '{npc_name}' combat style changed to '{new_combat_style}' because: {reason}"
     return f"Error: NPC '{npc_name}' not found."
 
@@ -151,7 +203,7 @@ def finalize_character_and_world(db_session: DBSession, genre: str, tone: str, w
     try:
         new_session = SessionModel(genre=genre, tone=tone, world_intro=world_intro, realism=False, power_fantasy=False)
         db_session.add(new_session)
-        db_session.commit()
+        _commit(db_session)
 
         final_attributes = dict(attributes)
         final_skills = dict(skills)
@@ -168,10 +220,10 @@ def finalize_character_and_world(db_session: DBSession, genre: str, tone: str, w
             limitations=[]
         )
         db_session.add(player)
-        db_session.commit()
+        _commit(db_session)
         return f"Success: World and character for {player_name} have been created. The adventure can now begin! New session ID is {new_session.id}"
     except Exception as e:
-        db_session.rollback()
+        _rollback(db_session)
         print(f"ERROR in finalize_character_and_world: {e}")
         return f"Error finalizing character: {e}"
 
@@ -183,7 +235,8 @@ def save_dialogue_context(db_session: DBSession, session_id: int, npc_name: str,
     if not npc:
         npc = NPC(session_id=session_id, name=npc_name, role="Unknown", motivation="Unknown", status="active", power_level=15, combat_style="Unknown")
         db_session.add(npc)
-        db_session.commit()
+        invalidate_world_state(session_id, "npcs", db=db_session)
+        _commit(db_session)
 
     context = db_session.query(ConversationContext).filter_by(session_id=session_id, npc_id=npc.id).first()
     if context:
@@ -199,7 +252,7 @@ def save_dialogue_context(db_session: DBSession, session_id: int, npc_name: str,
             last_updated=datetime.utcnow()
         )
         db_session.add(context)
-    db_session.commit()
+    _commit(db_session)
     return f"Success: Dialogue context with {npc_name} saved."
 
 def select_relevant_memories(memory_indices: list[int]):
@@ -314,3 +367,141 @@ FUNCTION_HANDLERS = {
     "save_dialogue_context": save_dialogue_context,
     "select_relevant_memories": select_relevant_memories,
 }
+
+# Narrowed toolsets: each call site declares only the tools it can use, which keeps the
+# schema sent with every request (and the model's choice) small.
+def toolset(*names: str) -> list:
+    """
+    Returns the WORLD_TOOLS_LIST entries for the named tools, in that order.
+    """
+    by_name = {fd.name: tool for tool in WORLD_TOOLS_LIST for fd in tool.function_declarations}
+    return [by_name[name] for name in names]
+
+# What the logic engine may change during play.
+LOGIC_ENGINE_TOOLS = toolset(
+    "update_quest_status", "update_npc_status", "create_rumor", "set_world_flag", "update_player_character",
+    "create_journal_entry", "update_npc_motivation", "update_npc_power_level", "update_npc_combat_style",
+    "save_dialogue_context",
+)
+PROGRESSION_TOOLS = toolset("update_player_character")
+DIALOGUE_TOOLS = toolset("save_dialogue_context")
+RELEVANCE_TOOLS = toolset("select_relevant_memories")
+SESSION_ZERO_TOOLS = toolset("finalize_character_and_world")
+
+# The rows each handler touches: (table, the argument naming the row). A None argument
+# means the call inserts a new row or touches the session's only row; a None table means
+# the handler doesn't use the database at all (and needs no savepoint).
+TOOL_FOOTPRINTS = {
+    "update_quest_status": ("quests", "quest_name"),
+    "update_npc_status": ("npcs", "npc_name"),
+    "create_rumor": ("rumors", None),
+    "set_world_flag": ("world_flags", "key"),
+    "update_player_character": ("player_state", None),
+    "create_journal_entry": ("journal_entries", None),
+    "update_npc_motivation": ("npcs", "npc_name"),
+    "update_npc_power_level": ("npcs", "npc_name"),
+    "update_npc_combat_style": ("npcs", "npc_name"),
+    "finalize_character_and_world": ("sessions", None),
+    "save_dialogue_context": ("conversation_contexts", "npc_name"),
+    "select_relevant_memories": (None, None),
+}
+
+# Tools that don't take the database session / session id arguments.
+TOOLS_WITHOUT_DB = {name for name, (table, _) in TOOL_FOOTPRINTS.items() if table is None}
+TOOLS_WITHOUT_SESSION_ID = {'select_relevant_memories', 'finalize_character_and_world'}
+
+def tool_footprint(name: str, args: dict) -> str:
+    """
+    The rows a call touches, e.g. "npcs:Mara" or "rumors"; "" if it doesn't use the database.
+    """
+    table, key_arg = TOOL_FOOTPRINTS.get(name, (None, None))
+    if table is None:
+        return ""
+    return f"{table}:{args.get(key_arg)}" if key_arg else table
+
+def _call_key(name: str, args: dict) -> str:
+    return json.dumps([name, args], sort_keys=True, default=str)
+
+def _execute_one(db_session: DBSession, session_id: int, tool_call: dict, turn_number: int, seen: dict) -> dict:
+    func_name = tool_call.get("name")
+    args = dict(tool_call.get("args") or {})
+    record = {"name": func_name, "args": args, "ok": False, "result": None,
+              "rows": tool_footprint(func_name, args), "duration_ms": 0.0, "duplicate": False}
+
+    if func_name not in FUNCTION_HANDLERS:
+        print(f"Warning: Tried to call unknown tool '{func_name}'")
+        record["result"] = "Error: Tool not found."
+        return record
+
+    if db_session is None and func_name not in TOOLS_WITHOUT_DB:
+        print(f"Warning: Tried to call '{func_name}' without a database session")
+        record["result"] = f"Error: {func_name} needs a database session."
+        return record
+
+    # The same call again (a model repeating itself) gets the first result instead of
+    # being applied twice.
+    key = _call_key(func_name, args)
+    if key in seen:
+        record.update(ok=True, result=seen[key][1], duplicate=True)
+        return record
+
+    call_args = dict(args)
+    if func_name not in TOOLS_WITHOUT_DB:
+        call_args['db_session'] = db_session
+    if func_name not in TOOLS_WITHOUT_SESSION_ID:
+        call_args['session_id'] = session_id
+    if func_name == 'create_journal_entry' and 'turn_number' not in call_args and turn_number is not None:
+        call_args['turn_number'] = turn_number
+
+    savepoint = db_session.begin_nested() if func_name not in TOOLS_WITHOUT_DB else None
+    start = time.perf_counter()
+    try:
+        print(f"Executing tool: {func_name} with args: {args}")
+        result = FUNCTION_HANDLERS[func_name](**call_args)
+        ok = not str(result).startswith("Error")
+    except Exception as e:
+        print(f"ERROR executing tool {func_name}: {e}")
+        result, ok = f"Error: {e}", False
+    if savepoint is not None:
+        if ok:
+            savepoint.commit()
+        else:
+            savepoint.rollback()
+    record["duration_ms"] = (time.perf_counter() - start) * 1000
+    record_span("tool", record["duration_ms"], model=func_name)
+
+    if ok:
+        # A different write to the same rows means repeating an earlier call is no
+        # longer a no-op (e.g. an NPC marked dead, then alive, then dead again).
+        if record["rows"]:
+            for other in [k for k, (rows, _) in seen.items() if rows == record["rows"]]:
+                del seen[other]
+        seen[key] = (record["rows"], result)
+    record.update(ok=ok, result=result)
+    return record
+
+def _timing_label(record: dict) -> str:
+    if record["duplicate"]:
+        return f"{record['name']} (duplicate)"
+    return f"{record['name']} {record['duration_ms']:.1f}ms"
+
+def execute_tool_calls(db_session: DBSession, session_id: int, tool_calls: list, turn_number: int = None, seen: dict = None) -> list:
+    """
+    Runs a list of {"name": ..., "args": {...}} tool calls in order, as one unit of work:
+    each database call gets its own savepoint and everything is committed once at the end.
+    A call that fails or returns an error is rolled back on its own; the others still apply.
+    A call identical (name and args) to one that already succeeded in this batch, or in
+    seen (pass the same dict to every batch of one conversation), is not run again and
+    gets the earlier result, marked as a duplicate. Each call is timed and traced as a
+    "tool" span. Returns one result per call:
+    {"name", "args", "ok", "result", "rows", "duration_ms", "duplicate"}.
+    """
+    seen = {} if seen is None else seen
+    results = []
+    with unit_of_work(db_session) if db_session is not None else nullcontext():
+        for tool_call in tool_calls:
+            results.append(_execute_one(db_session, session_id, tool_call, turn_number, seen))
+
+    if results:
+        print("Tool timings: " + ", ".join(_timing_label(r) for r in results))
+    return results